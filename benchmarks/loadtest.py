@@ -0,0 +1,237 @@
+"""
+Thundering-herd load test for pyramid_assetmutator.
+
+Spins up a sample Pyramid app whose view calls ``assetmutator_url`` for one of
+``--assets`` cold (never mutated) sources, using a slow stand-in mutator (a
+script which sleeps for ``--delay`` seconds before printing the source), and
+fires ``--requests`` concurrent requests at it from ``--threads`` threads in
+each of ``--processes`` processes. With the package installed (e.g. via
+``pip install -e .``), run it from the repository root::
+
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --processes 4 --threads 16 --json herd.json
+
+The report includes the number of mutator runs (compiles), the p50/p99 request
+latency and the duplicate-compile rate (the share of compiles which mutated an
+asset that had already been mutated by another compile). Pass
+``--compile-server`` to route all of the compiles through the host-wide compile
+server (see :mod:`pyramid_assetmutator.daemon`).
+"""
+import os
+import sys
+import json
+import signal
+import shutil
+import tempfile
+import argparse
+import threading
+import multiprocessing
+from timeit import default_timer
+
+from pyramid.config import Configurator
+from pyramid.request import Request
+
+from pyramid_assetmutator import AssetMutator
+from pyramid_assetmutator.daemon import CompileClient
+
+
+SLOW_MUTATOR = """\
+import os
+import sys
+import time
+
+delay, log, source = float(sys.argv[1]), sys.argv[2], sys.argv[3]
+time.sleep(delay)
+
+fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+os.write(fd, (source + '\\n').encode('utf-8'))
+os.close(fd)
+
+with open(source, 'rb') as f:
+    getattr(sys.stdout, 'buffer', sys.stdout).write(f.read())
+"""
+
+
+def get_command(root, options):
+    """
+    Returns the command of the stand-in mutator.
+    """
+    script = os.path.join(root, 'slowcat.py')
+    log = os.path.join(root, 'compiles.log')
+    return '%s %s %s %s' % (sys.executable, script, options.delay, log)
+
+def make_app(root, options, **settings):
+    """
+    Returns a WSGI app whose ``/<n>`` view returns the ``assetmutator_url`` of
+    the ``n``-th source in ``root``.
+    """
+    cmd = get_command(root, options)
+
+    settings.setdefault('assetmutator.remutate_check', 'stat')
+    if options.compile_server:
+        settings['assetmutator.compile_socket'] = os.path.join(root,
+                                                               'compile.sock')
+    config = Configurator(settings=settings)
+    config.include('pyramid_assetmutator')
+    config.assign_assetmutator('src', cmd, 'out')
+    config.add_static_view('static', root)
+
+    def view(request):
+        path = os.path.join(root, 'asset%s.src' % request.matchdict['n'])
+        helper = AssetMutator(request, {}).assetmutator_url
+        request.response.text = helper(path)
+        return request.response
+
+    config.add_route('asset', '/{n}')
+    config.add_view(view, route_name='asset')
+
+    return config.make_wsgi_app()
+
+def fire(app, options, offset):
+    """
+    Fires ``options.requests`` requests (spread over the assets) from
+    ``options.threads`` threads, and returns a ``(latencies, errors)`` tuple
+    of lists.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = [offset]
+
+    def work():
+        while True:
+            with lock:
+                if counter[0] >= offset + options.requests:
+                    return
+                n = counter[0] % options.assets
+                counter[0] += 1
+
+            start = default_timer()
+            response = Request.blank('/%s' % n).get_response(app)
+            elapsed = default_timer() - start
+
+            with lock:
+                if response.status_int == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(response.status)
+
+    threads = [threading.Thread(target=work) for _ in range(options.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, errors
+
+def run_process(root, options, offset, queue):
+    app = make_app(root, options)
+    queue.put(fire(app, options, offset))
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+def run(options):
+    root = tempfile.mkdtemp(prefix='assetmutator-herd-')
+
+    try:
+        with open(os.path.join(root, 'slowcat.py'), 'w') as f:
+            f.write(SLOW_MUTATOR)
+        for n in range(options.assets):
+            with open(os.path.join(root, 'asset%s.src' % n), 'w') as f:
+                f.write('asset %s\n' % n)
+
+        latencies = []
+        errors = []
+        start = default_timer()
+
+        if options.processes > 1:
+            queue = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(target=run_process,
+                                        args=(root, options, i, queue))
+                for i in range(options.processes)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process_latencies, process_errors = queue.get()
+                latencies.extend(process_latencies)
+                errors.extend(process_errors)
+            for process in processes:
+                process.join()
+        else:
+            latencies, errors = fire(make_app(root, options), options, 0)
+
+        elapsed = default_timer() - start
+
+        if options.compile_server:
+            client = CompileClient(os.path.join(root, 'compile.sock'),
+                                   autostart=False,
+                                   mutators={'src': get_command(root,
+                                                                options)})
+            os.kill(client.stats()['pid'], signal.SIGTERM)
+
+        try:
+            with open(os.path.join(root, 'compiles.log')) as f:
+                compiled = [line.strip() for line in f if line.strip()]
+        except IOError:
+            compiled = []
+    finally:
+        shutil.rmtree(root)
+
+    compiles = len(compiled)
+    duplicates = compiles - len(set(compiled))
+
+    return {
+        'requests': len(latencies) + len(errors),
+        'errors': len(errors),
+        'assets': options.assets,
+        'compiles': compiles,
+        'duplicate_compiles': duplicates,
+        'duplicate_compile_rate': duplicates / float(compiles or 1),
+        'p50_seconds': percentile(latencies, 50),
+        'p99_seconds': percentile(latencies, 99),
+        'elapsed_seconds': elapsed,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the pyramid_assetmutator thundering-herd load test.'
+    )
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Worker processes (default: 1).')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='Threads per process (default: 16).')
+    parser.add_argument('--requests', type=int, default=64,
+                        help='Requests per process (default: 64).')
+    parser.add_argument('--assets', type=int, default=4,
+                        help='Distinct cold assets (default: 4).')
+    parser.add_argument('--delay', type=float, default=0.5,
+                        help='Seconds the stand-in mutator sleeps for '
+                             '(default: 0.5).')
+    parser.add_argument('--compile-server', action='store_true',
+                        help='Run the compiles via the compile server.')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write the report to PATH as JSON.')
+    options = parser.parse_args(argv)
+
+    report = run(options)
+
+    for key in sorted(report):
+        value = report[key]
+        if isinstance(value, float):
+            sys.stdout.write('%-24s %12.4f\n' % (key, value))
+        else:
+            sys.stdout.write('%-24s %12s\n' % (key, value))
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Standalone benchmark runner for pyramid_assetmutator.
+
+Measures the per-render cost of the view helpers, ``Mutator`` construction,
+``compute_md5`` and ``each_boot`` batch throughput using a synthetic asset tree
+and the trivial ``cat`` mutator. With the package installed (e.g. via
+``pip install -e .``), run it from the repository root::
+
+    python benchmarks/run.py
+    python benchmarks/run.py --only helper --number 500 --json results.json
+
+Every benchmark is run ``--repeat`` times and the best (minimum) per-call time
+is reported, which is the most reproducible figure on a noisy machine.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+from timeit import default_timer
+
+from pyramid.config import Configurator
+from pyramid.request import Request
+
+from pyramid_assetmutator import AssetMutator
+from pyramid_assetmutator.mutator import Mutator
+from pyramid_assetmutator.utils import compute_md5
+
+
+CHECK_METHODS = ('exists', 'stat', 'checksum')
+MD5_SIZES = (1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+
+
+def timed(func, number, repeat, setup=None):
+    """
+    Calls ``func`` ``number`` times (``repeat`` rounds) and returns the best
+    per-call time in seconds. ``setup`` (if given) is called before every single
+    call and is excluded from the measurement.
+    """
+    best = None
+
+    for _ in range(repeat):
+        total = 0.0
+
+        for _ in range(number):
+            if setup is not None:
+                setup()
+            start = default_timer()
+            func()
+            total += default_timer() - start
+
+        per_call = total / number
+        best = per_call if best is None else min(best, per_call)
+
+    return best
+
+def make_app(root, **settings):
+    """
+    Returns a ``(registry, request)`` pair for a minimal app serving ``root``
+    as a static view and mutating ``.src`` files with ``cat``.
+    """
+    settings.setdefault('assetmutator.remutate_check', 'stat')
+    config = Configurator(settings=settings)
+    config.include('pyramid_assetmutator')
+    config.assign_assetmutator('src', 'cat', 'out')
+    config.add_static_view('static', root)
+    config.make_wsgi_app()
+
+    request = Request.blank('/')
+    request.registry = config.registry
+
+    return config.registry, request
+
+def write_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+def clear_outputs(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith('.out'):
+                os.unlink(os.path.join(dirpath, filename))
+
+
+def bench_helper(root, options):
+    results = []
+    source = os.path.join(root, 'helper.src')
+    write_file(source, 4096)
+
+    for check_method in CHECK_METHODS:
+        registry, request = make_app(
+            root, **{'assetmutator.remutate_check': check_method}
+        )
+        helper = AssetMutator(request, {}).assetmutator_url
+        call = lambda: helper(source)
+
+        # Cold: the mutated output has to be (re)generated for every call
+        cold = timed(call, max(1, options.number // 10), options.repeat,
+                     setup=lambda: clear_outputs(root))
+        results.append(('assetmutator_url[%s, cold]' % check_method, cold))
+
+        # Warm: the mutated output already exists
+        call()
+        warm = timed(call, options.number, options.repeat)
+        results.append(('assetmutator_url[%s, warm]' % check_method, warm))
+
+        clear_outputs(root)
+
+    return results
+
+def bench_construction(root, options):
+    results = []
+    source = os.path.join(root, 'construct.src')
+    write_file(source, 4096)
+
+    for check_method in CHECK_METHODS:
+        registry, request = make_app(
+            root, **{'assetmutator.remutate_check': check_method}
+        )
+        call = lambda: Mutator(request, source)
+        results.append(('Mutator()[%s]' % check_method,
+                        timed(call, options.number, options.repeat)))
+
+    return results
+
+def bench_md5(root, options):
+    results = []
+
+    for size in MD5_SIZES:
+        path = os.path.join(root, 'md5-%s.bin' % size)
+        write_file(path, size)
+        number = max(1, options.number * 1024 // size) if size > 1024 \
+                 else options.number
+        results.append(('compute_md5[%sKiB]' % (size // 1024),
+                        timed(lambda: compute_md5(path), number,
+                              options.repeat)))
+
+    return results
+
+def bench_each_boot(root, options):
+    tree = os.path.join(root, 'tree')
+    patterns = []
+
+    for dirnum in range(options.dirs):
+        dirpath = os.path.join(tree, 'd%s' % dirnum)
+        os.makedirs(dirpath)
+        patterns.append(os.path.join(dirpath, '*.src'))
+
+    for filenum in range(options.files):
+        write_file(os.path.join(tree, 'd%s' % (filenum % options.dirs),
+                                'f%s.src' % filenum), 256)
+
+    def boot():
+        make_app(tree, **{'assetmutator.each_request': 'false',
+                          'assetmutator.each_boot': '\n'.join(patterns)})
+
+    best = timed(boot, 1, options.repeat, setup=lambda: clear_outputs(tree))
+    shutil.rmtree(tree)
+
+    return [('each_boot[%s files]' % options.files, best),
+            ('each_boot[per file]', best / options.files)]
+
+
+BENCHMARKS = (
+    ('helper', bench_helper),
+    ('construction', bench_construction),
+    ('md5', bench_md5),
+    ('each_boot', bench_each_boot),
+)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the pyramid_assetmutator benchmarks.'
+    )
+    parser.add_argument('--only', action='append',
+                        choices=[name for name, _ in BENCHMARKS],
+                        help='Only run the specified benchmark(s).')
+    parser.add_argument('--number', type=int, default=200,
+                        help='Calls per round (default: 200).')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Rounds per benchmark (default: 3).')
+    parser.add_argument('--files', type=int, default=2000,
+                        help='Files in the each_boot tree (default: 2000).')
+    parser.add_argument('--dirs', type=int, default=20,
+                        help='Directories in the each_boot tree (default: 20).')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write the results to PATH as JSON.')
+    options = parser.parse_args(argv)
+
+    results = []
+    root = tempfile.mkdtemp(prefix='assetmutator-bench-')
+
+    try:
+        for name, bench in BENCHMARKS:
+            if options.only and name not in options.only:
+                continue
+            for label, seconds in bench(root, options):
+                results.append((label, seconds))
+                sys.stdout.write('%-40s %12.1f us\n' % (label, seconds * 1e6))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(root)
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(dict(results), f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
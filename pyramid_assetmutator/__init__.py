@@ -1,5 +1,7 @@
 import os
 import logging
+from functools import wraps
+from timeit import default_timer
 try:
     from collections import OrderedDict
 except ImportError:
@@ -7,11 +9,25 @@ except ImportError:
     from ordereddict import OrderedDict
 
 from pyramid.settings import asbool
+from pyramid.exceptions import ConfigurationError
+from pyramid.security import NO_PERMISSION_REQUIRED
 from pyramid.events import ApplicationCreated, BeforeRender
 from pyramid.threadlocal import get_current_request
+from pyramid.interfaces import IRendererFactory
 
-from pyramid_assetmutator.utils import as_string, as_list, get_abspath
-from pyramid_assetmutator.mutator import Mutator
+from pyramid_assetmutator.utils import as_string, as_list, get_abspath, \
+                                       get_output_abspath, get_pattern_matcher
+from pyramid_assetmutator.mutator import Mutator, mutate_all, \
+                                         mutate_variants
+from pyramid_assetmutator.bundle import Bundle
+from pyramid_assetmutator.index import SourceIndex
+from pyramid_assetmutator.scanner import TemplateScanner
+from pyramid_assetmutator.metrics import MemoryMetricsSink, metrics_view
+from pyramid_assetmutator.static import MutatedStaticView, DEFAULT_MAX_AGE
+from pyramid_assetmutator.warmup import Warmup, health_view
+from pyramid_assetmutator.state import BuildState, get_default_path
+from pyramid_assetmutator.scheduler import CompileScheduler
+from pyramid_assetmutator.profiling import BuildProfile, summarize
 
 
 __version__ = '1.0b1'
@@ -26,14 +42,31 @@ default_settings = (
     ('remutate_check', as_string, 'stat'),
     ('each_request', asbool, 'true'),
     ('each_boot', as_list, ('',)),
+    ('each_boot_exclude', as_list, ('',)),
+    ('each_boot_templates', as_list, ('',)),
+    ('each_boot_background', asbool, 'false'),
+    ('build_state', asbool, 'false'),
+    ('build_state_path', as_string, ''),
+    ('content_addressed', asbool, 'false'),
     ('mutated_file_prefix', as_string, '_'),
     ('mutated_path', as_string, ''),
     ('purge_mutated_path', asbool, 'false'),
     ('always_remutate', as_list, ('',)),
+    ('template_context_keys', as_list, ('',)),
+    ('integrity', as_string, ''),
+    ('metrics', asbool, 'false'),
+    ('compile_socket', as_string, ''),
+    ('compile_slots', int, '0'),
+    ('compile_slots_reserved', int, '0'),
+    ('failure_ttl', int, '0'),
+    ('failure_fallback', asbool, 'false'),
+    ('build_profile', as_string, ''),
 )
 
 # Use an OrderedDict so that processing always happens in order
 mutators = OrderedDict() # empty for now
+bundles = OrderedDict() # empty for now
+variants = OrderedDict() # empty for now
 
 def parse_settings(settings):
     parsed = {}
@@ -46,7 +79,8 @@ def parse_settings(settings):
     return parsed
 
 
-def assign_assetmutator(config, ext, cmd, new_ext):
+def assign_assetmutator(config, ext, cmd, new_ext, max_concurrency=None,
+                        interprocess=False):
     """
     Configuration method to set up/assign an asset mutator. This allows the
     various ``assetmutator_*`` view helper methods to know which mutator to run
@@ -64,6 +98,17 @@ def assign_assetmutator(config, ext, cmd, new_ext):
                     js).
     :type new_ext: string - Required
 
+    :param max_concurrency: The maximum number of instances of this mutator
+                            command which may run at once (e.g. to throttle
+                            expensive mutators). Unlimited by default.
+    :type max_concurrency: int - Optional
+
+    :param interprocess: Enforce ``max_concurrency`` across all of the
+                         processes on the host (via ``assetmutator-*.lock``
+                         files, one per slot, which are kept in the temporary
+                         directory) rather than per process.
+    :type interprocess: bool - Optional
+
 
     .. warning:: The specified mutator command must be installed, must be
                  executable by the Pyramid process, and must *output the
@@ -78,11 +123,294 @@ def assign_assetmutator(config, ext, cmd, new_ext):
     """
     mutators[ext] = dict(cmd=cmd, ext=new_ext)
 
+    if max_concurrency:
+        mutators[ext]['max_concurrency'] = int(max_concurrency)
+        mutators[ext]['interprocess'] = interprocess
+
+def assign_assetbundle(config, name, members, separator='\n'):
+    """
+    Configuration method to set up/assign an asset bundle. A bundle mutates
+    each of its members (as needed) and concatenates them into a single
+    fingerprinted output file, which can then be referenced via the
+    ``assetmutator_bundle_*`` view helper methods.
+
+    :param name: The name of the bundle, which is also used as the filename
+                 (e.g. app.js) of the bundle output.
+    :type name: string - Required
+
+    :param members: The asset specifications of the bundle members (in
+                    order). Members without a matching mutator are included
+                    as-is.
+    :type members: list - Required
+
+    :param separator: The string used to separate the concatenated members.
+    :type separator: string - Optional
+
+    The bundle output is stored in the ``mutated_path`` if one is configured,
+    otherwise it is stored in the directory of the first member. Only members
+    which have changed are remutated when the bundle is rebuilt.
+
+    For example::
+
+        config.assign_assetmutator('coffee', 'coffee -c -p', 'js')
+        config.assign_assetbundle('app.js', ['myapp:static/js/vendor.js',
+                                             'myapp:static/js/models.coffee',
+                                             'myapp:static/js/views.coffee'])
+    """
+    if not members:
+        raise ValueError('No members were specified for %s.' % name)
+
+    bundles[name] = dict(members=list(members), separator=separator)
+
+def assign_assetvariants(config, ext, outputs):
+    """
+    Configuration method to set up/assign the variants of an asset (e.g. the
+    sizes and formats of a responsive image). Each variant is a named output
+    of its own mutator command, and all of the variants of an asset are
+    mutated concurrently when it is referenced via the
+    ``assetmutator_srcset`` view helper method (or, if the ``each_request``
+    setting is disabled, when the ``each_boot`` assets are mutated).
+
+    :param ext: The file extension the variants should be generated for (e.g.
+                png).
+    :type ext: string - Required
+
+    :param outputs: A list of ``(name, cmd, new_ext)`` or ``(name, cmd,
+                    new_ext, descriptor)`` tuples, where ``name`` identifies
+                    the variant (and is included in its mutated filename),
+                    ``cmd`` and ``new_ext`` are as in
+                    :meth:`~pyramid_assetmutator.assign_assetmutator`, and
+                    ``descriptor`` is the ``srcset`` width or density
+                    descriptor of the variant (e.g. ``320w``; defaults to the
+                    ``name``).
+    :type outputs: list - Required
+
+    For example::
+
+        config.assign_assetvariants('png', [
+            ('320w', 'resize_wrapper 320', 'png'),
+            ('640w', 'resize_wrapper 640', 'png'),
+            ('1280w', 'resize_wrapper 1280', 'png'),
+            ('320w-webp', 'resize_wrapper --webp 320', 'webp', '320w'),
+            ('640w-webp', 'resize_wrapper --webp 640', 'webp', '640w'),
+        ])
+    """
+    if not outputs:
+        raise ValueError('No variants were specified for %s.' % ext)
+
+    variants[ext] = []
+
+    for output in outputs:
+        name, cmd, new_ext = output[:3]
+        descriptor = output[3] if len(output) > 3 else name
+        variants[ext].append(dict(cmd=cmd, ext=new_ext, variant=name,
+                                  descriptor=descriptor))
+
+def add_assetmutator_view(config, name, cache_max_age=DEFAULT_MAX_AGE,
+                          content_encodings=('br', 'gzip'), **kw):
+    """
+    Configuration method to add a static view which serves the mutated assets
+    stored in the configured ``mutated_path``. Unlike a regular static view,
+    it serves the (fingerprinted) assets with far-future ``immutable`` caching
+    headers, answers conditional requests via strong ETags derived from the
+    fingerprinted filename, and serves precompressed variants (e.g.
+    ``_app.0x1234.js.gz``) to clients that accept them.
+
+    :param name: The URL prefix (or view name) of the static view (e.g.
+                 ``static/cache``), as in
+                 :meth:`~pyramid.config.Configurator.add_static_view`.
+    :type name: string - Required
+
+    :param cache_max_age: The number of seconds clients may cache the mutated
+                          assets for (defaults to one year).
+    :type cache_max_age: int - Optional
+
+    :param content_encodings: The precompressed variant encodings to serve,
+                              in order of preference (``br`` and/or
+                              ``gzip``).
+    :type content_encodings: list - Optional
+
+    Any additional keyword arguments (e.g. ``permission``) will be passed to
+    :meth:`~pyramid.config.Configurator.add_static_view`.
+
+    .. note:: The immutable caching headers rely on the mutated filenames
+              changing whenever the source changes, so this view should not be
+              used with a ``remutate_check`` of ``exists``.
+    """
+    mutated_path = config.registry.settings.get('assetmutator.mutated_path')
+
+    if not mutated_path:
+        raise ConfigurationError(
+            'add_assetmutator_view requires an assetmutator.mutated_path.'
+        )
+
+    # Registers the route and URL generation for ``request.static_url``...
+    config.add_static_view(name, mutated_path, **kw)
+
+    if not name.endswith('/'):
+        name += '/'
+    if config.route_prefix:
+        route_name = '__%s/%s' % (config.route_prefix, name)
+    else:
+        route_name = '__%s' % name
+
+    # ...while this (more specific) view takes precedence for serving them
+    config.add_view(
+        MutatedStaticView(get_abspath(mutated_path),
+                          cache_max_age=cache_max_age,
+                          content_encodings=content_encodings),
+        route_name=route_name,
+        request_method=('GET', 'HEAD'),
+        permission=kw.get('permission', NO_PERMISSION_REQUIRED),
+    )
+
+def set_assetmutator_metrics_sink(config, sink):
+    """
+    Configuration method to set the metrics sink which will receive the
+    counters and histograms recorded by ``pyramid_assetmutator`` (helper call
+    latency, ``should_mutate`` outcomes, compile durations, bytes in/out and
+    failures).
+
+    :param sink: An instance of
+                 :class:`~pyramid_assetmutator.metrics.MetricsSink` (or any
+                 object implementing its ``incr`` and ``observe`` methods).
+    :type sink: object - Required
+
+    For example, to collect metrics in memory::
+
+        from pyramid_assetmutator.metrics import MemoryMetricsSink
+        config.set_assetmutator_metrics_sink(MemoryMetricsSink())
+    """
+    config.registry.settings['assetmutator.metrics_sink'] = sink
+
+def add_assetmutator_metrics_view(config, pattern='/_assetmutator/metrics',
+                                  **kw):
+    """
+    Configuration method to add a view which exports the collected metrics in
+    the Prometheus text format.
+
+    :param pattern: The URL pattern the view should be served from.
+    :type pattern: string - Optional
+
+    Any additional keyword arguments (e.g. ``permission``) will be passed to
+    :meth:`~pyramid.config.Configurator.add_view`.
+
+    .. note:: The view can only export metrics collected by a
+              :class:`~pyramid_assetmutator.metrics.MemoryMetricsSink` (which
+              is used by default when ``assetmutator.metrics`` is enabled).
+    """
+    config.add_route('assetmutator_metrics', pattern)
+    config.add_view(metrics_view, route_name='assetmutator_metrics', **kw)
+
+def add_assetmutator_health_view(config, pattern='/_assetmutator/health',
+                                 **kw):
+    """
+    Configuration method to add a readiness view which reports the progress of
+    the background ``each_boot`` warmup (see the ``each_boot_background``
+    setting) as JSON, responding with a ``503 Service Unavailable`` status
+    until all of the assets have been processed.
+
+    :param pattern: The URL pattern the view should be served from.
+    :type pattern: string - Optional
+
+    Any additional keyword arguments (e.g. ``permission``) will be passed to
+    :meth:`~pyramid.config.Configurator.add_view`.
+    """
+    config.add_route('assetmutator_health', pattern)
+    config.add_view(health_view, route_name='assetmutator_health', **kw)
+
+def instrumented(helper):
+    """
+    Decorator which records the latency of an ``assetmutator_*`` view helper
+    when a metrics sink is configured.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kw):
+            sink = self.request.registry.settings.get(
+                'assetmutator.metrics_sink'
+            )
+
+            if sink is None:
+                return method(self, *args, **kw)
+
+            start = default_timer()
+            try:
+                return method(self, *args, **kw)
+            finally:
+                sink.observe('assetmutator_helper_seconds',
+                             default_timer() - start, helper=helper)
+        return wrapper
+    return decorator
+
+def memoized(helper):
+    """
+    Decorator which memoizes the result of an ``assetmutator_*`` view helper
+    for the rest of the current request (see
+    :func:`get_assetmutator_memo`), so that referencing the same asset
+    several times within one response only costs a dictionary lookup.
+
+    Template assets are never memoized, as their output depends on the
+    rendering context of the template the helper is called from.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, path, *args, **kw):
+            memo = getattr(self.request, 'assetmutator_memo', None)
+
+            if memo is None or self._is_template(path):
+                return method(self, path, *args, **kw)
+
+            key = (helper, path, _memo_key(args), _memo_key(kw))
+
+            try:
+                return memo[key]
+            except KeyError:
+                result = memo[key] = method(self, path, *args, **kw)
+                return result
+        return wrapper
+    return decorator
+
+def _memo_key(value):
+    """
+    Returns a hashable version of the view helper argument ``value`` (e.g. a
+    mutator dictionary or a list of variant names).
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _memo_key(item))
+                            for key, item in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_memo_key(item) for item in value)
+
+    return value
+
+def get_assetmutator_memo(request):
+    """
+    Returns the dictionary used to memoize the view helper results of
+    ``request`` (available as the reified ``request.assetmutator_memo``).
+    """
+    return {}
+
 class AssetMutator(object):
     def __init__(self, request, rendering_val):
         self.request = request
         self.rendering_val = rendering_val
 
+    def _is_template(self, path):
+        """
+        Checks if ``path`` matches a template renderer (in which case it may be
+        rendered before mutation).
+        """
+        ext = os.path.splitext(path)[-1]
+
+        if not ext or ext in ('.txt',):
+            return False
+
+        return self.request.registry.queryUtility(IRendererFactory,
+                                                  name=ext) is not None
+
+    @instrumented('url')
+    @memoized('url')
     def assetmutator_url(self, path, **kw):
         """
         Returns a Pyramid :meth:`~pyramid.request.Request.static_url` of the
@@ -111,6 +439,97 @@ class AssetMutator(object):
         else:
             return request.static_url(mutant.mutate())
 
+    @instrumented('urls')
+    def assetmutator_urls(self, paths, **kw):
+        """
+        Returns a list of Pyramid :meth:`~pyramid.request.Request.static_url`
+        values of the mutated assets (in the same order as ``paths``). All of
+        the assets which need to be (re)mutated are mutated concurrently, so
+        that referencing several stale assets only takes about as long as the
+        slowest of them.
+
+        :param paths: The Pyramid asset paths to process.
+        :type paths: list - Required
+
+        :type mutator: dict or string - Optional
+        :param mutator: Allows you to override/specify a specific mutator to use
+                         (e.g. ``coffee``), or assign a brand new mutator
+                         dictionary to be used (e.g. ``{'cmd': 'lessc', 'ext':
+                         'css'}``)
+        """
+        request = self.request
+
+        if not request.registry.settings['assetmutator.each_request']:
+            new_paths = []
+
+            for path in paths:
+                mutant = Mutator(request, path,
+                                 rendering_val=self.rendering_val, **kw)
+
+                if not mutant.is_mutated:
+                    logger.warning(
+                        '"%s" does not appear to have been mutated yet.' % path
+                    )
+
+                new_paths.append(mutant.new_path)
+        else:
+            new_paths = mutate_all(request, paths,
+                                   rendering_val=self.rendering_val, **kw)
+
+        return [request.static_url(path) for path in new_paths]
+
+    @instrumented('srcset')
+    @memoized('srcset')
+    def assetmutator_srcset(self, path, names=None):
+        """
+        Returns a ``srcset`` attribute value listing the
+        :meth:`~pyramid.request.Request.static_url` and descriptor of each
+        variant of the asset (e.g. ``http://.../_img-320w.0x1234.png 320w,
+        http://.../_img-640w.0x1234.png 640w``), and mutates the variants
+        which need to be (concurrently).
+
+        :param path: The Pyramid asset path to process.
+        :type path: string - Required
+
+        :param names: The names of the variants to include (e.g. only the
+                      ``webp`` ones for a ``<source>`` element). Defaults to
+                      all of the variants assigned to the asset extension.
+        :type names: list - Optional
+        """
+        request = self.request
+        ext = os.path.splitext(path)[-1][1:]
+        outputs = request.registry.settings['assetmutator.variants'].get(ext)
+
+        if not outputs:
+            raise RuntimeError('No variants found for %s.' % ext)
+        if names is not None:
+            outputs = [output for output in outputs
+                       if output['variant'] in names]
+
+        if not request.registry.settings['assetmutator.each_request']:
+            new_paths = []
+
+            for output in outputs:
+                mutant = Mutator(request, path, mutator=output,
+                                 rendering_val=self.rendering_val)
+
+                if not mutant.is_mutated:
+                    logger.warning(
+                        '"%s" (%s) does not appear to have been mutated yet.'
+                        % (path, output['variant'])
+                    )
+
+                new_paths.append(mutant.new_path)
+        else:
+            new_paths = mutate_variants(request, path, outputs,
+                                        rendering_val=self.rendering_val)
+
+        return ', '.join('%s %s' % (request.static_url(new_path),
+                                    output['descriptor'])
+                         for new_path, output in zip(new_paths, outputs))
+
+    @instrumented('path')
+    @memoized('path')
     def assetmutator_path(self, path, **kw):
         """
         Returns a Pyramid :meth:`~pyramid.request.Request.static_path` of the
@@ -139,6 +558,8 @@ class AssetMutator(object):
         else:
             return request.static_path(mutant.mutate())
 
+    @instrumented('source')
+    @memoized('source')
     def assetmutator_source(self, path, **kw):
         """
         Returns the source data/contents of the mutated asset (and mutates the
@@ -173,6 +594,44 @@ class AssetMutator(object):
             mutant.mutate()
             return mutant.mutated_data()
 
+    @instrumented('integrity')
+    @memoized('integrity')
+    def assetmutator_integrity(self, path, **kw):
+        """
+        Returns the `Subresource Integrity`_ value (e.g. ``sha384-...``) of the
+        mutated asset (and mutates the asset if needed). The value is computed
+        once (when the asset is mutated if the ``integrity`` setting is
+        enabled) and then returned from memory.
+
+        :param path: The Pyramid asset path to process.
+        :type path: string - Required
+
+        :type mutator: dict or string - Optional
+        :param mutator: Allows you to override/specify a specific mutator to use
+                         (e.g. ``coffee``), or assign a brand new mutator
+                         dictionary to be used (e.g. ``{'cmd': 'lessc', 'ext':
+                         'css'}``)
+
+        .. _Subresource Integrity: https://www.w3.org/TR/SRI/
+        """
+        request = self.request
+
+        mutant = Mutator(request, path, rendering_val=self.rendering_val, **kw)
+
+        if not request.registry.settings['assetmutator.each_request']:
+            if not mutant.is_mutated:
+                logger.error(
+                    '"%s" does not appear to have been mutated yet.' % path
+                )
+                return None
+
+            return mutant.integrity()
+        else:
+            mutant.mutate()
+            return mutant.integrity()
+
+    @instrumented('assetpath')
+    @memoized('assetpath')
     def assetmutator_assetpath(self, path, **kw):
         """
         Returns a Pyramid `asset specification`_ such as
@@ -212,10 +671,267 @@ class AssetMutator(object):
         else:
             return mutant.mutate()
 
+    @instrumented('bundle_url')
+    def assetmutator_bundle_url(self, name):
+        """
+        Returns a Pyramid :meth:`~pyramid.request.Request.static_url` of the
+        output of the specified asset bundle (and builds the bundle if needed).
+
+        :param name: The name of the bundle (see
+                     :meth:`~pyramid_assetmutator.assign_assetbundle`).
+        :type name: string - Required
+        """
+        return self.request.static_url(self._bundle_path(name))
+
+    @instrumented('bundle_path')
+    def assetmutator_bundle_path(self, name):
+        """
+        Returns a Pyramid :meth:`~pyramid.request.Request.static_path` of the
+        output of the specified asset bundle (and builds the bundle if needed).
+
+        :param name: The name of the bundle (see
+                     :meth:`~pyramid_assetmutator.assign_assetbundle`).
+        :type name: string - Required
+        """
+        return self.request.static_path(self._bundle_path(name))
+
+    def _bundle_path(self, name):
+        request = self.request
+
+        bundle = Bundle(request, name, rendering_val=self.rendering_val)
+
+        if not request.registry.settings['assetmutator.each_request']:
+            if not bundle.is_mutated:
+                logger.warning(
+                    '"%s" does not appear to have been bundled yet.' % name
+                )
+
+            return bundle.new_path
+        else:
+            return bundle.mutate()
+
+
+def find_template_assets(registry, index, excludes):
+    """
+    Scans the ``each_boot_templates`` directories for assets referenced by the
+    view helpers, and returns a list of ``(fullpath, mutator)`` tuples for the
+    ones which were not already matched by the ``each_boot`` patterns (and for
+    each of the variants referenced by ``assetmutator_srcset``).
+    """
+    settings = registry.settings
+    scanner = TemplateScanner()
+
+    for path in settings['assetmutator.each_boot_templates']:
+        scanner.scan(path)
+
+    for filename, lineno, snippet in scanner.unresolved:
+        logger.warning(
+            'Unable to resolve the asset path of "%s" (%s:%s).' % (snippet,
+                                                                  filename,
+                                                                  lineno)
+        )
+
+    matched = set()
+    for asset_spec in settings['assetmutator.each_boot']:
+        matched.update(index.match(asset_spec, excludes))
+
+    renderers = [key for key in dict(registry.getUtilitiesFor(IRendererFactory))
+                 if key not in ['json', 'string', '.txt']]
+    assets = []
+
+    for path, mutator in scanner.assets:
+        fullpath = get_abspath(path)
+
+        if fullpath in matched or index.is_excluded(fullpath, excludes):
+            continue
+        matched.add(fullpath)
+
+        if not os.path.isfile(fullpath):
+            logger.warning('"%s" does not exist.' % path)
+            continue
+
+        # Template assets depend on the rendering context of each request
+        if os.path.splitext(fullpath)[-1] in renderers:
+            continue
+
+        ext = os.path.splitext(fullpath)[-1][1:]
+        if not mutator and ext not in settings['assetmutator.mutators']:
+            continue
+
+        assets.append((fullpath, mutator))
+
+    built = set()
+    for path, names in scanner.srcsets:
+        fullpath = get_abspath(path)
+        ext = os.path.splitext(fullpath)[-1][1:]
+
+        if index.is_excluded(fullpath, excludes):
+            continue
+
+        if not os.path.isfile(fullpath):
+            logger.warning('"%s" does not exist.' % path)
+            continue
+
+        for output in settings['assetmutator.variants'].get(ext, ()):
+            if names is not None and output['variant'] not in names:
+                continue
+            if (fullpath, output['variant']) in built:
+                continue
+
+            built.add((fullpath, output['variant']))
+            assets.append((fullpath, output))
+
+    for name in scanner.bundles:
+        if name not in settings['assetmutator.bundles']:
+            logger.warning('Unknown asset bundle "%s".' % name)
+
+    logger.debug(scanner.report())
+
+    return assets
+
+def get_build_state(registry):
+    """
+    Returns the :class:`~pyramid_assetmutator.state.BuildState` stored at the
+    ``build_state_path`` (or ``None`` if the ``build_state`` setting is
+    disabled).
+    """
+    settings = registry.settings
+
+    if not settings['assetmutator.build_state']:
+        return None
+
+    if not settings['assetmutator.mutated_path']:
+        logger.warning('The build_state setting requires a mutated_path.')
+        return None
+
+    path = settings['assetmutator.build_state_path']
+    if path:
+        path = get_output_abspath(path)
+    else:
+        # Never store the database in the (publicly served) mutated_path
+        path = get_default_path(
+            get_abspath(settings['assetmutator.mutated_path'])
+        )
+
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    return BuildState(path)
+
+def start_build_profile(registry):
+    """
+    Returns a :class:`~pyramid_assetmutator.profiling.BuildProfile` recording
+    the assets mutated via ``registry`` (or ``None`` if the ``build_profile``
+    setting is not defined).
+    """
+    if not registry.settings['assetmutator.build_profile']:
+        return None
+
+    profile = BuildProfile()
+    profile.subscribe(registry)
+
+    return profile
+
+def finish_build_profile(registry, profile):
+    """
+    Stops recording ``profile``, writes its JSON report to the configured
+    ``build_profile`` path and logs its summary.
+    """
+    profile.unsubscribe()
+    path = get_output_abspath(registry.settings['assetmutator.build_profile'])
+
+    try:
+        profile.write(path)
+    except EnvironmentError:
+        logger.exception('Unable to write the build profile to "%s".' % path)
+
+    logger.info(summarize(profile.report()))
+
+def start_warmup(request, registry, index, excludes, build_state=None,
+                 profile=None):
+    """
+    Starts mutating all of the ``each_boot`` (and ``each_boot_templates``)
+    assets in the background (see :class:`~pyramid_assetmutator.warmup.Warmup`)
+    and returns the warmup. The build ``profile`` (if any) is finished once
+    all of the assets have been processed.
+    """
+    settings = registry.settings
+    assets = []
+
+    for asset_spec in settings['assetmutator.each_boot']:
+        assets.extend((path, None) for path in index.match(asset_spec,
+                                                           excludes)
+                      if not is_variant_only(settings, path))
+
+    if settings['assetmutator.each_boot_templates']:
+        assets.extend(find_template_assets(registry, index, excludes))
+
+    callback = None
+    if profile is not None:
+        callback = lambda warmup: finish_build_profile(registry, profile)
+
+    warmup = Warmup(request, registry, assets, callback=callback, index=index,
+                    build_state=build_state)
+    settings['assetmutator.warmup'] = warmup
+    warmup.start()
+
+    return warmup
+
+def run_each_boot(request, registry, index, excludes, build_state=None):
+    """
+    Mutates all of the ``each_boot`` (and ``each_boot_templates``) assets.
+    """
+    settings = registry.settings
+
+    for asset_spec in settings['assetmutator.each_boot']:
+        if is_variant_only(settings, asset_spec):
+            continue
+
+        mutant = Mutator(request, asset_spec, registry=registry, batch=True,
+                         index=index, excludes=excludes,
+                         build_state=build_state)
+        mutant.mutate()
+
+    if settings['assetmutator.each_boot_templates']:
+        for path, mutator in find_template_assets(registry, index, excludes):
+            mutant = Mutator(request, path, registry=registry, batch=True,
+                             index=index, mutator=mutator,
+                             build_state=build_state)
+            mutant.mutate()
+
+def build_variants(request, registry, index, excludes):
+    """
+    Mutates all of the variants (see :func:`assign_assetvariants`) of the
+    ``each_boot`` assets.
+    """
+    settings = registry.settings
+
+    for asset_spec in settings['assetmutator.each_boot']:
+        for path in index.match(asset_spec, excludes):
+            ext = os.path.splitext(path)[-1][1:]
+            outputs = settings['assetmutator.variants'].get(ext)
+
+            if outputs:
+                mutate_variants(request, path, outputs, registry=registry)
+
+def is_variant_only(settings, path):
+    """
+    Checks if the extension of ``path`` (a source or pattern) only has
+    variants assigned to it, but no mutator.
+    """
+    ext = os.path.splitext(path)[-1][1:]
+
+    return ext not in settings['assetmutator.mutators'] and \
+           ext in settings['assetmutator.variants']
 
 def applicationcreated_subscriber(event):
     app = event.app
     app.registry.settings['assetmutator.mutators'] = mutators
+    app.registry.settings['assetmutator.bundles'] = bundles
+    app.registry.settings['assetmutator.variants'] = variants
+
+    # Precompile the always_remutate patterns (shared by all Mutators)
+    get_pattern_matcher(app.registry.settings['assetmutator.always_remutate'])
 
     if app.registry.settings['assetmutator.mutated_path'] \
        and app.registry.settings['assetmutator.purge_mutated_path']:
@@ -232,25 +948,63 @@ def applicationcreated_subscriber(event):
                     pass
 
 
-    if app.registry.settings['assetmutator.each_boot']:
+    if app.registry.settings['assetmutator.each_boot'] or \
+       app.registry.settings['assetmutator.each_boot_templates']:
         request = app.request_factory.blank('/')
+        mutated_path = app.registry.settings['assetmutator.mutated_path']
+        # Never match the mutated outputs themselves
+        index = SourceIndex(
+            ignore=[get_abspath(mutated_path)] if mutated_path else ()
+        )
+        excludes = app.registry.settings['assetmutator.each_boot_exclude']
+        build_state = get_build_state(app.registry)
+        profile = start_build_profile(app.registry)
 
-        for asset_spec in app.registry.settings['assetmutator.each_boot']:
-            mutant = Mutator(request, asset_spec, registry=app.registry,
-                             batch=True)
-            mutant.mutate()
+        if app.registry.settings['assetmutator.each_boot_background']:
+            start_warmup(request, app.registry, index, excludes,
+                         build_state=build_state, profile=profile)
+        else:
+            try:
+                run_each_boot(request, app.registry, index, excludes,
+                              build_state=build_state)
+            finally:
+                if build_state is not None:
+                    build_state.close()
+                if profile is not None:
+                    finish_build_profile(app.registry, profile)
+
+    if not app.registry.settings['assetmutator.each_request'] and bundles:
+        request = app.request_factory.blank('/')
+
+        for name in bundles:
+            Bundle(request, name, registry=app.registry).mutate()
+
+    if not app.registry.settings['assetmutator.each_request'] and variants \
+       and app.registry.settings['assetmutator.each_boot']:
+        request = app.request_factory.blank('/')
+        build_variants(request, app.registry, index, excludes)
 
 def beforerender_subscriber(event):
     request = event['request']
 
     event['assetmutator_url'] = \
         AssetMutator(request, event.rendering_val).assetmutator_url
+    event['assetmutator_urls'] = \
+        AssetMutator(request, event.rendering_val).assetmutator_urls
+    event['assetmutator_srcset'] = \
+        AssetMutator(request, event.rendering_val).assetmutator_srcset
     event['assetmutator_path'] = \
         AssetMutator(request, event.rendering_val).assetmutator_path
     event['assetmutator_source'] = \
         AssetMutator(request, event.rendering_val).assetmutator_source
     event['assetmutator_assetpath'] = \
         AssetMutator(request, event.rendering_val).assetmutator_assetpath
+    event['assetmutator_integrity'] = \
+        AssetMutator(request, event.rendering_val).assetmutator_integrity
+    event['assetmutator_bundle_url'] = \
+        AssetMutator(request, event.rendering_val).assetmutator_bundle_url
+    event['assetmutator_bundle_path'] = \
+        AssetMutator(request, event.rendering_val).assetmutator_bundle_path
 
 def includeme(config):
     """
@@ -261,6 +1015,34 @@ def includeme(config):
     settings = parse_settings(config.registry.settings)
     config.registry.settings.update(settings)
 
+    if settings['assetmutator.metrics'] and \
+       not config.registry.settings.get('assetmutator.metrics_sink'):
+        config.registry.settings['assetmutator.metrics_sink'] = \
+            MemoryMetricsSink()
+
+    if settings['assetmutator.compile_slots'] and \
+       not config.registry.settings.get('assetmutator.scheduler'):
+        config.registry.settings['assetmutator.scheduler'] = CompileScheduler(
+            settings['assetmutator.compile_slots'],
+            reserved=settings['assetmutator.compile_slots_reserved']
+        )
+
     config.add_directive('assign_assetmutator', assign_assetmutator)
+    config.add_directive('assign_assetbundle', assign_assetbundle)
+    config.add_directive('assign_assetvariants', assign_assetvariants)
+    config.add_directive('add_assetmutator_view', add_assetmutator_view)
+    config.add_directive('set_assetmutator_metrics_sink',
+                         set_assetmutator_metrics_sink)
+    config.add_directive('add_assetmutator_metrics_view',
+                         add_assetmutator_metrics_view)
+    config.add_directive('add_assetmutator_health_view',
+                         add_assetmutator_health_view)
+    if hasattr(config, 'add_request_method'):
+        config.add_request_method(get_assetmutator_memo, 'assetmutator_memo',
+                                  reify=True)
+    else: # pragma: no cover
+        # Pyramid 1.3 compat
+        config.set_request_property(get_assetmutator_memo,
+                                    'assetmutator_memo', reify=True)
     config.add_subscriber(applicationcreated_subscriber, ApplicationCreated)
     config.add_subscriber(beforerender_subscriber, BeforeRender)
@@ -0,0 +1,186 @@
+import os
+import hashlib
+from pyramid_assetmutator.compat import replace_file
+from pyramid_assetmutator.mutator import Mutator
+from pyramid_assetmutator.utils import get_abspath, get_stat, hexhashify, \
+                                       compute_md5, get_temp_path, \
+                                       store_content
+
+
+class Bundle(object):
+    """
+    Bundle class for the pyramid_assetmutator add-on. Mutates each member of an
+    asset bundle (as needed) and concatenates the results into a single
+    fingerprinted output file.
+    """
+    def __init__(self, request, name, **kw):
+        """
+        Initialize the Bundle class.
+
+        Required parameters:
+
+        :type request: request
+        :param request: The Pyramid application's current ``request``.
+
+        :type name: string
+        :param name: The name of a bundle assigned via
+                     :meth:`~pyramid_assetmutator.assign_assetbundle`.
+
+        Optional keyword parameters:
+
+        :type registry: registry
+        :param registry: Explicitly pass your own Pyramid ``registry`` (usually
+                         only used in combination with batch processing).
+
+        :type rendering_val: dict
+        :param rendering_val: A dictionary that will be passed to the renderer
+                              for members which match a valid template
+                              renderer.
+        """
+        self.request = request
+        try:
+            self.registry = kw['registry']
+        except KeyError:
+            self.registry = self.request.registry
+        self.settings = self.registry.settings
+        self.name = name
+        self.rendering_val = kw.get('rendering_val', {})
+
+        bundles = self.settings.get('assetmutator.bundles') or {}
+        try:
+            bundle = bundles[name]
+        except KeyError:
+            raise RuntimeError('No bundle found for %s.' % name)
+
+        self.members = bundle['members']
+        self.separator = bundle['separator']
+        self.mutators = self.settings.get('assetmutator.mutators') or {}
+        self.prefix = self.settings['assetmutator.mutated_file_prefix']
+        self.check_method = self.settings['assetmutator.remutate_check']
+        self.mutated_path = self.settings['assetmutator.mutated_path']
+        self.content_addressed = self.mutated_path and \
+            self.settings.get('assetmutator.content_addressed', False)
+
+        if self.mutated_path and not self.mutated_path.endswith(os.sep):
+            self.mutated_path += os.sep
+
+        self.sources = None
+        self.dest_fullpath = None
+        self.new_path = None
+
+    def _member_source(self, spec, mutate):
+        """
+        Returns a ``(fullpath, fingerprint)`` tuple for the (mutated) source of
+        the bundle member ``spec``.
+        """
+        try:
+            mutant = Mutator(self.request, spec, registry=self.registry,
+                             rendering_val=self.rendering_val)
+        except RuntimeError:
+            if os.path.splitext(spec)[-1][1:] in self.mutators:
+                raise
+            mutant = None
+
+        if mutant is not None:
+            if mutate:
+                mutant.mutate()
+            return mutant.dest_fullpath, mutant.dest_filename
+
+        # Members without a mutator are included as-is
+        fullpath = get_abspath(spec)
+
+        if self.check_method == 'exists':
+            fingerprint = hexhashify(fullpath)
+        elif self.check_method == 'checksum':
+            fingerprint = compute_md5(fullpath)
+        else:
+            fingerprint = hexhashify(fullpath) + hexhashify(get_stat(fullpath))
+
+        return fullpath, fingerprint
+
+    def _configure_paths(self, mutate):
+        """
+        Resolves (and optionally mutates) each member, then sets the various
+        path settings for the bundle output.
+        """
+        self.sources = []
+        md5 = hashlib.md5()
+
+        for spec in self.members:
+            fullpath, fingerprint = self._member_source(spec, mutate)
+            self.sources.append(fullpath)
+            md5.update(('%s\n%s\n' % (fullpath, fingerprint)).encode('utf-8'))
+
+        self.fingerprint = md5.hexdigest()[:12]
+
+        name, ext = os.path.splitext(self.name)
+        self.dest_filename = '%s%s.%s%s' % (self.prefix, name,
+                                            self.fingerprint, ext)
+
+        if self.mutated_path:
+            self.dest_dirpath = get_abspath(self.mutated_path)
+            self.new_path = self.mutated_path + self.dest_filename
+        else:
+            # Store the bundle next to its first member
+            first = self.members[0]
+            self.dest_dirpath = os.path.dirname(get_abspath(first))
+            self.new_path = first[:len(first) - len(os.path.basename(first))] \
+                            + self.dest_filename
+
+        self.dest_fullpath = os.path.join(self.dest_dirpath,
+                                          self.dest_filename)
+
+    @property
+    def is_mutated(self):
+        """
+        Property method to check and see if the bundle has already been built.
+        """
+        if self.dest_fullpath is None:
+            self._configure_paths(mutate=False)
+
+        return os.path.exists(self.dest_fullpath)
+
+    def mutate(self):
+        """
+        Mutate the (changed) bundle members, build the bundle if needed and
+        return the new asset specification path.
+        """
+        self._configure_paths(mutate=True)
+
+        if not os.path.exists(self.dest_fullpath):
+            if not os.path.isdir(self.dest_dirpath):
+                os.makedirs(self.dest_dirpath)
+
+            tmp_fullpath = get_temp_path(self.dest_fullpath)
+            separator = self.separator.encode('utf-8')
+            sha1 = hashlib.sha1()
+
+            with open(tmp_fullpath, 'wb') as out:
+                for i, source in enumerate(self.sources):
+                    if i:
+                        out.write(separator)
+                        sha1.update(separator)
+                    with open(source, 'rb') as f:
+                        for chunk in iter(lambda: f.read(65536), b''):
+                            out.write(chunk)
+                            sha1.update(chunk)
+
+            replace_file(tmp_fullpath, self.dest_fullpath)
+
+            if self.content_addressed:
+                store_content(self.dest_dirpath, self.dest_fullpath,
+                              sha1.hexdigest())
+
+        return self.new_path
+
+    def mutated_data(self):
+        """
+        Return the source of the built bundle.
+        """
+        if not self.is_mutated:
+            raise RuntimeError('Source not found. Has it been mutated?')
+
+        with open(self.dest_fullpath) as f:
+            data = f.read()
+
+        return data
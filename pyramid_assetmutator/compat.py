@@ -7,3 +7,39 @@ if PY3: # pragma: no cover
     string_types = str,
 else: # pragma: no cover
     string_types = basestring,
+
+try: # pragma: no cover
+    from os import scandir
+except ImportError: # pragma: no cover
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try: # pragma: no cover
+    from collections import OrderedDict
+except ImportError: # pragma: no cover
+    # Py 2.6 compat
+    from ordereddict import OrderedDict
+
+try: # pragma: no cover
+    from os import replace as replace_file
+except ImportError: # pragma: no cover
+    # Py 2 compat (os.rename is atomic on POSIX)
+    from os import rename as replace_file
+
+try: # pragma: no cover
+    from threading import get_ident
+except ImportError: # pragma: no cover
+    from thread import get_ident
+
+try: # pragma: no cover
+    import socketserver
+except ImportError: # pragma: no cover
+    import SocketServer as socketserver
+
+try: # pragma: no cover
+    import fcntl
+except ImportError: # pragma: no cover
+    # Not available on Windows
+    fcntl = None
@@ -0,0 +1,510 @@
+"""
+Host-wide compile service for pyramid_assetmutator.
+
+When the ``assetmutator.compile_socket`` setting is defined, every
+:class:`~pyramid_assetmutator.mutator.Mutator` (in every worker process on the
+host) hands its mutator runs to a single :class:`CompileServer` listening on
+that Unix socket rather than spawning the mutator command itself. The server
+deduplicates concurrent requests for the same output file, limits the number
+of mutator commands running at once across the whole host, and keeps a shared
+in-memory table of the outputs it has already produced.
+
+Clients only send the name of a registered mutator (see
+:func:`get_mutator_table`), and the server only runs the commands of the
+mutators it was started with. Its socket is only accessible to the user
+running it, and its path includes a digest of the mutator table (see
+:func:`get_socket_path`), so that workers with a different table (e.g. after a
+deploy) never use it.
+
+The server is started automatically by the first worker which needs it (and
+exits once it has been idle for a while), or can be run as a separate
+service::
+
+    python -m pyramid_assetmutator.daemon /run/myapp/assetmutator.sock \\
+        --mutator coffee='coffee -c -p' --mutator less=lessc
+"""
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import socket
+import hashlib
+import threading
+import subprocess
+from pyramid_assetmutator.compat import socketserver, fcntl
+from pyramid_assetmutator.mutator import run_command, format_integrity, \
+                                         write_integrity, discard_integrity
+from pyramid_assetmutator.utils import LRUCache, get_cpu_count, \
+                                       get_concurrency_limit
+
+
+# Seconds to wait for an automatically started server to accept connections
+STARTUP_TIMEOUT = 10.0
+# Seconds after which a mutator run (or a request waiting for one) fails
+COMPILE_TIMEOUT = 300.0
+# Seconds after which an automatically started server exits if left unused
+IDLE_TIMEOUT = 600.0
+
+
+class _Job(object):
+    """
+    A mutator run which is in progress (and may be waited on by any number of
+    identical requests).
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class CompileServer(object):
+    """
+    A compile service for the ``socket_path`` setting, listening on the Unix
+    socket returned by :func:`get_socket_path`.
+
+    ``mutators`` maps the names of the registered mutators to their commands
+    (see :func:`get_mutator_table`); no other commands are ever run.
+
+    Requests and responses are single lines of JSON. A ``compile`` request
+    (with the ``mutator`` name, ``src`` and ``dest`` of the run, and optionally
+    an ``integrity`` algorithm, a ``force`` flag and the ``max_concurrency``
+    of the mutator) is answered with
+    ``{"ok": true, "size": ..., "integrity": ..., "shared": ...}`` where
+    ``shared`` is ``true`` if the result of another (concurrent or previous)
+    request was reused, or with ``{"ok": false, "error": ...}`` if the mutator
+    failed.
+
+    At most ``concurrency`` (defaults to the number of CPUs) mutator commands
+    are run at once, each of them for at most ``timeout`` seconds, and at most
+    ``maxsize`` results are kept in the resolution table. If ``idle_timeout``
+    is set, the server shuts down once it has not received any request (nor
+    run any mutator) for that many seconds.
+    """
+    def __init__(self, socket_path, concurrency=None, maxsize=4096,
+                 mutators=None, timeout=COMPILE_TIMEOUT, idle_timeout=None):
+        self.mutators = dict(mutators or {})
+        self.socket_path = get_socket_path(socket_path, self.mutators)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.last_active = time.time()
+        self.concurrency = concurrency or get_cpu_count()
+        self.semaphore = threading.BoundedSemaphore(self.concurrency)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.results = LRUCache(maxsize=maxsize)
+        self.compiles = 0
+        self.deduplicated = 0
+        self.server = None
+        self.lockfile = None
+
+    def compile(self, mutator, src, dest, integrity='', force=False,
+                max_concurrency=None):
+        """
+        Runs the command of the registered ``mutator`` for ``src`` (unless an
+        identical run is already in progress, or, unless ``force`` is set,
+        ``dest`` was already produced) and returns the response dictionary. At
+        most ``max_concurrency`` runs of the command (if set) happen at once.
+        """
+        cmd = self.mutators.get(mutator)
+        if cmd is None:
+            return {'ok': False, 'error': 'Unknown mutator: %s' % mutator}
+
+        key = (cmd, src, dest)
+
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None and not force and \
+               result.get('integrity_algorithm') == integrity and \
+               os.path.exists(dest):
+                self.deduplicated += 1
+                return dict(result, shared=True)
+
+            job = self.pending.get(key)
+            if job is not None:
+                owner = False
+                self.deduplicated += 1
+            else:
+                owner = True
+                job = self.pending[key] = _Job()
+
+        if not owner:
+            if not job.done.wait(self.timeout):
+                return {'ok': False,
+                        'error': 'Timed out waiting for %s.' % dest}
+            return dict(job.result, shared=True)
+
+        try:
+            if max_concurrency:
+                with get_concurrency_limit(cmd, max_concurrency):
+                    with self.semaphore:
+                        job.result = self._run(cmd, src, dest, integrity)
+            else:
+                with self.semaphore:
+                    job.result = self._run(cmd, src, dest, integrity)
+        finally:
+            if job.result is None:
+                job.result = {'ok': False, 'error': 'Compile server error.'}
+            with self.lock:
+                del self.pending[key]
+                self.last_active = time.time()
+                if job.result['ok']:
+                    self.results.set(key, job.result)
+            job.done.set()
+
+        return dict(job.result, shared=False)
+
+    def _run(self, cmd, src, dest, integrity):
+        hashers = []
+        if integrity:
+            hashers.append(hashlib.new(integrity))
+
+        with self.lock:
+            self.compiles += 1
+
+        try:
+            size = run_command(cmd, src, dest, hashers=hashers,
+                               timeout=self.timeout)
+        except EnvironmentError as exc:
+            return {'ok': False, 'error': '%s' % exc}
+
+        value = None
+        if hashers:
+            value = format_integrity(hashers[0])
+            write_integrity(dest, value)
+        else:
+            discard_integrity(dest)
+
+        return {'ok': True, 'size': size, 'integrity': value,
+                'integrity_algorithm': integrity}
+
+    def handle(self, message):
+        """
+        Returns the response dictionary for the request ``message``.
+        """
+        op = message.get('op')
+        self.last_active = time.time()
+
+        if op == 'compile':
+            return self.compile(message['mutator'], message['src'],
+                                message['dest'],
+                                integrity=message.get('integrity') or '',
+                                force=message.get('force', False),
+                                max_concurrency=message.get(
+                                    'max_concurrency'
+                                ))
+        elif op == 'lookup':
+            result = self.results.get((self.mutators.get(message['mutator']),
+                                       message['src'], message['dest']))
+            return {'ok': True, 'found': result is not None}
+        elif op == 'stats':
+            with self.lock:
+                return {'ok': True, 'pid': os.getpid(),
+                        'compiles': self.compiles,
+                        'deduplicated': self.deduplicated,
+                        'pending': len(self.pending),
+                        'results': len(self.results),
+                        'concurrency': self.concurrency}
+
+        return {'ok': False, 'error': 'Unknown operation: %s' % op}
+
+    def bind(self):
+        """
+        Binds the server to its socket. Returns ``False`` if another server is
+        already running for the socket.
+        """
+        if fcntl is None:
+            raise RuntimeError('The compile server is not supported on this '
+                               'platform.')
+
+        self.lockfile = open(self.socket_path + '.lock', 'a')
+
+        try:
+            fcntl.flock(self.lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self.lockfile.close()
+            self.lockfile = None
+            return False
+
+        # Any existing socket was left behind by a server which is gone
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self.server = _UnixServer(self.socket_path, _RequestHandler)
+        self.server.compile_server = self
+        # Only the user running the server may connect
+        os.chmod(self.socket_path, 0o600)
+
+        return True
+
+    def serve_forever(self):
+        if self.idle_timeout:
+            watcher = threading.Thread(target=self._watch_idle)
+            watcher.daemon = True
+            watcher.start()
+
+        self.server.serve_forever()
+
+    def _watch_idle(self):
+        server = self.server
+
+        while self.server is server:
+            time.sleep(min(self.idle_timeout, 1.0))
+            with self.lock:
+                idle = not self.pending and \
+                       time.time() - self.last_active > self.idle_timeout
+            if idle:
+                server.shutdown()
+                return
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def close(self):
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+        if self.lockfile is not None:
+            self.lockfile.close()
+            self.lockfile = None
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, b''):
+            try:
+                message = json.loads(line.decode('utf-8'))
+                response = self.server.compile_server.handle(message)
+            except Exception as exc:
+                response = {'ok': False, 'error': '%s' % exc}
+
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class CompileClient(object):
+    """
+    A client for the :class:`CompileServer` of the ``socket_path`` setting and
+    the ``mutators`` table. If ``autostart`` is set, a server is started (in a
+    new process, once per client) when none is running yet. Requests fail with
+    an :exc:`EnvironmentError` if no response is received within ``timeout``
+    seconds.
+    """
+    def __init__(self, socket_path, autostart=True, mutators=None,
+                 timeout=COMPILE_TIMEOUT):
+        self.base_path = socket_path
+        self.mutators = dict(mutators or {})
+        self.socket_path = get_socket_path(socket_path, self.mutators)
+        self.autostart = autostart
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+
+        return sock
+
+    def connect(self):
+        """
+        Returns a socket connected to the server (starting the server first if
+        needed).
+        """
+        try:
+            return self._connect()
+        except socket.error as exc:
+            if not self.autostart or \
+               exc.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+
+        # Only one thread starts the server (the others wait for it)
+        with self.lock:
+            try:
+                return self._connect()
+            except socket.error as exc:
+                if exc.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                    raise
+
+            process = start_server(self.base_path, self.mutators)
+            deadline = time.time() + STARTUP_TIMEOUT
+
+            while True:
+                try:
+                    return self._connect()
+                except socket.error as exc:
+                    if time.time() > deadline or \
+                       exc.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                        raise
+                # A server which was shutting down (e.g. when idle) kept
+                # the new one from binding the socket
+                if process.poll() is not None:
+                    process = start_server(self.base_path, self.mutators)
+                time.sleep(0.05)
+
+    def request(self, message):
+        """
+        Sends the request ``message`` and returns the response dictionary.
+        """
+        sock = self.connect()
+
+        try:
+            # Wait for the (possibly deduplicated) run, plus some leeway
+            sock.settimeout(self.timeout + STARTUP_TIMEOUT)
+            f = sock.makefile('rwb')
+            f.write(json.dumps(message).encode('utf-8') + b'\n')
+            f.flush()
+            line = f.readline()
+            f.close()
+        except socket.timeout:
+            raise EnvironmentError('Timed out waiting for the compile server '
+                                   'at %s.' % self.socket_path)
+        finally:
+            sock.close()
+
+        if not line:
+            raise EnvironmentError('No response from the compile server at %s.'
+                                   % self.socket_path)
+
+        return json.loads(line.decode('utf-8'))
+
+    def compile(self, mutator, src, dest, integrity='', force=False,
+                max_concurrency=None):
+        """
+        Requests a run of the registered ``mutator`` and returns the response
+        dictionary. Raises an :exc:`EnvironmentError` if the mutator failed.
+        """
+        response = self.request({'op': 'compile', 'mutator': mutator,
+                                 'src': src,
+                                 'dest': dest, 'integrity': integrity,
+                                 'force': force,
+                                 'max_concurrency': max_concurrency})
+
+        if not response['ok']:
+            raise EnvironmentError(response['error'])
+
+        return response
+
+    def stats(self):
+        return self.request({'op': 'stats'})
+
+
+def get_mutator_table(settings):
+    """
+    Returns a dictionary mapping the names of the registered mutators (their
+    source extension, e.g. ``coffee``, or ``<ext>/<variant>`` for asset
+    variants) to their commands.
+    """
+    table = {}
+
+    for ext, mutator in (settings.get('assetmutator.mutators') or {}).items():
+        table[ext] = mutator['cmd']
+
+    for ext, outputs in (settings.get('assetmutator.variants') or {}).items():
+        for output in outputs:
+            table['%s/%s' % (ext, output['variant'])] = output['cmd']
+
+    return table
+
+def get_socket_path(socket_path, mutators=None):
+    """
+    Returns the path of the Unix socket of the compile server for the
+    ``socket_path`` setting and the ``mutators`` table, i.e. ``socket_path``
+    followed by a digest of the table.
+    """
+    table = json.dumps(sorted((mutators or {}).items()))
+    digest = hashlib.md5(table.encode('utf-8')).hexdigest()[:12]
+
+    return '%s.%s' % (socket_path, digest)
+
+_clients = {}
+
+def get_client(socket_path, mutators=None):
+    """
+    Returns the (shared) :class:`CompileClient` for ``socket_path`` and the
+    ``mutators`` table.
+    """
+    key = get_socket_path(socket_path, mutators)
+
+    try:
+        return _clients[key]
+    except KeyError:
+        return _clients.setdefault(key, CompileClient(socket_path,
+                                                      mutators=mutators))
+
+def start_server(socket_path, mutators=None):
+    """
+    Starts a compile server for ``socket_path`` (and the ``mutators`` table) in
+    a new (detached) process, which exits after :data:`IDLE_TIMEOUT` seconds
+    without requests, and returns the :class:`subprocess.Popen` object of the
+    process. If a server is already running, the new process exits
+    immediately.
+    """
+    args = [sys.executable, '-m', 'pyramid_assetmutator.daemon', socket_path,
+            '--idle-timeout=%s' % IDLE_TIMEOUT]
+    for name, cmd in sorted((mutators or {}).items()):
+        args.append('--mutator=%s=%s' % (name, cmd))
+
+    with open(os.devnull, 'r+b') as devnull:
+        return subprocess.Popen(
+            args,
+            stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+            preexec_fn=os.setsid,
+        )
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run the pyramid_assetmutator compile server.'
+    )
+    parser.add_argument('socket', help='The path of the Unix socket (the '
+                                       'compile_socket setting), which is '
+                                       'suffixed with a digest of the '
+                                       'mutator table.')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='Maximum number of concurrent mutator commands '
+                             '(default: the number of CPUs).')
+    parser.add_argument('--mutator', action='append', default=[],
+                        metavar='NAME=CMD',
+                        help='A registered mutator which may be run (may be '
+                             'repeated).')
+    parser.add_argument('--timeout', type=float, default=COMPILE_TIMEOUT,
+                        help='Seconds after which a mutator command is '
+                             'killed (default: %s).' % COMPILE_TIMEOUT)
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='Seconds without requests after which the server '
+                             'exits (default: never).')
+    options = parser.parse_args(argv)
+
+    mutators = dict(mutator.split('=', 1) for mutator in options.mutator)
+    server = CompileServer(options.socket, concurrency=options.concurrency,
+                           mutators=mutators, timeout=options.timeout,
+                           idle_timeout=options.idle_timeout)
+    if not server.bind():
+        return
+
+    signal.signal(signal.SIGTERM, _terminate)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt: # pragma: no cover
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+class AssetMutationEvent(object):
+    """
+    Base class for the asset mutation lifecycle events, which are emitted via
+    the Pyramid registry (so subscribers can be attached with
+    ``config.add_subscriber``).
+
+    Instances have the following attributes:
+
+    ``mutant``
+        The :class:`~pyramid_assetmutator.mutator.Mutator` instance.
+
+    ``request``
+        The current ``request`` (a blank request when batch processing).
+
+    ``path``
+        The asset specification (or absolute path) being mutated.
+
+    ``mutator``
+        The mutator dictionary (e.g. ``{'cmd': 'lessc', 'ext': 'css'}``).
+
+    ``fingerprint``
+        The fingerprint of the asset source (as used in the mutated filename).
+
+    ``rendered``
+        Whether the asset source is parsed by a template renderer before
+        mutation.
+    """
+    def __init__(self, mutant):
+        self.mutant = mutant
+        self.request = mutant.request
+        self.path = mutant.path
+        self.mutator = mutant.mutator
+        self.fingerprint = mutant.fingerprint
+        self.rendered = mutant.parse_template
+
+
+class AssetMutationStarted(AssetMutationEvent):
+    """
+    An event emitted right before an asset is (re)mutated.
+    """
+
+
+class AssetMutated(AssetMutationEvent):
+    """
+    An event emitted after an asset was processed by
+    :meth:`~pyramid_assetmutator.mutator.Mutator.mutate`. In addition to the
+    common attributes, it has:
+
+    ``duration``
+        The time (in seconds) it took to render and mutate the asset (``0``
+        for cache hits).
+
+    ``cache_hit``
+        ``True`` if an up to date mutated version of the asset already existed
+        (and so no mutation took place).
+    """
+    def __init__(self, mutant, duration, cache_hit=False):
+        super(AssetMutated, self).__init__(mutant)
+        self.duration = duration
+        self.cache_hit = cache_hit
+
+
+class AssetMutationFailed(AssetMutationEvent):
+    """
+    An event emitted when mutating an asset raised an exception (which will be
+    re-raised after all subscribers have been notified). In addition to the
+    common attributes, it has:
+
+    ``duration``
+        The time (in seconds) spent before the failure.
+
+    ``exception``
+        The raised exception.
+    """
+    def __init__(self, mutant, duration, exception):
+        super(AssetMutationFailed, self).__init__(mutant)
+        self.duration = duration
+        self.exception = exception
@@ -0,0 +1,221 @@
+import os
+import glob
+import stat
+from fnmatch import fnmatch
+from pyramid_assetmutator.compat import scandir
+from pyramid_assetmutator.utils import get_abspath, format_stat, has_magic, \
+                                       glob_to_regex
+
+
+class SourceIndex(object):
+    """
+    In-memory index of asset source files used for batch processing.
+
+    Each directory tree is walked (via :func:`os.scandir` where available) at
+    most once, recording every file's stat info by extension, so that all of
+    the ``each_boot`` specifications can be matched against the index rather
+    than rescanning the filesystem, and so that the recorded stat info can be
+    reused for change detection.
+
+    Hidden (dot-prefixed) files and directories, as well as the ``ignore``
+    directories (e.g. the ``mutated_path``, so that mutated outputs are never
+    mutated again), are left out of the index. Symlinked directories are
+    followed, but every directory is only walked once (so that symlink cycles,
+    e.g. in linked ``node_modules``, never yield a file more than once).
+
+    Only recursive (``**``) patterns walk a directory tree; any other pattern
+    only lists the directories it can match.
+    """
+    def __init__(self, ignore=()):
+        self.ignore = frozenset(os.path.normpath(path) for path in ignore)
+        self.roots = []
+        self.stats = {}
+        self.by_ext = {}
+
+    def _add(self, path, statinfo):
+        self.stats[path] = format_stat(statinfo)
+        ext = os.path.splitext(path)[-1][1:]
+        self.by_ext.setdefault(ext, []).append(path)
+
+    def _walk(self, root):
+        """
+        Walks the ``root`` directory tree and adds all of its files to the
+        index.
+        """
+        try:
+            statinfo = os.stat(root)
+        except OSError:
+            return
+
+        visited = set([(statinfo.st_dev, statinfo.st_ino)])
+        stack = [root]
+
+        def visit(statinfo):
+            key = (statinfo.st_dev, statinfo.st_ino)
+            if key in visited:
+                return False
+            visited.add(key)
+            return True
+
+        while stack:
+            dirpath = stack.pop()
+
+            if scandir is not None:
+                try:
+                    entries = list(scandir(dirpath))
+                except OSError:
+                    continue
+
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+
+                    try:
+                        if entry.is_dir():
+                            # (DirEntry.stat() lacks st_ino on Windows)
+                            if entry.path not in self.ignore and \
+                               visit(os.stat(entry.path)):
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            self._add(entry.path, entry.stat())
+                    except OSError:
+                        pass
+            else: # pragma: no cover
+                try:
+                    names = os.listdir(dirpath)
+                except OSError:
+                    continue
+
+                for name in names:
+                    if name.startswith('.'):
+                        continue
+
+                    path = os.path.join(dirpath, name)
+                    try:
+                        statinfo = os.stat(path)
+                    except OSError:
+                        continue
+
+                    if stat.S_ISDIR(statinfo.st_mode):
+                        if path not in self.ignore and visit(statinfo):
+                            stack.append(path)
+                    elif stat.S_ISREG(statinfo.st_mode):
+                        self._add(path, statinfo)
+
+    def _is_ignored(self, path):
+        for dirpath in self.ignore:
+            if path.startswith(dirpath + os.sep):
+                return True
+
+        return False
+
+    def _list(self, pattern):
+        """
+        Returns the files matching the non-recursive glob ``pattern`` (adding
+        them to the index).
+        """
+        paths = []
+
+        for path in glob.glob(pattern):
+            if os.path.basename(path).startswith('.') or \
+               self._is_ignored(path):
+                continue
+
+            if path not in self.stats:
+                try:
+                    statinfo = os.stat(path)
+                except OSError:
+                    continue
+
+                if not stat.S_ISREG(statinfo.st_mode):
+                    continue
+
+                self._add(path, statinfo)
+
+            paths.append(path)
+
+        return sorted(paths)
+
+    def scan(self, root):
+        """
+        Adds the ``root`` directory tree to the index (unless it, or one of its
+        parent directories, has already been scanned).
+        """
+        root = os.path.normpath(root)
+
+        for scanned in self.roots:
+            if root == scanned or root.startswith(scanned + os.sep):
+                return
+
+        # Drop any previously scanned subdirectories of the new root
+        prefix = root + os.sep
+        self.roots = [r for r in self.roots if not r.startswith(prefix)]
+        for path in [p for p in self.stats if p.startswith(prefix)]:
+            del self.stats[path]
+        for ext, paths in self.by_ext.items():
+            self.by_ext[ext] = [p for p in paths if not p.startswith(prefix)]
+
+        self.roots.append(root)
+        self._walk(root)
+
+    def match(self, pattern, excludes=()):
+        """
+        Returns a sorted list of the absolute paths of the files matching the
+        passed glob ``pattern`` (an asset specification or absolute path, which
+        may contain ``**`` to match any number of nested directories).
+
+        Files matching any of the ``excludes`` patterns are skipped. Exclude
+        patterns which are asset specifications or absolute paths are matched
+        against the full path, while any others (e.g. ``_*.sass``) are matched
+        against the filename.
+        """
+        pattern = os.path.normpath(get_abspath(pattern))
+
+        if not has_magic(pattern):
+            paths = [pattern] if os.path.isfile(pattern) else []
+        elif '**' not in pattern:
+            paths = self._list(pattern)
+        else:
+            # Scan the deepest directory without any globbing characters
+            parts = pattern.split(os.sep)
+            for i, part in enumerate(parts):
+                if has_magic(part):
+                    break
+            root = os.sep.join(parts[:i]) or os.sep
+            self.scan(root)
+
+            ext = os.path.splitext(pattern)[-1][1:]
+            if ext and not has_magic(ext):
+                candidates = self.by_ext.get(ext, [])
+            else:
+                candidates = self.stats
+
+            regex = glob_to_regex(pattern)
+            paths = sorted(p for p in candidates if regex.match(p))
+
+        if excludes:
+            paths = [p for p in paths if not self.is_excluded(p, excludes)]
+
+        return paths
+
+    def is_excluded(self, path, excludes):
+        """
+        Returns ``True`` if ``path`` matches any of the ``excludes`` patterns.
+        """
+        for exclude in excludes:
+            if ':' in exclude or os.path.isabs(exclude):
+                regex = glob_to_regex(os.path.normpath(get_abspath(exclude)))
+                if regex.match(path):
+                    return True
+            elif fnmatch(os.path.basename(path), exclude):
+                return True
+
+        return False
+
+    def get_stat(self, path):
+        """
+        Returns the indexed stat info for ``path`` (formatted like
+        :func:`~pyramid_assetmutator.utils.get_stat`), or ``None`` if the file
+        is not in the index.
+        """
+        return self.stats.get(path)
@@ -0,0 +1,185 @@
+import threading
+from bisect import bisect_left
+from pyramid.response import Response
+
+
+# Default histogram buckets (in seconds), roughly matching the Prometheus client
+# defaults.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class MetricsSink(object):
+    """
+    Base (no-op) metrics sink. Subclass this and override :meth:`incr` and
+    :meth:`observe` to forward metrics to your own collection system (e.g.
+    statsd), then register it via
+    ``config.set_assetmutator_metrics_sink(sink)``.
+    """
+    def incr(self, name, value=1, **labels):
+        """
+        Increment the counter ``name`` (with the specified ``labels``) by
+        ``value``.
+        """
+        pass
+
+    def observe(self, name, value, **labels):
+        """
+        Record ``value`` in the histogram ``name`` (with the specified
+        ``labels``).
+        """
+        pass
+
+
+class MemoryMetricsSink(MetricsSink):
+    """
+    Thread-safe metrics sink which keeps all counters and histograms in memory.
+    Values can be inspected via :meth:`snapshot` or exported in the Prometheus
+    text format via :meth:`render_prometheus`.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Discard all of the recorded values.
+        """
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def incr(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            hist = self.histograms.get(key)
+
+            if hist is None:
+                hist = self.histograms[key] = dict(
+                    count=0, sum=0.0, buckets=[0] * (len(self.buckets) + 1)
+                )
+
+            hist['count'] += 1
+            hist['sum'] += value
+            hist['buckets'][bisect_left(self.buckets, value)] += 1
+
+    def snapshot(self):
+        """
+        Returns a plain dict copy of the recorded values, e.g.::
+
+            {'counters': {
+                 ('assetmutator_compile_failures_total',
+                  (('mutator', 'lessc'),)): 1,
+             },
+             'histograms': {
+                 ('assetmutator_compile_seconds',
+                  (('mutator', 'lessc'),)): {'count': 2, 'sum': 0.53,
+                                             'buckets': [...]},
+             }}
+
+        Keys are ``(name, labels)`` tuples, where ``labels`` is a sorted tuple
+        of ``(label, value)`` pairs.
+        """
+        with self.lock:
+            return dict(
+                counters=dict(self.counters),
+                histograms=dict(
+                    (key, dict(count=hist['count'], sum=hist['sum'],
+                               buckets=list(hist['buckets'])))
+                    for key, hist in self.histograms.items()
+                ),
+            )
+
+    def value(self, name, **labels):
+        """
+        Convenience method which returns the current value of a counter, or
+        the observation count of a histogram (``0`` if nothing was recorded).
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            if key in self.histograms:
+                return self.histograms[key]['count']
+            return self.counters.get(key, 0)
+
+    def render_prometheus(self):
+        """
+        Returns the recorded values formatted using the Prometheus text
+        exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, series in _group(snapshot['counters']):
+            lines.append('# TYPE %s counter' % name)
+            for labels, value in series:
+                lines.append('%s%s %s' % (name, _format_labels(labels),
+                                          _format_value(value)))
+
+        for name, series in _group(snapshot['histograms']):
+            lines.append('# TYPE %s histogram' % name)
+            for labels, hist in series:
+                cumulative = 0
+                bounds = [_format_value(b) for b in self.buckets] + ['+Inf']
+                for bound, count in zip(bounds, hist['buckets']):
+                    cumulative += count
+                    lines.append('%s_bucket%s %s' % (
+                        name, _format_labels(labels + (('le', bound),)),
+                        cumulative
+                    ))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels),
+                                              _format_value(hist['sum'])))
+                lines.append('%s_count%s %s' % (name, _format_labels(labels),
+                                                hist['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _group(values):
+    """
+    Groups ``{(name, labels): value}`` items by metric name (sorted).
+    """
+    grouped = {}
+
+    for (name, labels), value in values.items():
+        grouped.setdefault(name, []).append((labels, value))
+
+    return [(name, sorted(grouped[name])) for name in sorted(grouped)]
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, ('%s' % value).replace('\\', '\\\\')
+                                        .replace('"', '\\"')
+                                        .replace('\n', '\\n'))
+        for key, value in labels
+    )
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return '%s' % value
+
+
+def metrics_view(request):
+    """
+    A Pyramid view which exports the values of the configured
+    :class:`MemoryMetricsSink` in the Prometheus text format.
+    """
+    sink = request.registry.settings.get('assetmutator.metrics_sink')
+
+    if not hasattr(sink, 'render_prometheus'):
+        return Response('', content_type='text/plain', charset='utf-8')
+
+    return Response(sink.render_prometheus(),
+                    content_type='text/plain', charset='utf-8')
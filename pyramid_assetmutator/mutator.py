@@ -1,19 +1,272 @@
 import os
 import re
-import glob
+import json
+import time
 import shlex
+import base64
+import hashlib
+import logging
+import threading
 import subprocess
-from fnmatch import fnmatch
+from collections import namedtuple
+from timeit import default_timer
+from multiprocessing.pool import ThreadPool
 from pyramid.interfaces import IRendererFactory
 from pyramid.renderers import render
+from pyramid.threadlocal import manager
+from pyramid_assetmutator.compat import replace_file, get_ident
 from pyramid_assetmutator.utils import get_abspath, get_stat, hexhashify, \
-                                       compute_md5
+                                       compute_md5, LRUCache, \
+                                       get_pattern_matcher, get_temp_path, \
+                                       get_path_lock, get_cpu_count, \
+                                       store_content, compute_sha1, \
+                                       get_concurrency_limit, link_file
+from pyramid_assetmutator.events import AssetMutationStarted, AssetMutated, \
+                                        AssetMutationFailed
+from pyramid_assetmutator.index import SourceIndex
+from pyramid_assetmutator.scheduler import REQUEST, BATCH
+
+
+logger = logging.getLogger(__name__)
+
+
+# Digests of rendered template assets, keyed by source, fingerprint and the
+# rendering values (or only those of the configured ``template_context_keys``)
+rendered_digests = LRUCache(maxsize=1024)
+
+# Subresource Integrity values of mutated assets, keyed by their full path
+integrity_values = LRUCache(maxsize=4096)
+
+# Failed mutator runs (their expiry time and error message), keyed by the
+# mutator command and the output file (and thus the source fingerprint)
+failed_runs = LRUCache(maxsize=1024)
+
+# The last good output (new path and full path) of each asset, keyed by the
+# asset path and the mutator command
+last_outputs = LRUCache(maxsize=4096)
+
+# Size of the chunks in which mutator output is streamed to disk
+CHUNK_SIZE = 64 * 1024
+# Maximum amount of mutator stdout/stderr data kept for error messages
+MAX_ERROR_OUTPUT = 64 * 1024
+
+
+def run_command(cmd, src_fullpath, dest_fullpath, hashers=(), timeout=None):
+    """
+    Runs the mutator command ``cmd`` for ``src_fullpath``, streaming its output
+    (in chunks) to a temporary file which is atomically renamed to
+    ``dest_fullpath`` once the command has completed successfully. Memory usage
+    is therefore constant regardless of the size of the mutated output.
+
+    The stderr output of the command is drained concurrently (keeping at most
+    ``MAX_ERROR_OUTPUT`` bytes of it), and any output to stderr (or a non-zero
+    return code) raises an :exc:`EnvironmentError`.
+
+    Each of the (:mod:`hashlib` style) ``hashers`` is updated with the output
+    on the fly. Returns the number of bytes written.
+
+    If the command takes longer than ``timeout`` seconds, it is killed and an
+    :exc:`EnvironmentError` is raised.
+    """
+    dest_dirpath = os.path.normpath(os.path.dirname(dest_fullpath))
+
+    if not os.path.exists(dest_dirpath):
+        try:
+            os.makedirs(dest_dirpath)
+        except OSError:
+            if not os.path.isdir(dest_dirpath):
+                raise
+
+    proc = subprocess.Popen(
+        shlex.split('%s %s' % (cmd, src_fullpath), posix=False),
+        stdout=subprocess.PIPE,
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    proc.stdin.close()
+
+    err = []
+    def drain_stderr():
+        size = 0
+        for chunk in iter(lambda: proc.stderr.read(CHUNK_SIZE), b''):
+            if size < MAX_ERROR_OUTPUT:
+                err.append(chunk[:MAX_ERROR_OUTPUT - size])
+            size += len(chunk)
+
+    stderr_thread = threading.Thread(target=drain_stderr)
+    stderr_thread.daemon = True
+    stderr_thread.start()
+
+    timed_out = []
+    def kill():
+        timed_out.append(True)
+        proc.kill()
+
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    tmp_fullpath = get_temp_path(dest_fullpath)
+    head = b''
+    size = 0
+
+    try:
+        with open(tmp_fullpath, 'wb') as f:
+            for chunk in iter(lambda: proc.stdout.read(CHUNK_SIZE), b''):
+                if len(head) < MAX_ERROR_OUTPUT:
+                    head += chunk[:MAX_ERROR_OUTPUT - len(head)]
+                f.write(chunk)
+                for hasher in hashers:
+                    hasher.update(chunk)
+                size += len(chunk)
+
+        proc.wait()
+        if timer is not None:
+            timer.cancel()
+        stderr_thread.join()
+        proc.stdout.close()
+        proc.stderr.close()
+        err = b''.join(err)
+
+        if timed_out:
+            raise EnvironmentError('Timed out after %ss when attempting to '
+                                   'execute %s.' % (timeout, cmd))
+
+        if proc.returncode != 0 or err:
+            errmsg = 'Return code %s when attempting to execute %s.\n\n%s\n\n%s'
+            raise EnvironmentError(errmsg % (proc.returncode, cmd, err, head))
+
+        replace_file(tmp_fullpath, dest_fullpath)
+    except:
+        if timer is not None:
+            timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        if os.path.exists(tmp_fullpath):
+            os.unlink(tmp_fullpath)
+        raise
+
+    return size
+
+
+def format_integrity(hasher):
+    """
+    Formats the digest of ``hasher`` as a Subresource Integrity value (e.g.
+    ``sha384-...``).
+    """
+    return '%s-%s' % (hasher.name,
+                      base64.b64encode(hasher.digest()).decode('ascii'))
+
+def write_integrity(dest_fullpath, value):
+    """
+    Persists the Subresource Integrity ``value`` of ``dest_fullpath`` (in a
+    ``.sri`` file alongside it) and caches it in memory.
+    """
+    sri_fullpath = dest_fullpath + '.sri'
+    tmp_fullpath = get_temp_path(sri_fullpath)
+
+    with open(tmp_fullpath, 'w') as f:
+        f.write(value)
+
+    replace_file(tmp_fullpath, sri_fullpath)
+    integrity_values.set(dest_fullpath, value)
+
+def discard_integrity(dest_fullpath):
+    """
+    Forgets the Subresource Integrity value of ``dest_fullpath`` (in memory and
+    on disk), e.g. when the file was remutated without computing a new one.
+    """
+    integrity_values.pop(dest_fullpath)
+
+    try:
+        os.unlink(dest_fullpath + '.sri')
+    except OSError:
+        pass
+
+def get_integrity(dest_fullpath, algorithm='sha384'):
+    """
+    Returns the Subresource Integrity value of ``dest_fullpath``. The value is
+    returned from memory if possible, otherwise it is read from the ``.sri``
+    file persisted alongside the mutated asset (or computed and persisted if
+    there is no such file).
+    """
+    value = integrity_values.get(dest_fullpath)
+
+    if value is not None and value.startswith(algorithm + '-'):
+        return value
+
+    try:
+        with open(dest_fullpath + '.sri') as f:
+            value = f.read().strip()
+    except IOError:
+        value = None
+
+    if value and value.startswith(algorithm + '-'):
+        integrity_values.set(dest_fullpath, value)
+    else:
+        hasher = hashlib.new(algorithm)
+
+        with open(dest_fullpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+
+        value = format_integrity(hasher)
+        write_integrity(dest_fullpath, value)
+
+    return value
+
+
+class ResolvedAsset(namedtuple('ResolvedAsset', ['path', 'src_fullpath',
+                                                 'dest_fullpath', 'new_path',
+                                                 'fingerprint', 'mutator'])):
+    """
+    A compact, immutable record of a resolved asset (as returned by
+    :attr:`Mutator.resolved`), which is kept in caches (e.g. the last good
+    outputs used by the ``failure_fallback`` setting) instead of the (much
+    larger) :class:`Mutator` instance itself.
+
+    ``path``
+        The asset specification (or absolute path) of the source.
+
+    ``src_fullpath``
+        The full path of the source.
+
+    ``dest_fullpath``
+        The full path of the mutated output.
+
+    ``new_path``
+        The asset specification (or absolute path) of the mutated output.
+
+    ``fingerprint``
+        The fingerprint of the source (as used in the mutated filename).
+
+    ``mutator``
+        The mutator command (e.g. ``lessc``).
+    """
+    __slots__ = ()
 
 
 class Mutator(object):
     """
     Mutator class for the pyramid_assetmutator add-on.
     """
+    # A Mutator is created for every view helper call, so avoid a per-instance
+    # __dict__
+    __slots__ = ('request', 'registry', 'settings', 'path', 'renderers',
+                 'rendering_val', 'mutators', 'prefix', 'check_method',
+                 'mutated_path', 'always_remutate', 'remutate_matcher',
+                 'metrics', 'context_keys', 'integrity_algorithm',
+                 'compile_socket', 'mutator', 'batch', 'index', 'excludes',
+                 'build_state', 'content_addressed', 'scheduler', 'priority',
+                 'failure_ttl', 'failure_fallback',
+                 'checksum', 'stat', 'fingerprint', 'exists', 'dest_dirpath',
+                 'parse_template', 'rendered_data', 'src_fullpath',
+                 'src_dirpath', 'src_filename', 'src_name', 'src_ext',
+                 'dest_filename', 'dest_fullpath', 'new_path')
+
     def __init__(self, request, path, **kw):
         """
         Initialize the Mutator class.
@@ -51,6 +304,27 @@ class Mutator(object):
         :type batch: bool
         :param batch: Specify that the class should perform batch processing
                       rather than request-based processing.
+
+        :type index: SourceIndex
+        :param index: A :class:`~pyramid_assetmutator.index.SourceIndex` to
+                      match batch processing patterns against (so that it can
+                      be shared between multiple batch ``Mutator`` instances).
+
+        :type excludes: list
+        :param excludes: A list of patterns for sources that should be skipped
+                         when batch processing.
+
+        :type build_state: BuildState
+        :param build_state: A :class:`~pyramid_assetmutator.state.BuildState`
+                            used to only remutate the changed sources when
+                            batch processing.
+
+        :type priority: int
+        :param priority: The priority of the mutator runs in the compile
+                         scheduler (see
+                         :mod:`pyramid_assetmutator.scheduler`). Defaults to
+                         ``BATCH`` when batch processing, and to ``REQUEST``
+                         otherwise.
         """
         self.request = request
         try:
@@ -72,6 +346,17 @@ class Mutator(object):
         self.check_method = self.settings['assetmutator.remutate_check']
         self.mutated_path = self.settings['assetmutator.mutated_path']
         self.always_remutate = self.settings['assetmutator.always_remutate']
+        self.remutate_matcher = get_pattern_matcher(self.always_remutate)
+        self.metrics = self.settings.get('assetmutator.metrics_sink')
+        self.context_keys = self.settings['assetmutator.template_context_keys']
+        self.integrity_algorithm = self.settings['assetmutator.integrity']
+        self.compile_socket = self.settings.get('assetmutator.compile_socket')
+        self.content_addressed = self.mutated_path and \
+            self.settings.get('assetmutator.content_addressed', False)
+        self.scheduler = self.settings.get('assetmutator.scheduler')
+        self.failure_ttl = self.settings.get('assetmutator.failure_ttl', 0)
+        self.failure_fallback = \
+            self.settings.get('assetmutator.failure_fallback', False)
 
         if self.mutated_path and not self.mutated_path.endswith(os.sep):
             self.mutated_path += os.sep
@@ -82,11 +367,17 @@ class Mutator(object):
             raise RuntimeError('No mutators were found.')
 
         self.batch = kw.get('batch', False)
+        self.index = kw.get('index')
+        self.excludes = kw.get('excludes') or ()
+        self.build_state = kw.get('build_state')
+        self.priority = kw.get('priority', BATCH if self.batch else REQUEST)
         self.checksum = None
         self.stat = None
+        self.fingerprint = None
         self.exists = False
         self.dest_dirpath = None
         self.parse_template = False
+        self.rendered_data = None
 
         if not self.batch:
             self._configure_paths()
@@ -97,10 +388,26 @@ class Mutator(object):
         Property method to check and see if the initialized asset path has
         already been mutated.
         """
+        if not self.exists:
+            # Prioritize (or wait for) the asset if it is still pending in the
+            # background each_boot warmup
+            warmup = self.settings.get('assetmutator.warmup')
+            if warmup is not None and not warmup.ready:
+                warmup.wait(self.src_fullpath)
+
         self.exists = self.exists or os.path.exists(self.dest_fullpath)
 
         return self.exists
 
+    @property
+    def resolved(self):
+        """
+        Returns a :class:`ResolvedAsset` record of the initialized asset.
+        """
+        return ResolvedAsset(self.path, self.src_fullpath, self.dest_fullpath,
+                             self.new_path, self.fingerprint,
+                             self.mutator['cmd'])
+
     @property
     def should_mutate(self):
         """
@@ -109,15 +416,7 @@ class Mutator(object):
         if self.is_mutated is not True:
             return True
 
-        if self.always_remutate:
-            if '*' in self.always_remutate or self.path in self.always_remutate:
-                return True
-            else:
-                for val in self.always_remutate:
-                    if fnmatch(self.path, val):
-                        return True
-
-        return False
+        return self.remutate_matcher(self.path)
 
     def _configure_paths(self):
         """
@@ -151,6 +450,10 @@ class Mutator(object):
             raise RuntimeError('No mutator found for %s.' % self.src_ext)
 
         dest_ext = self.mutator['ext']
+        dest_name = self.src_name
+        if self.mutator.get('variant'):
+            # Variants of the same source are stored side by side
+            dest_name += '-%s' % self.mutator['variant']
 
         # Parse the fingerprint
         if self.check_method == 'exists':
@@ -164,14 +467,22 @@ class Mutator(object):
             fingerprint = self.checksum
         else: # self.check_method == 'stat'
             if self.batch:
-                self.stat = get_stat(self.src_fullpath)
+                self.stat = (self.index and
+                             self.index.get_stat(self.src_fullpath)) or \
+                            get_stat(self.src_fullpath)
             else:
                 self.stat = self.stat or get_stat(self.src_fullpath)
 
             fingerprint = hexhashify(self.src_fullpath) + hexhashify(self.stat)
 
+        if self.parse_template and not self.batch:
+            # The mutated output depends on the rendering context as well
+            fingerprint += self._template_digest(fingerprint)
+
+        self.fingerprint = fingerprint
+
         # Set the destination filename/path
-        self.dest_filename = '%s%s.%s.%s' % (self.prefix, self.src_name,
+        self.dest_filename = '%s%s.%s.%s' % (self.prefix, dest_name,
                                              fingerprint, dest_ext)
         self.dest_fullpath = os.path.join(self.dest_dirpath, self.dest_filename)
 
@@ -184,66 +495,395 @@ class Mutator(object):
                                                 self.dest_filename,
                                                 self.path)
 
+    def _render_template(self):
+        """
+        Renders the initialized asset using the matching template renderer and
+        returns the rendered data (as UTF-8 encoded bytes).
+        """
+        # The template may be rendered lazily (i.e. when a cached digest was
+        # used), possibly in another thread
+        manager.push({'registry': self.registry, 'request': self.request})
+        try:
+            data = render(self.path, self.rendering_val, request=self.request)
+        finally:
+            manager.pop()
+
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        return data
+
+    def _template_digest(self, fingerprint):
+        """
+        Returns a digest of the rendered template output. The digest is cached
+        for the source ``fingerprint`` and the rendering values (only the
+        values of the ``template_context_keys``, if any are configured), so
+        that identical rendering contexts don't need to be rerendered. Unless
+        keys are configured, contexts which can't be serialized to JSON are
+        rendered on each call.
+        """
+        cache_key = None
+
+        if self.context_keys:
+            context = tuple((key, repr(self.rendering_val.get(key)))
+                            for key in self.context_keys)
+        else:
+            try:
+                context = hashlib.md5(json.dumps(
+                    self.rendering_val, sort_keys=True
+                ).encode('utf-8')).hexdigest()
+            except (TypeError, ValueError):
+                context = None
+
+        if context is not None:
+            cache_key = (self.src_fullpath, fingerprint, context)
+            digest = rendered_digests.get(cache_key)
+
+            if digest is not None:
+                return digest
+
+        self.rendered_data = self._render_template()
+        digest = hashlib.md5(self.rendered_data).hexdigest()[:12]
+
+        if cache_key is not None:
+            rendered_digests.set(cache_key, digest)
+
+        return digest
+
     def _process_template(self, source):
         """
-        Renders a file using the specified renderer and returns the new source
-        filename to use for the mutator.
+        Renders a file using the specified renderer into a temporary source
+        file (unique to the current process and thread, as every rendering
+        context has its own output) for the mutator, and returns its full
+        path.
         """
-        self.src_filename = self.prefix + os.path.splitext(self.src_filename)[0]
+        data = self.rendered_data
+        if data is None:
+            data = self._render_template()
+
+        name, ext = os.path.splitext(os.path.splitext(self.src_filename)[0])
+        self.src_filename = '%s%s.%s-%s%s' % (self.prefix, name, os.getpid(),
+                                              get_ident(), ext)
         self.src_fullpath = os.path.join(self.dest_dirpath, self.src_filename)
         self.prefix = ''
 
-        data = render(source, self.rendering_val, request=self.request)
-
-        with open(self.src_fullpath, 'w') as f:
+        with open(self.src_fullpath, 'wb') as f:
             f.write(data)
 
-    def _run_mutator(self):
+        return self.src_fullpath
+
+    def _registered_name(self):
         """
-        Runs the mutator for the initialized asset.
+        Returns the name under which the mutator command of the initialized
+        asset is registered (see
+        :func:`~pyramid_assetmutator.daemon.get_mutator_table`), or ``None``.
         """
-        cmd = '%s %s' % (self.mutator['cmd'], self.src_fullpath)
+        from pyramid_assetmutator.daemon import get_mutator_table
+
+        for name, cmd in get_mutator_table(self.settings).items():
+            if cmd == self.mutator['cmd']:
+                return name
+
+        return None
 
-        proc = subprocess.Popen(
-            shlex.split(cmd, posix=False),
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+    def _run_remote(self, name):
+        """
+        Runs the mutator registered as ``name`` for the initialized asset via
+        the host-wide compile server (see :mod:`pyramid_assetmutator.daemon`)
+        and returns the size of the mutated output.
+        """
+        from pyramid_assetmutator.daemon import get_client, get_mutator_table
+
+        # Existing output is only remutated on purpose (e.g. always_remutate)
+        client = get_client(self.compile_socket,
+                            mutators=get_mutator_table(self.settings))
+        response = client.compile(
+            name, self.src_fullpath, self.dest_fullpath,
+            integrity=self.integrity_algorithm,
+            force=self.batch or self.exists,
+            max_concurrency=self.mutator.get('max_concurrency'),
         )
-        data, err = proc.communicate()
 
-        if proc.returncode != 0 or err:
-            errmsg = 'Return code %s when attempting to execute %s.\n\n%s\n\n%s'
-            raise EnvironmentError(errmsg % (proc.returncode,
-                                             self.mutator['cmd'], err, data))
+        if response['integrity']:
+            integrity_values.set(self.dest_fullpath, response['integrity'])
+        else:
+            discard_integrity(self.dest_fullpath)
 
-        new_dirname = os.path.normpath(os.path.dirname(self.dest_fullpath))
+        return response['size']
 
-        if not os.path.exists(new_dirname):
-            os.makedirs(new_dirname)
+    def _run_mutator(self, name=None):
+        """
+        Runs the mutator for the initialized asset (via the compile server if
+        the mutator is registered there as ``name``).
+        """
+        start = default_timer()
+        hashers = []
+        digest = None
 
-        with open(self.dest_fullpath, 'wb') as f:
-            f.write(data)
+        if self.integrity_algorithm:
+            hashers.append(hashlib.new(self.integrity_algorithm))
+        if self.content_addressed:
+            hashers.append(hashlib.sha1())
+
+        try:
+            if name:
+                size = self._run_remote(name)
+                hashers = []
+                if self.content_addressed:
+                    digest = compute_sha1(self.dest_fullpath)
+            else:
+                size = run_command(self.mutator['cmd'], self.src_fullpath,
+                                   self.dest_fullpath, hashers=hashers)
+        except EnvironmentError:
+            if self.metrics is not None:
+                self.metrics.incr('assetmutator_compile_failures_total',
+                                  mutator=self.mutator['cmd'])
+            raise
+
+        if self.metrics is not None:
+            self.metrics.observe('assetmutator_compile_seconds',
+                                 default_timer() - start,
+                                 mutator=self.mutator['cmd'])
+            self.metrics.incr('assetmutator_compile_input_bytes_total',
+                              os.path.getsize(self.src_fullpath),
+                              mutator=self.mutator['cmd'])
+            self.metrics.incr('assetmutator_compile_output_bytes_total',
+                              size, mutator=self.mutator['cmd'])
+
+        if self.content_addressed:
+            # Identical outputs share a single (content-addressed) file
+            digest = digest or hashers.pop().hexdigest()
+            store_content(self.dest_dirpath, self.dest_fullpath, digest)
+
+        if hashers:
+            write_integrity(self.dest_fullpath, format_integrity(hashers[0]))
+        elif not name:
+            # Never keep the integrity value of the previous output around
+            discard_integrity(self.dest_fullpath)
+
+    def _schedule(self, name):
+        """
+        Runs the mutator for the initialized asset once the
+        :class:`~pyramid_assetmutator.scheduler.CompileScheduler` (if any)
+        grants it a slot.
+        """
+        if self.scheduler is None:
+            self._run_mutator(name)
+        else:
+            self.scheduler.run(self.priority, self._run_mutator, name)
+
+    def _source_stat(self):
+        return (self.index and self.index.get_stat(self.src_fullpath)) or \
+               get_stat(self.src_fullpath)
+
+    def _is_built(self):
+        """
+        Checks the build state to see if the initialized asset is up to date,
+        reusing the previous output if only the stat info of the source (but
+        not its contents) changed.
+        """
+        record = self.build_state.get(self.src_fullpath)
+
+        if record is None or record.cmd != self.mutator['cmd'] or \
+           self.remutate_matcher(self.path):
+            return False
+
+        stat = self._source_stat()
+
+        if record.dest == self.dest_fullpath and \
+           not self.build_state.is_stale(record, stat):
+            return True
+
+        if not os.path.exists(record.dest):
+            return False
+
+        digest = self.checksum or compute_md5(self.src_fullpath)
+        if digest != record.digest:
+            return False
+
+        if record.dest != self.dest_fullpath:
+            # Link the (identical) previous output to the new filename, which
+            # also keeps content addressed outputs stored only once
+            for suffix in ('', '.sri'):
+                if suffix and not os.path.exists(record.dest + suffix):
+                    continue
+                link_file(record.dest + suffix, self.dest_fullpath + suffix)
+
+        self.build_state.record(self.src_fullpath, stat, digest,
+                                self.mutator['cmd'], self.dest_fullpath)
+
+        return True
+
+    def _record_build(self):
+        self.build_state.record(self.src_fullpath, self._source_stat(),
+                                self.checksum or
+                                compute_md5(self.src_fullpath),
+                                self.mutator['cmd'], self.dest_fullpath)
+
+    def _mutate_asset(self):
+        """
+        Renders (if needed) and mutates the initialized asset, emitting the
+        mutation lifecycle events.
+
+        If a ``failure_ttl`` is configured, a failed mutator run is remembered
+        (for the current fingerprint of the source) and its error is raised
+        again right away, without running the mutator, until the source
+        changes or the TTL expires.
+        """
+        failure_key = None
+
+        if self.failure_ttl:
+            # The dest_fullpath doesn't change with the source for a
+            # remutate_check of exists, so its stat info is part of the key
+            failure_key = (self.mutator['cmd'], self.dest_fullpath,
+                           self.stat or self._source_stat())
+            failure = failed_runs.get(failure_key)
+
+            if failure is not None and failure[0] > time.time():
+                exc = EnvironmentError(failure[1])
+                self.registry.notify(AssetMutationFailed(self, 0, exc))
+                raise exc
+
+        self.registry.notify(AssetMutationStarted(self))
+        start = default_timer()
+        rendered_fullpath = None
+
+        try:
+            if self.parse_template and not self.batch:
+                rendered_fullpath = self._process_template(self.path)
+
+            # The compile server only runs registered mutators (and enforces
+            # their max_concurrency itself)
+            name = self.compile_socket and self._registered_name()
+
+            if self.mutator.get('max_concurrency') and not name:
+                # Only take a scheduler slot once the mutator's own limit lets
+                # the run through, so that throttled runs never hold slots
+                with get_concurrency_limit(
+                    self.mutator['cmd'], self.mutator['max_concurrency'],
+                    interprocess=self.mutator.get('interprocess', False)
+                ):
+                    self._schedule(name)
+            else:
+                self._schedule(name)
+        except Exception as exc:
+            if self.failure_ttl and isinstance(exc, EnvironmentError):
+                failed_runs.set(failure_key,
+                                (time.time() + self.failure_ttl, str(exc)))
+
+            self.registry.notify(
+                AssetMutationFailed(self, default_timer() - start, exc)
+            )
+            raise
+        finally:
+            if rendered_fullpath is not None and \
+               os.path.exists(rendered_fullpath):
+                os.unlink(rendered_fullpath)
+
+        self.registry.notify(AssetMutated(self, default_timer() - start))
 
     def mutate(self):
         """
         Mutate the asset(s) and return the new asset specification path.
         """
         if self.batch:
-            for asset in glob.glob(get_abspath(self.path)):
+            if self.index is None:
+                # Never match the mutated outputs themselves
+                self.index = SourceIndex(
+                    ignore=[get_abspath(self.mutated_path)]
+                    if self.mutated_path else ()
+                )
+            mutator = self.mutator
+
+            for asset in self.index.match(self.path, self.excludes):
                 self.path = asset
+                self.mutator = mutator
                 self._configure_paths()
-                self._run_mutator()
-        else:
-            if self.should_mutate:
-                if self.parse_template:
-                    self._process_template(self.path)
 
-                self._run_mutator()
-                self.exists = True
+                if self.build_state is None:
+                    self._mutate_asset()
+                elif self._is_built():
+                    self.registry.notify(AssetMutated(self, 0, cache_hit=True))
+                else:
+                    self._mutate_asset()
+                    self._record_build()
+        else:
+            should_mutate = self.should_mutate
+            lock = None
+            output = None
+
+            if should_mutate:
+                # Only one thread at a time may write the output file
+                lock = get_path_lock(self.dest_fullpath)
+                lock.acquire()
+
+                if not self.exists and os.path.exists(self.dest_fullpath):
+                    # Another thread mutated the asset in the meantime
+                    self.exists = True
+                    should_mutate = False
+
+            try:
+                if self.metrics is not None:
+                    self.metrics.incr(
+                        'assetmutator_should_mutate_total',
+                        outcome='mutate' if should_mutate else 'hit'
+                    )
+
+                if should_mutate:
+                    try:
+                        self._mutate_asset()
+                    except EnvironmentError:
+                        output = self._last_output()
+                        if output is None:
+                            raise
+
+                        logger.warning('Unable to mutate "%s", falling back '
+                                       'to "%s".' % (self.path,
+                                                     output.new_path))
+                        # Serve the last good output instead
+                        self.new_path = output.new_path
+                        self.dest_fullpath = output.dest_fullpath
+
+                    self.exists = True
+                else:
+                    self.registry.notify(AssetMutated(self, 0, cache_hit=True))
+            finally:
+                if lock is not None:
+                    lock.release()
+
+            if self.failure_fallback and output is None:
+                last_outputs.set((self.path, self.mutator['cmd']),
+                                 self.resolved)
 
             return self.new_path
 
+    def _last_output(self):
+        """
+        Returns the :class:`ResolvedAsset` of the last good output of the
+        initialized asset if the ``failure_fallback`` setting is enabled (and
+        the output still exists), or ``None``.
+        """
+        if not self.failure_fallback:
+            return None
+
+        output = last_outputs.get((self.path, self.mutator['cmd']))
+
+        if output is None or not os.path.exists(output.dest_fullpath):
+            return None
+
+        return output
+
+    def integrity(self):
+        """
+        Return the Subresource Integrity value (e.g. ``sha384-...``) of the
+        mutated version of the initialized asset.
+        """
+        if not self.is_mutated:
+            raise RuntimeError('Source not found. Has it been mutated?')
+
+        return get_integrity(self.dest_fullpath,
+                             self.integrity_algorithm or 'sha384')
+
     def mutated_data(self):
         """
         Return the mutated source of the initialized asset.
@@ -255,3 +895,83 @@ class Mutator(object):
             data = f.read()
 
         return data
+
+
+def mutate_all(request, paths, max_workers=None, **kw):
+    """
+    Resolves all of the asset ``paths`` at once, mutates the ones which need
+    to be (re)mutated concurrently (in a pool of at most ``max_workers``
+    threads, which defaults to the number of CPUs) and returns the list of new
+    asset specification paths (in the same order as ``paths``).
+
+    Any additional keyword arguments are passed to each
+    :class:`~pyramid_assetmutator.mutator.Mutator`. If mutating any of the
+    assets fails, the (first) exception is raised once all of them have been
+    processed.
+    """
+    mutants = [Mutator(request, path, **kw) for path in paths]
+
+    return _mutate_concurrently(request, mutants, max_workers)
+
+def mutate_variants(request, path, variants, max_workers=None, **kw):
+    """
+    Mutates the asset ``path`` with each of the ``variants`` (a list of
+    mutator dictionaries, see :func:`pyramid_assetmutator.assign_assetvariants`)
+    concurrently, like :func:`mutate_all`, and returns the list of new asset
+    specification paths (in the same order as ``variants``).
+    """
+    mutants = [Mutator(request, path, mutator=variant, **kw)
+               for variant in variants]
+
+    return _mutate_concurrently(request, mutants, max_workers)
+
+def _mutate_concurrently(request, mutants, max_workers=None):
+    stale = []
+    seen = set()
+    warmup = None
+    if mutants:
+        warmup = mutants[0].settings.get('assetmutator.warmup')
+        if warmup is not None and warmup.ready:
+            warmup = None
+
+    for mutant in mutants:
+        if mutant.dest_fullpath in seen:
+            continue
+        seen.add(mutant.dest_fullpath)
+
+        if warmup is not None and warmup.is_pending(mutant.src_fullpath):
+            # Waiting for the background warmup (or mutating the asset right
+            # away) happens in the pool, rather than one asset at a time here
+            stale.append(mutant)
+        elif mutant.should_mutate:
+            stale.append(mutant)
+        else:
+            mutant.mutate()
+
+    if len(stale) > 1:
+        registry = mutants[0].registry
+        errors = []
+
+        def mutate(mutant):
+            manager.push({'registry': registry, 'request': request})
+            try:
+                mutant.mutate()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                manager.pop()
+
+        pool = ThreadPool(min(len(stale), max_workers or get_cpu_count()))
+        try:
+            pool.map(mutate, stale)
+        finally:
+            pool.close()
+            pool.join()
+
+        if errors:
+            raise errors[0]
+    else:
+        for mutant in stale:
+            mutant.mutate()
+
+    return [mutant.new_path for mutant in mutants]
@@ -0,0 +1,168 @@
+"""
+Build profiles for batch mutation.
+
+When the ``assetmutator.build_profile`` setting is defined, every asset
+processed by ``each_boot`` is recorded (with its mutator, duration, input and
+output sizes, and whether it was skipped or failed), and a JSON report listing
+the slowest assets first is written to the configured path once all of them
+have been processed. A human readable summary of a report can be printed
+with::
+
+    python -m pyramid_assetmutator.profiling build-profile.json
+"""
+import os
+import sys
+import json
+import threading
+from pyramid_assetmutator.events import AssetMutated, AssetMutationFailed
+
+
+class BuildProfile(object):
+    """
+    Records the assets mutated by batch processing while it is subscribed to
+    the mutation events of a registry (see :meth:`subscribe`). The assets
+    mutated by requests meanwhile (e.g. during a background ``each_boot``) are
+    ignored. Instances may be shared between threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.registry = None
+
+    def subscribe(self, registry):
+        """
+        Starts recording the assets mutated via ``registry``.
+        """
+        self.registry = registry
+        registry.registerHandler(self.record, (AssetMutated,))
+        registry.registerHandler(self.record, (AssetMutationFailed,))
+
+    def unsubscribe(self):
+        if self.registry is not None:
+            self.registry.unregisterHandler(self.record, (AssetMutated,))
+            self.registry.unregisterHandler(self.record,
+                                            (AssetMutationFailed,))
+            self.registry = None
+
+    def record(self, event):
+        """
+        Records an :class:`~pyramid_assetmutator.events.AssetMutated` or
+        :class:`~pyramid_assetmutator.events.AssetMutationFailed` event (unless
+        it was triggered by a request).
+        """
+        mutant = event.mutant
+        if not getattr(mutant, 'batch', False):
+            return
+
+        failed = isinstance(event, AssetMutationFailed)
+
+        entry = {
+            'path': event.path,
+            'mutator': event.mutator['cmd'],
+            'seconds': event.duration,
+            'input_bytes': _getsize(mutant.src_fullpath),
+            'output_bytes': None if failed else
+                            _getsize(mutant.dest_fullpath),
+            'skipped': not failed and event.cache_hit,
+            'failed': failed,
+        }
+        if failed:
+            entry['error'] = '%s' % event.exception
+
+        with self.lock:
+            self.entries.append(entry)
+
+    def report(self):
+        """
+        Returns the (JSON serializable) report: the ``assets`` sorted by
+        slowest first, along with ``totals`` and the total ``seconds`` spent
+        per ``mutator``.
+        """
+        with self.lock:
+            entries = sorted(self.entries, key=lambda e: (-e['seconds'],
+                                                          e['path']))
+
+        mutators = {}
+        for entry in entries:
+            mutators[entry['mutator']] = \
+                mutators.get(entry['mutator'], 0) + entry['seconds']
+
+        return {
+            'assets': entries,
+            'mutators': mutators,
+            'totals': {
+                'assets': len(entries),
+                'mutated': len([e for e in entries
+                                if not e['skipped'] and not e['failed']]),
+                'skipped': len([e for e in entries if e['skipped']]),
+                'failed': len([e for e in entries if e['failed']]),
+                'seconds': sum(e['seconds'] for e in entries),
+            },
+        }
+
+    def write(self, path):
+        """
+        Writes the JSON report to ``path``.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+
+def _getsize(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def summarize(report, limit=10):
+    """
+    Returns a human readable summary of a build profile ``report``, listing
+    (at most ``limit`` of) the slowest assets.
+    """
+    totals = report['totals']
+    lines = ['Processed %s asset(s) in %.2fs: %s mutated, %s skipped, %s '
+             'failed.' % (totals['assets'], totals['seconds'],
+                          totals['mutated'], totals['skipped'],
+                          totals['failed'])]
+
+    if report['mutators']:
+        lines.append('')
+        lines.append('Time per mutator:')
+        for cmd, seconds in sorted(report['mutators'].items(),
+                                   key=lambda item: -item[1]):
+            lines.append('  %8.2fs  %s' % (seconds, cmd))
+
+    if report['assets']:
+        lines.append('')
+        lines.append('Slowest assets:')
+        for entry in report['assets'][:limit]:
+            if entry['failed']:
+                status = 'failed'
+            elif entry['skipped']:
+                status = 'skipped'
+            else:
+                status = '%s -> %s bytes' % (entry['input_bytes'],
+                                             entry['output_bytes'])
+            lines.append('  %8.2fs  %s (%s)' % (entry['seconds'],
+                                                entry['path'], status))
+
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Summarize a pyramid_assetmutator build profile.'
+    )
+    parser.add_argument('report', help='The path of the JSON report.')
+    parser.add_argument('--limit', type=int, default=10,
+                        help='Number of slowest assets to list (default: 10).')
+    options = parser.parse_args(argv)
+
+    with open(options.report) as f:
+        report = json.load(f)
+
+    sys.stdout.write(summarize(report, limit=options.limit) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import os
+import re
+import io
+from pyramid_assetmutator.utils import get_abspath
+
+
+# The file extensions of the templates which are scanned by default
+TEMPLATE_EXTENSIONS = ('.pt', '.jinja2', '.jinja', '.j2', '.mak', '.mako',
+                       '.html')
+
+# The view helpers which take an asset path (a list of asset paths for
+# ``urls``, or a bundle name for ``bundle_*``) as their first argument
+HELPER_RE = re.compile(
+    r'\bassetmutator_(?P<helper>urls|url|srcset|path|source|assetpath|'
+    r'integrity|bundle_url|bundle_path)\s*\('
+)
+LITERAL_RE = re.compile(
+    r'\s*(?P<q>[\'"])(?P<path>[^\'"\\]*)(?P=q)\s*(?P<end>[,)])'
+)
+LIST_RE = re.compile(
+    r'\s*(?:names\s*=\s*)?[\[(](?P<items>[^\])]*)[\])]\s*(?P<end>[,)])'
+)
+ITEM_RE = re.compile(r'\s*(?P<q>[\'"])(?P<path>[^\'"\\]*)(?P=q)\s*(?:,|$)')
+MUTATOR_RE = re.compile(
+    r'\s*(?:mutator\s*=\s*)?(?P<q>[\'"])(?P<mutator>[\w.-]+)(?P=q)\s*\)'
+)
+
+# Interpolation markers which indicate a (partially) dynamic string literal
+DYNAMIC_MARKERS = ('${', '{{', '{%', '%(')
+
+
+class TemplateScanner(object):
+    """
+    Statically scans templates for ``assetmutator_*`` view helper calls with a
+    string literal asset path (e.g.
+    ``assetmutator_url('myapp:static/app.coffee')``) so that the referenced
+    assets can be mutated when the application boots.
+
+    Discovered assets are collected as ``(path, mutator)`` tuples in
+    ``assets`` (where ``mutator`` is ``None`` unless a literal mutator name
+    was passed to the helper), the assets passed to ``assetmutator_srcset``
+    as ``(path, names)`` tuples in ``srcsets`` (where ``names`` is ``None``
+    unless a literal list of variant names was passed) and the names passed to
+    the ``assetmutator_bundle_*`` helpers in ``bundles``. The calls whose
+    arguments could not be resolved statically (e.g.
+    ``assetmutator_url(asset)``) are collected as ``(filename, lineno,
+    snippet)`` tuples in ``unresolved``.
+    """
+    def __init__(self, extensions=TEMPLATE_EXTENSIONS):
+        self.extensions = tuple(extensions)
+        self.assets = []
+        self.srcsets = []
+        self.bundles = []
+        self.unresolved = []
+        self.templates = 0
+
+    def _add(self, path, mutator):
+        asset = (path, mutator)
+        if asset not in self.assets:
+            self.assets.append(asset)
+
+    def _match_literal(self, text, pos):
+        literal = LITERAL_RE.match(text, pos)
+
+        if literal is None or \
+           any(m in literal.group('path') for m in DYNAMIC_MARKERS):
+            return None
+
+        return literal
+
+    def _match_list(self, text, pos):
+        match = LIST_RE.match(text, pos)
+        if match is None:
+            return None, None
+
+        items = match.group('items')
+        paths = []
+        end = len(items.rstrip())
+        pos = 0
+
+        while pos < end:
+            item = ITEM_RE.match(items, pos)
+            if item is None or \
+               any(m in item.group('path') for m in DYNAMIC_MARKERS):
+                return None, None
+
+            paths.append(item.group('path'))
+            pos = item.end()
+
+        return match, paths
+
+    def _scan_path(self, text, pos):
+        literal = self._match_literal(text, pos)
+        if literal is None:
+            return False
+
+        if literal.group('end') == ')':
+            self._add(literal.group('path'), None)
+            return True
+
+        mutator = MUTATOR_RE.match(text, literal.end())
+        if mutator is not None:
+            self._add(literal.group('path'), mutator.group('mutator'))
+            return True
+
+        return False
+
+    def _scan_paths(self, text, pos):
+        match, paths = self._match_list(text, pos)
+        if match is None:
+            return False
+
+        mutator = None
+        if match.group('end') != ')':
+            mutator = MUTATOR_RE.match(text, match.end())
+            if mutator is None:
+                return False
+            mutator = mutator.group('mutator')
+
+        for path in paths:
+            self._add(path, mutator)
+
+        return True
+
+    def _scan_srcset(self, text, pos):
+        literal = self._match_literal(text, pos)
+        if literal is None:
+            return False
+
+        names = None
+        if literal.group('end') != ')':
+            match, names = self._match_list(text, literal.end())
+            if match is None or match.group('end') != ')':
+                return False
+            names = tuple(names)
+
+        srcset = (literal.group('path'), names)
+        if srcset not in self.srcsets:
+            self.srcsets.append(srcset)
+
+        return True
+
+    def _scan_bundle(self, text, pos):
+        literal = self._match_literal(text, pos)
+        if literal is None or literal.group('end') != ')':
+            return False
+
+        if literal.group('path') not in self.bundles:
+            self.bundles.append(literal.group('path'))
+
+        return True
+
+    def scan_text(self, text, filename='<string>'):
+        """
+        Scans the template source ``text`` for view helper calls.
+        """
+        for match in HELPER_RE.finditer(text):
+            helper = match.group('helper')
+
+            if helper == 'urls':
+                resolved = self._scan_paths(text, match.end())
+            elif helper == 'srcset':
+                resolved = self._scan_srcset(text, match.end())
+            elif helper.startswith('bundle_'):
+                resolved = self._scan_bundle(text, match.end())
+            else:
+                resolved = self._scan_path(text, match.end())
+
+            if resolved:
+                continue
+
+            lineno = text.count('\n', 0, match.start()) + 1
+            snippet = text[match.start():].split('\n', 1)[0].strip()
+            self.unresolved.append((filename, lineno, snippet))
+
+    def scan(self, path):
+        """
+        Scans all of the templates in the ``path`` directory tree (an asset
+        specification or absolute path).
+        """
+        root = get_abspath(path)
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+
+            for filename in sorted(filenames):
+                if not filename.endswith(self.extensions):
+                    continue
+
+                fullpath = os.path.join(dirpath, filename)
+                with io.open(fullpath, encoding='utf-8',
+                             errors='replace') as f:
+                    self.scan_text(f.read(), fullpath)
+                self.templates += 1
+
+    def report(self):
+        """
+        Returns a human readable summary of the scan.
+        """
+        lines = ['Scanned %s template(s): found %s asset(s), %s srcset(s), '
+                 '%s bundle(s), %s unresolved call(s).' % (
+                     self.templates, len(self.assets), len(self.srcsets),
+                     len(self.bundles), len(self.unresolved)
+                 )]
+
+        for filename, lineno, snippet in self.unresolved:
+            lines.append('  %s:%s: %s' % (filename, lineno, snippet))
+
+        return '\n'.join(lines)
@@ -0,0 +1,90 @@
+import heapq
+import itertools
+import threading
+from pyramid_assetmutator.utils import get_cpu_count
+
+
+# Compile priorities (lower values are scheduled first)
+REQUEST = 0
+WATCHER = 1
+BATCH = 2
+
+PRIORITY_NAMES = {REQUEST: 'request', WATCHER: 'watcher', BATCH: 'batch'}
+
+
+class CompileScheduler(object):
+    """
+    Schedules the mutator runs of all of the threads of the process (request
+    threads, the background ``each_boot`` warmup, :func:`mutate_all` pools,
+    file watchers...) so that at most ``slots`` of them (defaults to the number
+    of CPUs) run at once.
+
+    Whenever a slot is freed, it is granted to the waiting run with the highest
+    priority (:data:`REQUEST`, then :data:`WATCHER`, then :data:`BATCH`), in
+    the order they were submitted. Additionally, the last ``reserved`` slots are
+    only ever granted to :data:`REQUEST` runs, so that background work can
+    never keep a request waiting for all of the slots to free up.
+    """
+    def __init__(self, slots=None, reserved=0):
+        self.slots = slots or get_cpu_count()
+        self.reserved = min(reserved, self.slots - 1)
+        self.cond = threading.Condition(threading.Lock())
+        self.counter = itertools.count()
+        self.waiting = []
+        self.running = dict((priority, 0) for priority in PRIORITY_NAMES)
+
+    def _can_run(self, entry):
+        limit = self.slots
+        if entry[0] != REQUEST:
+            limit -= self.reserved
+
+        return self.waiting[0] is entry and \
+               sum(self.running.values()) < limit
+
+    def acquire(self, priority):
+        """
+        Blocks until a slot is granted to a run of ``priority``.
+        """
+        with self.cond:
+            entry = (priority, next(self.counter))
+            heapq.heappush(self.waiting, entry)
+
+            while not self._can_run(entry):
+                self.cond.wait()
+
+            heapq.heappop(self.waiting)
+            self.running[priority] += 1
+            # The next waiting run may be able to run as well
+            self.cond.notify_all()
+
+    def release(self, priority):
+        with self.cond:
+            self.running[priority] -= 1
+            self.cond.notify_all()
+
+    def run(self, priority, func, *args, **kw):
+        """
+        Calls ``func`` (in the calling thread) with the passed arguments once a
+        slot is granted to it, and returns its result.
+        """
+        self.acquire(priority)
+        try:
+            return func(*args, **kw)
+        finally:
+            self.release(priority)
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of ``running`` and ``waiting``
+        runs per priority name.
+        """
+        with self.cond:
+            waiting = dict((name, 0) for name in PRIORITY_NAMES.values())
+            for priority, seq in self.waiting:
+                waiting[PRIORITY_NAMES[priority]] += 1
+
+            return {'slots': self.slots, 'reserved': self.reserved,
+                    'running': dict((PRIORITY_NAMES[priority], count)
+                                    for priority, count
+                                    in self.running.items()),
+                    'waiting': waiting}
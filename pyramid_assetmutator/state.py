@@ -0,0 +1,154 @@
+"""
+Persistent build state for batch mutation.
+
+When the ``assetmutator.build_state`` setting is enabled, batch processing
+(``each_boot``) records what it produced for every source in a SQLite database
+(stored at the ``build_state_path``, which is never within the publicly served
+``mutated_path``), so that subsequent runs only remutate the sources which
+actually changed. The database can also be queried for the sources which are
+stale::
+
+    python -m pyramid_assetmutator.state /var/lib/myapp/assetmutator.db
+"""
+import os
+import sys
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+from pyramid_assetmutator.utils import get_stat
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    src TEXT PRIMARY KEY,
+    stat TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    cmd TEXT NOT NULL,
+    dest TEXT NOT NULL
+)
+"""
+
+
+class BuildRecord(namedtuple('BuildRecord', ['src', 'stat', 'digest', 'cmd',
+                                             'dest'])):
+    """
+    The recorded build state of a source: its ``stat`` info and content
+    ``digest``, and the mutator ``cmd`` and ``dest`` output file which were
+    used.
+    """
+    __slots__ = ()
+
+
+class BuildState(object):
+    """
+    A build state database stored at ``path``. Instances may be shared between
+    threads, and several processes may use the same database.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30,
+                                    check_same_thread=False)
+
+        with self.lock:
+            self.conn.execute(SCHEMA)
+            self.conn.commit()
+
+    def get(self, src):
+        """
+        Returns the :class:`BuildRecord` for ``src`` (or ``None``).
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT src, stat, digest, cmd, dest FROM assets '
+                'WHERE src = ?', (src,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return BuildRecord(*row)
+
+    def record(self, src, stat, digest, cmd, dest):
+        """
+        Records the build state of ``src``.
+        """
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO assets (src, stat, digest, cmd, dest) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (src, stat, digest, cmd, dest)
+            )
+            self.conn.commit()
+
+    def remove(self, src):
+        with self.lock:
+            self.conn.execute('DELETE FROM assets WHERE src = ?', (src,))
+            self.conn.commit()
+
+    def records(self):
+        """
+        Returns a list of all of the :class:`BuildRecord` entries.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT src, stat, digest, cmd, dest FROM assets '
+                'ORDER BY src'
+            ).fetchall()
+
+        return [BuildRecord(*row) for row in rows]
+
+    def is_stale(self, record, stat=None):
+        """
+        Checks (via stat info only) if the recorded output of ``record`` is
+        out of date: i.e. if its source (whose current ``stat`` info may be
+        passed if already known) changed, or its output is missing.
+        """
+        try:
+            if stat is None:
+                stat = get_stat(record.src)
+        except OSError:
+            return True
+
+        return stat != record.stat or not os.path.exists(record.dest)
+
+    def stale(self):
+        """
+        Returns a list of the recorded sources which are stale (see
+        :meth:`is_stale`).
+        """
+        return [record.src for record in self.records()
+                if self.is_stale(record)]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def get_default_path(mutated_path):
+    """
+    Returns the default path of the database for the (absolute)
+    ``mutated_path``, which is a file in the temporary directory.
+    """
+    digest = hashlib.md5(mutated_path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), 'assetmutator-%s.db' % digest)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='List the stale sources of a pyramid_assetmutator build '
+                    'state database.'
+    )
+    parser.add_argument('database', help='The path of the database.')
+    options = parser.parse_args(argv)
+
+    state = BuildState(options.database)
+    try:
+        for src in state.stale():
+            sys.stdout.write('%s\n' % src)
+    finally:
+        state.close()
+
+if __name__ == '__main__':
+    main()
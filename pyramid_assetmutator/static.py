@@ -0,0 +1,112 @@
+import os
+import mimetypes
+from pyramid.httpexceptions import HTTPNotFound, HTTPNotModified
+from pyramid.response import FileResponse
+
+
+# One year, the maximum recommended by RFC 7234
+DEFAULT_MAX_AGE = 60 * 60 * 24 * 365
+
+# Precompressed variant file extensions, by content encoding
+ENCODING_EXTENSIONS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+# The file extensions of the internal files kept next to the mutated assets
+# (integrity values, temporary outputs and lock files)
+PRIVATE_EXTENSIONS = ('.sri', '.tmp', '.lock')
+
+
+class MutatedStaticView(object):
+    """
+    A Pyramid view which serves (fingerprinted) mutated assets from
+    ``root_dir``.
+
+    Since the filename of a mutated asset changes whenever its source changes,
+    responses are marked as ``immutable`` and cacheable for ``cache_max_age``
+    seconds, and carry a strong ETag derived from the (fingerprinted) filename
+    so that conditional requests can be answered with a ``304 Not Modified``
+    without touching the file.
+
+    If a precompressed variant of the requested file exists (e.g.
+    ``_app.0x1234.js.gz``) and the client accepts that encoding, the variant is
+    served instead. The first encoding in ``content_encodings`` which is
+    acceptable to the client wins.
+
+    Files are served via :class:`~pyramid.response.FileResponse`, which uses
+    the server's ``wsgi.file_wrapper`` (e.g. ``sendfile``) when available.
+    """
+    def __init__(self, root_dir, cache_max_age=DEFAULT_MAX_AGE,
+                 content_encodings=('br', 'gzip')):
+        self.root_dir = os.path.normpath(root_dir)
+        self.cache_max_age = cache_max_age
+        self.content_encodings = [enc for enc in content_encodings
+                                  if enc in ENCODING_EXTENSIONS]
+        self.cache_control = 'public, max-age=%s, immutable' % cache_max_age
+
+    def _resolve(self, subpath):
+        """
+        Returns the full path of the requested file, or ``None`` if the
+        ``subpath`` is invalid or refers to a hidden (dot-prefixed, e.g. the
+        content addressed store) or internal file.
+        """
+        for segment in subpath:
+            if not segment or segment.startswith('.') or '\x00' in segment or \
+               os.sep in segment or (os.altsep and os.altsep in segment):
+                return None
+
+        if not subpath or subpath[-1].endswith(PRIVATE_EXTENSIONS):
+            return None
+
+        return os.path.join(self.root_dir, *subpath)
+
+    def _headers(self, etag):
+        headers = [('Cache-Control', self.cache_control),
+                   ('ETag', '"%s"' % etag)]
+
+        if self.content_encodings:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        return headers
+
+    def __call__(self, context, request):
+        filepath = self._resolve(request.subpath)
+
+        if filepath is None or not os.path.isfile(filepath):
+            return HTTPNotFound(request.url)
+
+        encoding = None
+        if self.content_encodings and request.accept_encoding:
+            acceptable = [offer for offer, q in
+                          request.accept_encoding.acceptable_offers(
+                              self.content_encodings
+                          )]
+            for enc in self.content_encodings:
+                if enc in acceptable and \
+                   os.path.isfile(filepath + ENCODING_EXTENSIONS[enc]):
+                    encoding = enc
+                    break
+
+        etag = os.path.basename(filepath)
+        if encoding:
+            etag = '%s-%s' % (etag, encoding)
+
+        if etag in request.if_none_match:
+            return HTTPNotModified(headers=self._headers(etag))
+
+        content_type = mimetypes.guess_type(filepath, strict=False)[0] or \
+                       'application/octet-stream'
+
+        if encoding:
+            response = FileResponse(filepath + ENCODING_EXTENSIONS[encoding],
+                                    request=request, content_type=content_type)
+            response.content_encoding = encoding
+        else:
+            response = FileResponse(filepath, request=request,
+                                    content_type=content_type)
+
+        for name, value in self._headers(etag):
+            response.headers[name] = value
+
+        return response
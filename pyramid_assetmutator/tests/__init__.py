@@ -36,10 +36,25 @@ class TestParseSettings(unittest.TestCase):
              'assetmutator.each_request': False,
              'assetmutator.each_boot': ['pyramid_assetmutator:static/*.css',
                                         'pyramid_assetmutator:static/*.js'],
+             'assetmutator.each_boot_exclude': [],
+             'assetmutator.each_boot_templates': [],
+             'assetmutator.each_boot_background': False,
+             'assetmutator.build_state': False,
+             'assetmutator.build_state_path': '',
+             'assetmutator.content_addressed': False,
              'assetmutator.mutated_file_prefix': '.',
              'assetmutator.mutated_path': 'pyramid_assetmutator:static/cache/',
              'assetmutator.purge_mutated_path': False,
-             'assetmutator.always_remutate': ['*']}
+             'assetmutator.always_remutate': ['*'],
+             'assetmutator.template_context_keys': [],
+             'assetmutator.integrity': '',
+             'assetmutator.metrics': False,
+             'assetmutator.compile_socket': '',
+             'assetmutator.compile_slots': 0,
+             'assetmutator.compile_slots_reserved': 0,
+             'assetmutator.failure_ttl': 0,
+             'assetmutator.failure_fallback': False,
+             'assetmutator.build_profile': ''}
         )
 
 class TestIncludeme(unittest.TestCase):
@@ -59,6 +74,28 @@ class TestIncludeme(unittest.TestCase):
         self.assertEqual(settings['assetmutator.each_boot'], [])
         self.assertEqual(settings['assetmutator.mutated_file_prefix'], '_')
         self.assertEqual(settings['assetmutator.mutated_path'], '')
+        self.assertEqual(settings['assetmutator.metrics'], False)
+        self.assertFalse('assetmutator.metrics_sink' in settings)
+
+    def test_metrics(self):
+        from pyramid_assetmutator.metrics import MemoryMetricsSink
+        self.config.registry.settings['assetmutator.metrics'] = 'true'
+        self._callFUT(self.config)
+        settings = self.config.registry.settings
+        self.assertEqual(settings['assetmutator.metrics'], True)
+        self.assertTrue(isinstance(settings['assetmutator.metrics_sink'],
+                                   MemoryMetricsSink))
+
+    def test_scheduler(self):
+        from pyramid_assetmutator.scheduler import CompileScheduler
+        settings = self.config.registry.settings
+        self.assertFalse('assetmutator.scheduler' in settings)
+        settings['assetmutator.compile_slots'] = '4'
+        settings['assetmutator.compile_slots_reserved'] = '1'
+        self._callFUT(self.config)
+        scheduler = settings['assetmutator.scheduler']
+        self.assertTrue(isinstance(scheduler, CompileScheduler))
+        self.assertEqual((scheduler.slots, scheduler.reserved), (4, 1))
 
 class TestMutator(unittest.TestCase):
     def setUp(self):
@@ -99,6 +136,23 @@ class TestMutator(unittest.TestCase):
                         mutator='spam')
             self.assertEqual('%s' % exc.exception, 'No mutator found for json.')
 
+    def test_mutator_resolved(self):
+        from pyramid_assetmutator.mutator import ResolvedAsset
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        mutant = Mutator(self.request, path)
+        self.assertFalse(hasattr(mutant, '__dict__'))
+
+        resolved = mutant.resolved
+        self.assertEqual(
+            resolved,
+            ResolvedAsset(path, self.fixture_path, mutant.dest_fullpath,
+                          mutant.new_path, mutant.fingerprint, 'cat')
+        )
+        self.assertEqual(resolved.dest_fullpath, mutant.dest_fullpath)
+        self.assertFalse(hasattr(resolved, '__dict__'))
+        self.assertRaises(AttributeError, setattr, resolved, 'path', 'spam')
+        self.assertEqual(hash(resolved), hash(mutant.resolved))
+
     def test_mutator_source_not_found(self):
         self.settings['assetmutator.remutate_check'] = 'exists'
 
@@ -281,6 +335,82 @@ class TestMutator(unittest.TestCase):
 
         os.remove(filename)
 
+    def test_mutator_integrity(self):
+        import base64
+        from pyramid_assetmutator.mutator import integrity_values
+        self.settings['assetmutator.remutate_check'] = 'exists'
+        self.settings['assetmutator.integrity'] = 'sha384'
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        src_fullpath = get_abspath(path)
+        mutant = Mutator(self.request, path)
+        mutant.mutate()
+
+        filename = '%s/fixtures/_test.%s.txt' % (self.here,
+                                                 hexhashify(src_fullpath))
+        with open(filename, 'rb') as f:
+            expected = 'sha384-' + base64.b64encode(
+                hashlib.sha384(f.read()).digest()
+            ).decode('ascii')
+
+        self.assertEqual(mutant.integrity(), expected)
+        with open(filename + '.sri') as f:
+            self.assertEqual(f.read(), expected)
+
+        # Falls back to the persisted value...
+        integrity_values.clear()
+        self.assertEqual(Mutator(self.request, path).integrity(), expected)
+
+        # ...and computes it if needed
+        integrity_values.clear()
+        os.remove(filename + '.sri')
+        self.settings['assetmutator.integrity'] = ''
+        self.assertEqual(Mutator(self.request, path).integrity(), expected)
+        self.assertTrue(os.path.exists(filename + '.sri'))
+
+        os.remove(filename)
+        os.remove(filename + '.sri')
+
+    def test_mutator_integrity_remutated(self):
+        import base64
+        self.settings['assetmutator.remutate_check'] = 'exists'
+        self.settings['assetmutator.integrity'] = 'sha384'
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        src_fullpath = get_abspath(path)
+        mutant = Mutator(self.request, path,
+                         mutator=dict(cmd='cat', ext='txt'))
+        mutant.mutate()
+        stale = mutant.integrity()
+
+        filename = '%s/fixtures/_test.%s.txt' % (self.here,
+                                                 hexhashify(src_fullpath))
+        self.assertTrue(os.path.exists(filename + '.sri'))
+
+        # Remutating in place without integrity drops the old value
+        self.settings['assetmutator.integrity'] = ''
+        self.settings['assetmutator.always_remutate'] = ['*']
+        mutant = Mutator(self.request, path,
+                         mutator=dict(cmd='gzip --stdout', ext='txt'))
+        mutant.mutate()
+        self.assertFalse(os.path.exists(filename + '.sri'))
+
+        with open(filename, 'rb') as f:
+            expected = 'sha384-' + base64.b64encode(
+                hashlib.sha384(f.read()).digest()
+            ).decode('ascii')
+
+        self.assertNotEqual(mutant.integrity(), stale)
+        self.assertEqual(mutant.integrity(), expected)
+
+        os.remove(filename)
+        os.remove(filename + '.sri')
+
+    def test_mutator_integrity_not_mutated(self):
+        self.settings['assetmutator.remutate_check'] = 'exists'
+        mutant = Mutator(self.request,
+                         'pyramid_assetmutator.tests:fixtures/test.json')
+
+        self.assertRaises(RuntimeError, mutant.integrity)
+
     def test_mutator_binary_mutator(self):
         self.settings['assetmutator.remutate_check'] = 'exists'
         path = 'pyramid_assetmutator.tests:fixtures/test.json'
@@ -308,6 +438,1709 @@ class TestMutator(unittest.TestCase):
 
         os.remove(filename)
 
+class TestGetAbspath(unittest.TestCase):
+    def setUp(self):
+        self.here = os.path.abspath(os.path.dirname(__file__))
+        self.config = testing.setUp()
+        clear_abspath_cache()
+
+    def tearDown(self):
+        clear_abspath_cache()
+        testing.tearDown()
+
+    def test_memoized(self):
+        from pyramid_assetmutator import utils
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+
+        self.assertEqual(get_abspath(path),
+                         '%s/fixtures/test.json' % self.here)
+        self.assertEqual(len(utils._abspath_cache), 1)
+        self.assertEqual(get_abspath(path),
+                         '%s/fixtures/test.json' % self.here)
+        self.assertEqual(len(utils._abspath_cache), 1)
+
+    def test_absolute(self):
+        from pyramid_assetmutator import utils
+        path = '%s/fixtures/test.json' % self.here
+
+        self.assertEqual(get_abspath(path), path)
+        self.assertEqual(len(utils._abspath_cache), 0)
+
+    def test_override_invalidates(self):
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+
+        self.assertEqual(get_abspath(path),
+                         '%s/fixtures/test.json' % self.here)
+
+        self.config.override_asset(
+            path, 'pyramid_assetmutator.tests:fixtures/subdir/test2.json'
+        )
+        self.assertEqual(get_abspath(path),
+                         '%s/fixtures/subdir/test2.json' % self.here)
+
+        self.config.override_asset(
+            path, 'pyramid_assetmutator.tests:fixtures/subdir/test3.json'
+        )
+        self.assertEqual(get_abspath(path),
+                         '%s/fixtures/subdir/test3.json' % self.here)
+
+class TestPatternMatcher(unittest.TestCase):
+    def _callFUT(self, patterns):
+        return get_pattern_matcher(patterns)
+
+    def _fnmatch(self, path, patterns):
+        # The original (uncompiled) always_remutate semantics
+        from fnmatch import fnmatch
+        if '*' in patterns or path in patterns:
+            return True
+        for val in patterns:
+            if fnmatch(path, val):
+                return True
+        return False
+
+    def test_equivalence(self):
+        paths = ['pkg:static/js/app.coffee', 'pkg:static/css/app.sass',
+                 'pkg:static/css/_partial.sass', 'pkg:static/[x].js',
+                 'other:static/js/app.coffee', '/abs/path/app.less',
+                 'pkg:static/css/app.sass.jinja2', 'app.sass\n']
+        pattern_lists = [[], ['*'], ['*.sass'], ['pkg:static/[x].js'],
+                         ['pkg:static/js/*', '*/_*.sass'],
+                         ['pkg:static/css/app.sass'], ['?kg:*', '[!p]*'],
+                         ['/abs/**.less', 'pkg:static/[cj]s*/app.*']]
+
+        for patterns in pattern_lists:
+            matcher = self._callFUT(patterns)
+            for path in paths:
+                self.assertEqual(matcher(path), self._fnmatch(path, patterns),
+                                 '%r %r' % (path, patterns))
+
+    def test_shared(self):
+        self.assertTrue(self._callFUT(['*.sass', '*.less']) is
+                        self._callFUT(['*.sass', '*.less']))
+        self.assertFalse(self._callFUT(['*.sass']) is
+                         self._callFUT(['*.less']))
+
+class TestPathLock(unittest.TestCase):
+    def test_get_path_lock(self):
+        import gc
+        from pyramid_assetmutator.utils import get_path_lock, _path_locks
+        lock = get_path_lock('/_test/a.txt')
+        self.assertTrue(lock is get_path_lock('/_test/a.txt'))
+
+        with lock:
+            self.assertFalse(lock.acquire(False))
+        self.assertTrue(lock.acquire(False))
+        lock.release()
+
+        # Unused locks are dropped
+        del lock
+        gc.collect()
+        self.assertFalse('/_test/a.txt' in _path_locks)
+
+class TestConcurrencyLimit(unittest.TestCase):
+    def _run(self, limits, count=6):
+        import threading
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def work(limit):
+            with limit:
+                with lock:
+                    state['running'] += 1
+                    state['max'] = max(state['max'], state['running'])
+                time.sleep(0.05)
+                with lock:
+                    state['running'] -= 1
+
+        threads = [threading.Thread(target=work,
+                                    args=(limits[i % len(limits)],))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return state['max']
+
+    def test_threads(self):
+        limit = get_concurrency_limit('_test_threads', 2)
+        self.assertTrue(limit is get_concurrency_limit('_test_threads', 2))
+        self.assertEqual(self._run([limit]), 2)
+
+    def test_interprocess(self):
+        import shutil
+        import tempfile
+        from pyramid_assetmutator.utils import ConcurrencyLimit
+        tmpdir = tempfile.mkdtemp()
+
+        try:
+            # Separate instances share nothing but their slot files (just like
+            # the instances of separate processes)
+            limits = [ConcurrencyLimit('_test_interprocess', 1,
+                                       interprocess=True, lock_dir=tmpdir)
+                      for i in range(3)]
+            self.assertEqual(self._run(limits), 1)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_mutator(self):
+        import tempfile
+        import threading
+        from pyramid_assetmutator.mutator import mutate_all
+        tmpdir = tempfile.mkdtemp()
+        script = os.path.join(tmpdir, 'slowcat.py')
+        log = os.path.join(tmpdir, 'runs.log')
+        with open(script, 'w') as f:
+            f.write('import sys, time\n'
+                    'log = open(%r, "a")\n'
+                    'log.write("+"); log.flush(); time.sleep(0.1)\n'
+                    'log.write("-"); log.close()\n'
+                    'sys.stdout.write(open(sys.argv[1]).read())\n' % log)
+        request = testing.DummyRequest()
+        config = testing.setUp(request=request)
+        config.include('pyramid_assetmutator')
+        config.assign_assetmutator('_slow', '%s %s' % (sys.executable, script),
+                                   'txt', max_concurrency=1)
+        from pyramid_assetmutator import mutators
+        settings = config.registry.settings
+        settings['assetmutator.mutators'] = mutators
+        settings['assetmutator.mutated_path'] = tmpdir
+        paths = ['pyramid_assetmutator.tests:fixtures/test.json',
+                 'pyramid_assetmutator.tests:fixtures/subdir/test2.json',
+                 'pyramid_assetmutator.tests:fixtures/subdir/test3.json']
+
+        try:
+            self.assertEqual(mutators['_slow']['max_concurrency'], 1)
+            mutate_all(request, paths, max_workers=3, mutator='_slow')
+
+            # The runs of the mutator never overlapped
+            with open(log) as f:
+                self.assertEqual(f.read(), '+-' * 3)
+        finally:
+            import shutil
+            del mutators['_slow']
+            shutil.rmtree(tmpdir)
+            testing.tearDown()
+
+class TestCompileScheduler(unittest.TestCase):
+    def _makeOne(self, *args, **kw):
+        from pyramid_assetmutator.scheduler import CompileScheduler
+        return CompileScheduler(*args, **kw)
+
+    def _submit(self, scheduler, priority, order):
+        import threading
+        thread = threading.Thread(
+            target=scheduler.run, args=(priority, order.append, priority)
+        )
+        thread.start()
+
+        # Wait until the run is queued
+        while thread.is_alive() and \
+              priority not in [p for p, seq in scheduler.waiting]:
+            time.sleep(0.005)
+
+        return thread
+
+    def test_priorities(self):
+        from pyramid_assetmutator.scheduler import REQUEST, WATCHER, BATCH
+        scheduler = self._makeOne(1)
+        order = []
+
+        scheduler.acquire(BATCH)
+        threads = [self._submit(scheduler, BATCH, order),
+                   self._submit(scheduler, WATCHER, order),
+                   self._submit(scheduler, REQUEST, order)]
+        self.assertEqual(scheduler.stats()['waiting'],
+                         {'request': 1, 'watcher': 1, 'batch': 1})
+        scheduler.release(BATCH)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, [REQUEST, WATCHER, BATCH])
+        self.assertEqual(scheduler.stats()['running'],
+                         {'request': 0, 'watcher': 0, 'batch': 0})
+
+    def test_reserved(self):
+        from pyramid_assetmutator.scheduler import REQUEST, BATCH
+        scheduler = self._makeOne(2, reserved=1)
+        order = []
+
+        # Background work can't take the reserved slot...
+        scheduler.acquire(BATCH)
+        thread = self._submit(scheduler, BATCH, order)
+        self.assertEqual(order, [])
+
+        # ...which stays available to requests
+        scheduler.run(REQUEST, order.append, REQUEST)
+        self.assertEqual(order, [REQUEST])
+
+        scheduler.release(BATCH)
+        thread.join()
+        self.assertEqual(order, [REQUEST, BATCH])
+
+    def test_mutator(self):
+        from pyramid_assetmutator.scheduler import REQUEST, BATCH
+        request = testing.DummyRequest()
+        config = testing.setUp(request=request)
+        config.include('pyramid_assetmutator')
+        settings = config.registry.settings
+        settings['assetmutator.mutators'] = {'json': {'cmd': 'cat',
+                                                      'ext': 'txt'}}
+        scheduler = settings['assetmutator.scheduler'] = self._makeOne(1)
+        priorities = []
+        run = scheduler.run
+        scheduler.run = lambda priority, *args: (priorities.append(priority),
+                                                 run(priority, *args))
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+
+        try:
+            mutant = Mutator(request, path)
+            mutant.mutate()
+            batch = Mutator(request, path, batch=True)
+            batch.mutate()
+            self.assertEqual(priorities, [REQUEST, BATCH])
+        finally:
+            os.remove(mutant.dest_fullpath)
+            testing.tearDown()
+
+    def test_mutator_concurrency_limit(self):
+        import threading
+        from pyramid_assetmutator.scheduler import REQUEST
+        request = testing.DummyRequest()
+        config = testing.setUp(request=request)
+        config.include('pyramid_assetmutator')
+        settings = config.registry.settings
+        settings['assetmutator.mutators'] = {
+            'json': {'cmd': 'cat', 'ext': 'txt', 'max_concurrency': 1}
+        }
+        scheduler = settings['assetmutator.scheduler'] = self._makeOne(1)
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        mutant = Mutator(request, path, registry=config.registry)
+        thread = threading.Thread(target=mutant.mutate)
+
+        try:
+            with get_concurrency_limit('cat', 1):
+                thread.start()
+                time.sleep(0.1)
+
+                # The throttled run doesn't hold the only scheduler slot
+                self.assertEqual(scheduler.stats()['running']['request'], 0)
+                self.assertEqual(scheduler.run(REQUEST, lambda: 'spam'),
+                                 'spam')
+
+            thread.join()
+            self.assertTrue(os.path.exists(mutant.dest_fullpath))
+        finally:
+            os.remove(mutant.dest_fullpath)
+            testing.tearDown()
+
+class TestBundle(unittest.TestCase):
+    def setUp(self):
+        from pyramid_assetmutator import mutators, bundles
+        self.here = os.path.abspath(os.path.dirname(__file__))
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request=self.request)
+        self.settings = self.config.registry.settings
+        self.config.include('pyramid_assetmutator')
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.config.assign_assetbundle(
+            'bundle.txt',
+            ['pyramid_assetmutator.tests:fixtures/test.json',
+             'pyramid_assetmutator.tests:fixtures/subdir/test2.json',
+             'pyramid_assetmutator.tests:fixtures/test_assetmutator_url.pt']
+        )
+        self.settings['assetmutator.mutators'] = mutators
+        self.settings['assetmutator.bundles'] = bundles
+        self.settings['assetmutator.remutate_check'] = 'exists'
+
+    def tearDown(self):
+        from pyramid_assetmutator import bundles
+        bundles.clear()
+        testing.tearDown()
+
+    def _makeOne(self, name='bundle.txt'):
+        from pyramid_assetmutator.bundle import Bundle
+        return Bundle(self.request, name)
+
+    def test_bundle_not_found(self):
+        self.assertRaises(RuntimeError, self._makeOne, 'spam.js')
+
+    def test_assign_no_members(self):
+        self.assertRaises(ValueError, self.config.assign_assetbundle,
+                          'spam.js', [])
+
+    def test_bundle(self):
+        bundle = self._makeOne()
+        self.assertFalse(bundle.is_mutated)
+
+        new_path = bundle.mutate()
+        self.assertEqual(
+            new_path,
+            'pyramid_assetmutator.tests:fixtures/_bundle.%s.txt' % \
+                bundle.fingerprint
+        )
+        self.assertEqual(
+            bundle.mutated_data(),
+            '{"spam": "lorem", "eggs": "鸡蛋"}\n\n' + \
+            '{"spam": "lorem", "eggs": "鸡蛋"}\n\n' + \
+            "${assetmutator_url('pyramid_assetmutator.tests:fixtures/" + \
+            "test.json')}\n"
+        )
+
+        source = get_abspath('pyramid_assetmutator.tests:fixtures/test.json')
+        source2 = get_abspath(
+            'pyramid_assetmutator.tests:fixtures/subdir/test2.json'
+        )
+        filename = '%s/fixtures/_test.%s.txt' % (self.here,
+                                                 hexhashify(source))
+        filename2 = '%s/fixtures/subdir/_test2.%s.txt' % (self.here,
+                                                          hexhashify(source2))
+        self.assertTrue(os.path.exists(filename))
+        self.assertTrue(os.path.exists(filename2))
+
+        # Rebuilding an unchanged bundle reuses the existing output
+        stat = get_stat(bundle.dest_fullpath)
+        time.sleep(0.1)
+        bundle = self._makeOne()
+        self.assertTrue(bundle.is_mutated)
+        self.assertEqual(bundle.mutate(), new_path)
+        self.assertEqual(stat, get_stat(bundle.dest_fullpath))
+
+        os.remove(bundle.dest_fullpath)
+        os.remove(filename)
+        os.remove(filename2)
+
+    def test_bundle_member_changed(self):
+        self.settings['assetmutator.remutate_check'] = 'stat'
+        path = '%s/fixtures/subdir/test2.json' % self.here
+        bundle = self._makeOne()
+        bundle.mutate()
+        old_sources = bundle.sources
+
+        # Touching a member results in a new bundle (but only that member is
+        # remutated)
+        stat = get_stat(old_sources[0])
+        mtime = os.path.getmtime(path)
+        os.utime(path, (mtime + 10, mtime + 10))
+        try:
+            new_bundle = self._makeOne()
+            new_bundle.mutate()
+        finally:
+            os.utime(path, (mtime, mtime))
+
+        self.assertNotEqual(new_bundle.dest_fullpath, bundle.dest_fullpath)
+        self.assertEqual(new_bundle.sources[0], old_sources[0])
+        self.assertEqual(stat, get_stat(new_bundle.sources[0]))
+        self.assertNotEqual(new_bundle.sources[1], old_sources[1])
+
+        for filename in set(old_sources[:2] + new_bundle.sources[:2] +
+                            [bundle.dest_fullpath, new_bundle.dest_fullpath]):
+            os.remove(filename)
+
+class TestSourceIndex(unittest.TestCase):
+    def setUp(self):
+        self.here = os.path.abspath(os.path.dirname(__file__))
+        self.fixtures = os.path.join(self.here, 'fixtures')
+
+    def _makeOne(self):
+        from pyramid_assetmutator.index import SourceIndex
+        return SourceIndex()
+
+    def test_glob_to_regex(self):
+        regex = glob_to_regex('/a/**/*.sass', sep='/')
+        self.assertTrue(regex.match('/a/b.sass'))
+        self.assertTrue(regex.match('/a/b/c/d.sass'))
+        self.assertFalse(regex.match('/a/b.sass.pt'))
+        self.assertFalse(regex.match('/ab.sass'))
+
+        regex = glob_to_regex('/a/*.sass', sep='/')
+        self.assertTrue(regex.match('/a/b.sass'))
+        self.assertFalse(regex.match('/a/b/c.sass'))
+
+        regex = glob_to_regex('/a/[!_]?.sass', sep='/')
+        self.assertTrue(regex.match('/a/bc.sass'))
+        self.assertFalse(regex.match('/a/_c.sass'))
+
+    def test_match_ignored(self):
+        import shutil
+        import tempfile
+        from pyramid_assetmutator.index import SourceIndex
+        tmpdir = tempfile.mkdtemp()
+        cache = os.path.join(tmpdir, 'cache')
+        for dirpath in (cache, os.path.join(tmpdir, '.cas')):
+            os.makedirs(dirpath)
+        for path in ('app.js', 'cache/_app.0x1.js', '.cas/ab.js', '.app.js'):
+            with open(os.path.join(tmpdir, path), 'w') as f:
+                f.write('')
+
+        try:
+            index = SourceIndex(ignore=[cache + os.sep])
+            self.assertEqual(index.match(os.path.join(tmpdir, '**', '*.js')),
+                             [os.path.join(tmpdir, 'app.js')])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_match_symlink_cycle(self):
+        import shutil
+        import tempfile
+        if not hasattr(os, 'symlink'): # pragma: no cover
+            return
+        tmpdir = tempfile.mkdtemp()
+        static = os.path.join(tmpdir, 'static')
+        for dirpath in ('sub', 'other'):
+            os.makedirs(os.path.join(static, dirpath))
+        with open(os.path.join(static, 'app.coffee'), 'w') as f:
+            f.write('')
+        os.symlink('..', os.path.join(static, 'sub', 'up'))
+        os.symlink('..', os.path.join(static, 'other', 'up'))
+
+        try:
+            # Every directory is walked once, despite the cycles
+            index = self._makeOne()
+            self.assertEqual(index.match(os.path.join(static, '**',
+                                                      '*.coffee')),
+                             [os.path.join(static, 'app.coffee')])
+
+            # Non-recursive patterns only list their directory
+            index = self._makeOne()
+            self.assertEqual(index.match(os.path.join(static, '*.coffee')),
+                             [os.path.join(static, 'app.coffee')])
+            self.assertEqual(index.roots, [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_match(self):
+        index = self._makeOne()
+        subdir = os.path.join(self.fixtures, 'subdir')
+
+        self.assertEqual(
+            index.match('pyramid_assetmutator.tests:fixtures/**/*.json'),
+            [os.path.join(subdir, 'test2.json'),
+             os.path.join(subdir, 'test3.json'),
+             os.path.join(self.fixtures, 'test.json')]
+        )
+        self.assertEqual(
+            index.match('pyramid_assetmutator.tests:fixtures/*.json'),
+            [os.path.join(self.fixtures, 'test.json')]
+        )
+        self.assertEqual(
+            index.match(os.path.join(subdir, 'test2.json')),
+            [os.path.join(subdir, 'test2.json')]
+        )
+        self.assertEqual(index.roots, [self.fixtures])
+
+    def test_match_excludes(self):
+        index = self._makeOne()
+        subdir = os.path.join(self.fixtures, 'subdir')
+
+        self.assertEqual(
+            index.match('pyramid_assetmutator.tests:fixtures/**/*.json',
+                        excludes=['test3.*']),
+            [os.path.join(subdir, 'test2.json'),
+             os.path.join(self.fixtures, 'test.json')]
+        )
+        self.assertEqual(
+            index.match('pyramid_assetmutator.tests:fixtures/**/*.json',
+                        excludes=['pyramid_assetmutator.tests:fixtures/sub*/*']),
+            [os.path.join(self.fixtures, 'test.json')]
+        )
+
+    def test_scan_nested_roots(self):
+        index = self._makeOne()
+        index.scan(os.path.join(self.fixtures, 'subdir'))
+        index.scan(self.fixtures)
+        index.scan(os.path.join(self.fixtures, 'subdir'))
+
+        self.assertEqual(index.roots, [self.fixtures])
+        self.assertEqual(len(index.by_ext['json']), 3)
+
+    def test_get_stat(self):
+        index = self._makeOne()
+        index.scan(self.fixtures)
+        path = os.path.join(self.fixtures, 'test.json')
+
+        self.assertEqual(index.get_stat(path), get_stat(path))
+        self.assertEqual(index.get_stat(path + '.spam'), None)
+
+class TestTemplateScanner(unittest.TestCase):
+    def setUp(self):
+        self.here = os.path.abspath(os.path.dirname(__file__))
+
+    def _makeOne(self):
+        from pyramid_assetmutator.scanner import TemplateScanner
+        return TemplateScanner()
+
+    def test_scan(self):
+        scanner = self._makeOne()
+        scanner.scan('pyramid_assetmutator.tests:fixtures')
+
+        self.assertEqual(
+            scanner.assets,
+            [('pyramid_assetmutator.tests:fixtures/test.json', None),
+             ('pyramid_assetmutator.tests:fixtures/test.json.pt', None),
+             ('pyramid_assetmutator.tests:fixtures/test.json.jinja2', None),
+             ('pyramid_assetmutator.tests:fixtures/subdir/test3.json', None),
+             ('pyramid_assetmutator.tests:fixtures/subdir/test2.json', None)]
+        )
+        self.assertEqual(
+            scanner.srcsets,
+            [('pyramid_assetmutator.tests:fixtures/test.json', None),
+             ('pyramid_assetmutator.tests:fixtures/test.json', ('2x',))]
+        )
+        self.assertEqual(scanner.bundles, ['bundle.txt'])
+        self.assertEqual(scanner.unresolved, [])
+        self.assertEqual(scanner.templates, 17)
+
+    def test_scan_text(self):
+        scanner = self._makeOne()
+        scanner.scan_text(
+            '<script src="${assetmutator_url("myapp:static/app.coffee")}">\n'
+            '<link href="${assetmutator_url(\'myapp:static/a.less\', '
+            'mutator=\'less\')}">\n'
+            '${assetmutator_path(asset)}\n'
+            '{{ assetmutator_source("myapp:static/{{ name }}.coffee") }}\n'
+            '${assetmutator_url(\'myapp:static/a.less\', mutator=m)}\n'
+            '${assetmutator_urls(["myapp:static/a.coffee", \'myapp:b.coffee\','
+            ' ])}\n'
+            '${assetmutator_urls(("myapp:static/c.less",), \'less\')}\n'
+            '${assetmutator_urls(assets)}\n'
+            '${assetmutator_srcset("myapp:static/a.png")}\n'
+            '${assetmutator_srcset("myapp:static/a.png", names=["webp"])}\n'
+            '${assetmutator_srcset("myapp:static/a.png", names)}\n'
+            '${assetmutator_bundle_url("app.js")}\n'
+            '${assetmutator_bundle_path(name)}\n',
+            'index.pt'
+        )
+
+        self.assertEqual(scanner.assets,
+                         [('myapp:static/app.coffee', None),
+                          ('myapp:static/a.less', 'less'),
+                          ('myapp:static/a.coffee', None),
+                          ('myapp:b.coffee', None),
+                          ('myapp:static/c.less', 'less')])
+        self.assertEqual(scanner.srcsets,
+                         [('myapp:static/a.png', None),
+                          ('myapp:static/a.png', ('webp',))])
+        self.assertEqual(scanner.bundles, ['app.js'])
+        self.assertEqual(
+            scanner.unresolved,
+            [('index.pt', 3, 'assetmutator_path(asset)}'),
+             ('index.pt', 4,
+              'assetmutator_source("myapp:static/{{ name }}.coffee") }}'),
+             ('index.pt', 5,
+              'assetmutator_url(\'myapp:static/a.less\', mutator=m)}'),
+             ('index.pt', 8, 'assetmutator_urls(assets)}'),
+             ('index.pt', 11,
+              'assetmutator_srcset("myapp:static/a.png", names)}'),
+             ('index.pt', 13, 'assetmutator_bundle_path(name)}')]
+        )
+        self.assertTrue(scanner.report().startswith(
+            'Scanned 0 template(s): found 5 asset(s), 2 srcset(s), 1 '
+            'bundle(s), 6 unresolved call(s).'
+        ))
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        from pyramid_assetmutator import mutators
+        from pyramid_assetmutator.metrics import MemoryMetricsSink
+        self.here = os.path.abspath(os.path.dirname(__file__))
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request=self.request)
+        self.settings = self.config.registry.settings
+        self.config.include('pyramid_assetmutator')
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.settings['assetmutator.mutators'] = mutators
+        self.settings['assetmutator.remutate_check'] = 'exists'
+        self.sink = MemoryMetricsSink()
+        self.config.set_assetmutator_metrics_sink(self.sink)
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_memory_sink(self):
+        self.sink.incr('spam_total', mutator='cat')
+        self.sink.incr('spam_total', 2, mutator='cat')
+        self.sink.observe('eggs_seconds', 0.2, helper='url')
+        self.sink.observe('eggs_seconds', 20, helper='url')
+
+        snapshot = self.sink.snapshot()
+        self.assertEqual(
+            snapshot['counters'],
+            {('spam_total', (('mutator', 'cat'),)): 3}
+        )
+        hist = snapshot['histograms'][('eggs_seconds', (('helper', 'url'),))]
+        self.assertEqual(hist['count'], 2)
+        self.assertAlmostEqual(hist['sum'], 20.2)
+        self.assertEqual(sum(hist['buckets']), 2)
+        self.assertEqual(hist['buckets'][-1], 1)
+        self.assertEqual(self.sink.value('eggs_seconds', helper='url'), 2)
+
+        self.sink.reset()
+        self.assertEqual(self.sink.snapshot(),
+                         {'counters': {}, 'histograms': {}})
+
+    def test_render_prometheus(self):
+        self.sink.incr('spam_total', mutator='coffee -c "-p"')
+        self.sink.observe('eggs_seconds', 0.2, helper='url')
+        text = self.sink.render_prometheus()
+
+        self.assertTrue('# TYPE spam_total counter\n' in text)
+        self.assertTrue('spam_total{mutator="coffee -c \\"-p\\""} 1\n' in text)
+        self.assertTrue('# TYPE eggs_seconds histogram\n' in text)
+        self.assertTrue('eggs_seconds_bucket{helper="url",le="0.1"} 0\n' in text)
+        self.assertTrue('eggs_seconds_bucket{helper="url",le="0.25"} 1\n' in text)
+        self.assertTrue('eggs_seconds_bucket{helper="url",le="+Inf"} 1\n' in text)
+        self.assertTrue('eggs_seconds_count{helper="url"} 1\n' in text)
+
+    def test_mutator_metrics(self):
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        source = get_abspath(path)
+        Mutator(self.request, path).mutate()
+        Mutator(self.request, path).mutate()
+
+        self.assertEqual(
+            self.sink.value('assetmutator_should_mutate_total',
+                            outcome='mutate'), 1
+        )
+        self.assertEqual(
+            self.sink.value('assetmutator_should_mutate_total',
+                            outcome='hit'), 1
+        )
+        self.assertEqual(
+            self.sink.value('assetmutator_compile_seconds', mutator='cat'), 1
+        )
+        self.assertEqual(
+            self.sink.value('assetmutator_compile_input_bytes_total',
+                            mutator='cat'),
+            os.path.getsize(source)
+        )
+        self.assertEqual(
+            self.sink.value('assetmutator_compile_output_bytes_total',
+                            mutator='cat'),
+            os.path.getsize(source)
+        )
+
+        os.remove('%s/fixtures/_test.%s.txt' % (self.here,
+                                                hexhashify(source)))
+
+    def test_mutator_metrics_failure(self):
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        mutant = Mutator(self.request, path,
+                         mutator=dict(cmd='false', ext='txt'))
+
+        self.assertRaises(EnvironmentError, mutant.mutate)
+        self.assertEqual(
+            self.sink.value('assetmutator_compile_failures_total',
+                            mutator='false'), 1
+        )
+
+class TestRunCommand(unittest.TestCase):
+    def setUp(self):
+        self.here = os.path.abspath(os.path.dirname(__file__))
+        self.dest = '%s/cache/_run_command.txt' % self.here
+
+    def tearDown(self):
+        if os.path.exists(self.dest):
+            os.remove(self.dest)
+
+    def _callFUT(self, *args, **kw):
+        from pyramid_assetmutator.mutator import run_command
+        return run_command(*args, **kw)
+
+    def test_streamed(self):
+        from pyramid_assetmutator.mutator import CHUNK_SIZE
+        source = '%s/cache/_run_command.src' % self.here
+        with open(source, 'wb') as f:
+            f.write(os.urandom(CHUNK_SIZE * 5 + 123))
+        md5 = hashlib.md5()
+
+        try:
+            size = self._callFUT('cat', source, self.dest, hashers=[md5])
+
+            self.assertEqual(size, CHUNK_SIZE * 5 + 123)
+            self.assertEqual(md5.hexdigest()[:12], compute_md5(source))
+            self.assertEqual(compute_md5(self.dest), compute_md5(source))
+        finally:
+            os.remove(source)
+
+    def test_failure(self):
+        from pyramid_assetmutator.mutator import MAX_ERROR_OUTPUT
+        source = '%s/cache/_does_not_exist.src' % self.here
+
+        self.assertRaises(EnvironmentError, self._callFUT, 'cat', source,
+                          self.dest)
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertEqual(
+            [f for f in os.listdir('%s/cache' % self.here)
+             if f.endswith('.tmp')], []
+        )
+
+        if sys.version_info[:2] > (2, 6):
+            with self.assertRaises(EnvironmentError) as exc:
+                self._callFUT('cat', source, self.dest)
+            self.assertTrue('Return code 1 when attempting to execute cat.' in
+                            str(exc.exception))
+            self.assertTrue(len(str(exc.exception)) < MAX_ERROR_OUTPUT * 5)
+
+class TestCompileServer(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        import threading
+        from pyramid_assetmutator.daemon import CompileServer
+        self.here = os.path.abspath(os.path.dirname(__file__))
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'compile.sock')
+        self.server = CompileServer(self.socket_path, concurrency=2,
+                                    mutators={'json': 'cat'})
+        self.assertTrue(self.server.bind())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.source = os.path.join(self.here, 'fixtures', 'test.json')
+        self.dest = os.path.join(self.tmpdir, '_test.txt')
+
+    def tearDown(self):
+        import shutil
+        from pyramid_assetmutator import daemon
+        self.server.shutdown()
+        self.server.close()
+        daemon._clients.clear()
+        shutil.rmtree(self.tmpdir)
+        testing.tearDown()
+
+    def _makeClient(self):
+        from pyramid_assetmutator.daemon import CompileClient
+        return CompileClient(self.socket_path, autostart=False,
+                             mutators={'json': 'cat'})
+
+    def test_single_server(self):
+        from pyramid_assetmutator.daemon import CompileServer
+        self.assertFalse(CompileServer(self.socket_path,
+                                       mutators={'json': 'cat'}).bind())
+
+    def test_socket_per_mutator_table(self):
+        from pyramid_assetmutator.daemon import CompileServer, CompileClient
+        self.assertTrue(self.server.socket_path.startswith(self.socket_path))
+
+        # A different table (e.g. after a deploy) gets its own server
+        server = CompileServer(self.socket_path, mutators={'json': 'tac'})
+        try:
+            self.assertTrue(server.bind())
+            self.assertNotEqual(server.socket_path, self.server.socket_path)
+            client = CompileClient(self.socket_path, autostart=False,
+                                   mutators={'json': 'tac'})
+            self.assertEqual(client.socket_path, server.socket_path)
+        finally:
+            server.close()
+
+    def test_socket_mode(self):
+        import stat
+        mode = os.stat(self.server.socket_path).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o600)
+
+    def test_bind_unsupported(self):
+        from pyramid_assetmutator import daemon
+        server = daemon.CompileServer(self.socket_path,
+                                      mutators={'json': 'tac'})
+        fcntl, daemon.fcntl = daemon.fcntl, None
+        try:
+            self.assertRaises(RuntimeError, server.bind)
+        finally:
+            daemon.fcntl = fcntl
+
+    def test_idle_timeout(self):
+        import threading
+        from pyramid_assetmutator.daemon import CompileServer
+        server = CompileServer(self.socket_path, mutators={'json': 'tac'},
+                               idle_timeout=0.1)
+        self.assertTrue(server.bind())
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        finally:
+            server.close()
+
+    def test_autostart_once(self):
+        import threading
+        import subprocess
+        from pyramid_assetmutator import daemon
+        started = []
+        client = daemon.CompileClient(self.socket_path,
+                                      mutators={'json': 'tac'})
+        server = daemon.CompileServer(self.socket_path,
+                                      mutators={'json': 'tac'})
+
+        def start_server(socket_path, mutators=None):
+            started.append(socket_path)
+            # The other clients wait while the server starts up
+            time.sleep(0.2)
+            server.bind()
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            return subprocess.Popen(['true'])
+
+        original, daemon.start_server = daemon.start_server, start_server
+        try:
+            threads = [threading.Thread(target=client.stats)
+                       for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(started, [self.socket_path])
+        finally:
+            daemon.start_server = original
+            server.shutdown()
+            server.close()
+
+    def test_unknown_mutator(self):
+        client = self._makeClient()
+        self.assertRaises(EnvironmentError, client.compile, 'cat',
+                          self.source, self.dest)
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertEqual(client.stats()['compiles'], 0)
+
+    def test_compile_timeout(self):
+        from pyramid_assetmutator.daemon import CompileServer
+        server = CompileServer(self.socket_path, mutators={'json': 'tail -f'},
+                               timeout=0.2)
+        response = server.compile('json', self.source, self.dest)
+        self.assertFalse(response['ok'])
+        self.assertTrue('Timed out' in response['error'])
+
+    def test_compile(self):
+        client = self._makeClient()
+        response = client.compile('json', self.source, self.dest,
+                                  integrity='sha384')
+
+        self.assertEqual(response['size'], os.path.getsize(self.source))
+        self.assertFalse(response['shared'])
+        self.assertTrue(response['integrity'].startswith('sha384-'))
+        self.assertEqual(compute_md5(self.dest), compute_md5(self.source))
+        self.assertTrue(os.path.exists(self.dest + '.sri'))
+
+        # The resolution table is shared, unless a remutation is forced
+        response = client.compile('json', self.source, self.dest,
+                                  integrity='sha384')
+        self.assertTrue(response['shared'])
+        response = client.compile('json', self.source, self.dest,
+                                  integrity='sha384', force=True)
+        self.assertFalse(response['shared'])
+        self.assertEqual(client.stats()['compiles'], 2)
+
+    def test_compile_deduplicated(self):
+        import threading
+        client = self._makeClient()
+        responses = []
+
+        def compile():
+            responses.append(client.compile('json', self.source, self.dest))
+
+        threads = [threading.Thread(target=compile) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = client.stats()
+        self.assertEqual(len(responses), 8)
+        self.assertEqual(stats['compiles'], 1)
+        self.assertEqual(stats['deduplicated'], 7)
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['pid'], os.getpid())
+
+    def test_compile_failure(self):
+        client = self._makeClient()
+        source = os.path.join(self.tmpdir, '_does_not_exist.json')
+
+        self.assertRaises(EnvironmentError, client.compile, 'json', source,
+                          self.dest)
+        self.assertFalse(os.path.exists(self.dest))
+
+        # Failures are not kept in the resolution table
+        self.assertRaises(EnvironmentError, client.compile, 'json', source,
+                          self.dest)
+        self.assertEqual(client.stats()['compiles'], 2)
+
+    def test_mutator_table(self):
+        from pyramid_assetmutator.daemon import get_mutator_table
+        settings = {
+            'assetmutator.mutators': {'json': {'cmd': 'cat', 'ext': 'txt'}},
+            'assetmutator.variants': {
+                'png': [{'cmd': 'convert', 'ext': 'png', 'variant': 'small'}],
+            },
+        }
+        self.assertEqual(get_mutator_table(settings),
+                         {'json': 'cat', 'png/small': 'convert'})
+
+    def test_mutator(self):
+        from pyramid_assetmutator import mutators
+        request = testing.DummyRequest()
+        config = testing.setUp(request=request)
+        config.include('pyramid_assetmutator')
+        config.assign_assetmutator('json', 'cat', 'txt')
+        settings = config.registry.settings
+        settings['assetmutator.mutators'] = mutators
+        settings['assetmutator.mutated_path'] = self.tmpdir
+        settings['assetmutator.compile_socket'] = self.socket_path
+
+        mutant = Mutator(request, self.source)
+        mutant.mutate()
+        self.assertEqual(mutant.mutated_data(), open(self.source).read())
+        self.assertEqual(self._makeClient().stats()['compiles'], 1)
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        from pyramid_assetmutator import mutators
+        from pyramid_assetmutator.events import AssetMutationStarted, \
+                                                AssetMutated, \
+                                                AssetMutationFailed
+        self.here = os.path.abspath(os.path.dirname(__file__))
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request=self.request)
+        self.settings = self.config.registry.settings
+        self.config.include('pyramid_assetmutator')
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.settings['assetmutator.mutators'] = mutators
+        self.settings['assetmutator.remutate_check'] = 'exists'
+        self.events = []
+        for iface in (AssetMutationStarted, AssetMutated, AssetMutationFailed):
+            self.config.add_subscriber(self.events.append, iface)
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_mutate_events(self):
+        from pyramid_assetmutator.events import AssetMutationStarted, \
+                                                AssetMutated
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        src_fullpath = get_abspath(path)
+        Mutator(self.request, path).mutate()
+        Mutator(self.request, path).mutate()
+
+        self.assertEqual([type(e) for e in self.events],
+                         [AssetMutationStarted, AssetMutated, AssetMutated])
+        started, mutated, hit = self.events
+
+        self.assertEqual(started.path, path)
+        self.assertEqual(started.fingerprint, hexhashify(src_fullpath))
+        self.assertEqual(started.mutator, {'cmd': 'cat', 'ext': 'txt'})
+        self.assertTrue(started.request is self.request)
+        self.assertFalse(started.rendered)
+        self.assertFalse(mutated.cache_hit)
+        self.assertTrue(mutated.duration > 0)
+        self.assertTrue(hit.cache_hit)
+        self.assertEqual(hit.duration, 0)
+
+        os.remove('%s/fixtures/_test.%s.txt' % (self.here,
+                                                hexhashify(src_fullpath)))
+
+    def test_mutate_failed_event(self):
+        from pyramid_assetmutator.events import AssetMutationStarted, \
+                                                AssetMutationFailed
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        mutant = Mutator(self.request, path,
+                         mutator=dict(cmd='false', ext='txt'))
+
+        self.assertRaises(EnvironmentError, mutant.mutate)
+        self.assertEqual([type(e) for e in self.events],
+                         [AssetMutationStarted, AssetMutationFailed])
+        self.assertTrue(isinstance(self.events[1].exception, EnvironmentError))
+
+    def test_mutate_failure_cached(self):
+        from pyramid_assetmutator.events import AssetMutationStarted, \
+                                                AssetMutationFailed
+        from pyramid_assetmutator.mutator import failed_runs
+        self.settings['assetmutator.failure_ttl'] = 60
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        mutator = dict(cmd='false', ext='txt')
+
+        try:
+            self.assertRaises(EnvironmentError,
+                              Mutator(self.request, path,
+                                      mutator=mutator).mutate)
+
+            # The failure is raised again without running the mutator
+            del self.events[:]
+            mutant = Mutator(self.request, path, mutator=mutator)
+            if sys.version_info[:2] > (2, 6):
+                with self.assertRaises(EnvironmentError) as exc:
+                    mutant.mutate()
+                self.assertTrue('Return code 1 when attempting to execute '
+                                'false.' in str(exc.exception))
+            self.assertEqual([type(e) for e in self.events],
+                             [AssetMutationFailed])
+
+            # Until the TTL expires
+            del self.events[:]
+            key = ('false', mutant.dest_fullpath,
+                   get_stat(mutant.src_fullpath))
+            failed_runs.set(key, (time.time() - 1, failed_runs.get(key)[1]))
+            self.assertRaises(EnvironmentError, mutant.mutate)
+            self.assertEqual([type(e) for e in self.events],
+                             [AssetMutationStarted, AssetMutationFailed])
+        finally:
+            failed_runs.clear()
+
+    def test_mutate_failure_source_changed(self):
+        import shutil
+        import tempfile
+        from pyramid_assetmutator.events import AssetMutationStarted, \
+                                                AssetMutationFailed
+        from pyramid_assetmutator.mutator import failed_runs
+        self.settings['assetmutator.failure_ttl'] = 60
+        tmpdir = tempfile.mkdtemp()
+        source = os.path.join(tmpdir, 'app.json')
+        with open(source, 'w') as f:
+            f.write('{}')
+        mutator = dict(cmd='false', ext='txt')
+
+        try:
+            self.assertRaises(EnvironmentError,
+                              Mutator(self.request, source,
+                                      mutator=mutator).mutate)
+
+            # Editing the source invalidates the cached failure (even though
+            # the remutate_check of exists keeps the same output filename)
+            os.utime(source, (0, 0))
+            del self.events[:]
+            self.assertRaises(EnvironmentError,
+                              Mutator(self.request, source,
+                                      mutator=mutator).mutate)
+            self.assertEqual([type(e) for e in self.events],
+                             [AssetMutationStarted, AssetMutationFailed])
+        finally:
+            failed_runs.clear()
+            shutil.rmtree(tmpdir)
+
+    def test_mutate_failure_fallback(self):
+        import shutil
+        import tempfile
+        from pyramid_assetmutator.mutator import failed_runs, last_outputs
+        tmpdir = tempfile.mkdtemp()
+        script = os.path.join(tmpdir, 'check.py')
+        with open(script, 'w') as f:
+            f.write('import sys\n'
+                    'data = open(sys.argv[1]).read()\n'
+                    'sys.exit(1) if "broken" in data else '
+                    'sys.stdout.write(data)\n')
+        source = os.path.join(tmpdir, 'app.json')
+        with open(source, 'w') as f:
+            f.write('{"good": true}')
+        mutator = {'cmd': '%s %s' % (sys.executable, script), 'ext': 'txt'}
+        self.settings['assetmutator.remutate_check'] = 'checksum'
+        self.settings['assetmutator.failure_ttl'] = 60
+        self.settings['assetmutator.failure_fallback'] = True
+
+        try:
+            good_path = Mutator(self.request, source, mutator=mutator).mutate()
+
+            with open(source, 'w') as f:
+                f.write('{"broken": true}')
+
+            # The last good output is used while the source is broken
+            for i in range(2):
+                mutant = Mutator(self.request, source, mutator=mutator)
+                self.assertEqual(mutant.mutate(), good_path)
+                self.assertEqual(mutant.mutated_data(), '{"good": true}')
+
+            resolved = last_outputs.get((source, mutator['cmd']))
+            self.assertEqual(resolved.new_path, good_path)
+            self.assertTrue(resolved.fingerprint in good_path)
+
+            self.settings['assetmutator.failure_fallback'] = False
+            self.assertRaises(EnvironmentError,
+                              Mutator(self.request, source,
+                                      mutator=mutator).mutate)
+        finally:
+            failed_runs.clear()
+            last_outputs.clear()
+            shutil.rmtree(tmpdir)
+
+    def test_mutate_concurrent(self):
+        import tempfile
+        import threading
+        from pyramid_assetmutator.events import AssetMutationStarted
+        tmpdir = tempfile.mkdtemp()
+        script = os.path.join(tmpdir, 'slowcat.py')
+        with open(script, 'w') as f:
+            f.write('import sys, time\n'
+                    'time.sleep(0.2)\n'
+                    'sys.stdout.write(open(sys.argv[1]).read())\n')
+        mutator = {'cmd': '%s %s' % (sys.executable, script), 'ext': 'txt'}
+        path = get_abspath('pyramid_assetmutator.tests:fixtures/test.json')
+        self.settings['assetmutator.mutated_path'] = tmpdir
+        new_paths = []
+
+        def request():
+            new_paths.append(Mutator(self.request, path, mutator=mutator,
+                                     registry=self.config.registry).mutate())
+
+        try:
+            # A herd of cold requests only mutates the asset once
+            threads = [threading.Thread(target=request) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            started = [e for e in self.events
+                       if isinstance(e, AssetMutationStarted)]
+            self.assertEqual(len(started), 1)
+            self.assertEqual(len(set(new_paths)), 1)
+            self.assertEqual(len(new_paths), 8)
+        finally:
+            import shutil
+            shutil.rmtree(tmpdir)
+
+    def test_mutate_all(self):
+        import threading
+        from pyramid_assetmutator.events import AssetMutated
+        from pyramid_assetmutator.mutator import mutate_all
+        paths = ['pyramid_assetmutator.tests:fixtures/subdir/test3.json',
+                 'pyramid_assetmutator.tests:fixtures/test.json',
+                 'pyramid_assetmutator.tests:fixtures/subdir/test3.json',
+                 'pyramid_assetmutator.tests:fixtures/subdir/test2.json']
+        threads = []
+        self.config.add_subscriber(
+            lambda event: threads.append(threading.current_thread()),
+            AssetMutated
+        )
+
+        new_paths = mutate_all(self.request, paths, max_workers=3)
+
+        self.assertEqual(new_paths, [Mutator(self.request, path).new_path
+                                     for path in paths])
+        # Each stale asset was mutated once, outside of the calling thread
+        mutated = [e for e in self.events
+                   if isinstance(e, AssetMutated) and not e.cache_hit]
+        self.assertEqual(sorted(e.path for e in mutated), sorted(set(paths)))
+        self.assertFalse(threading.current_thread() in threads)
+
+        # Up to date assets are not mutated again
+        del self.events[:]
+        self.assertEqual(mutate_all(self.request, paths), new_paths)
+        self.assertEqual([e.cache_hit for e in self.events], [True] * 3)
+
+        for path in set(new_paths):
+            os.remove(get_abspath(path))
+
+    def test_mutate_all_failed(self):
+        from pyramid_assetmutator.mutator import mutate_all
+        paths = ['pyramid_assetmutator.tests:fixtures/subdir/test2.json',
+                 'pyramid_assetmutator.tests:fixtures/subdir/test3.json']
+
+        self.assertRaises(EnvironmentError, mutate_all, self.request, paths,
+                          mutator=dict(cmd='false', ext='txt'))
+
+class TestWarmup(unittest.TestCase):
+    def setUp(self):
+        from pyramid_assetmutator import mutators
+        self.here = os.path.abspath(os.path.dirname(__file__))
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request=self.request)
+        self.settings = self.config.registry.settings
+        self.config.include('pyramid_assetmutator')
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.settings['assetmutator.mutators'] = mutators
+        self.settings['assetmutator.remutate_check'] = 'exists'
+        self.sources = [os.path.join(self.here, 'fixtures', 'test.json'),
+                        os.path.join(self.here, 'fixtures', 'subdir',
+                                     'test2.json')]
+        self.filenames = [os.path.join(os.path.dirname(source), '_%s.%s.txt' %
+                                       (os.path.basename(source)[:-5],
+                                        hexhashify(source)))
+                          for source in self.sources]
+
+    def tearDown(self):
+        for filename in self.filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+        testing.tearDown()
+
+    def _makeOne(self, assets):
+        from pyramid_assetmutator.warmup import Warmup
+        return Warmup(self.request, self.config.registry, assets, workers=2)
+
+    def test_it(self):
+        warmup = self._makeOne([(source, None) for source in self.sources] +
+                               [(self.sources[0], None)])
+        self.assertFalse(warmup.ready)
+        self.assertEqual(warmup.progress(),
+                         {'ready': False, 'total': 2, 'done': 0, 'failed': 0,
+                          'pending': 2})
+
+        warmup.start()
+        self.assertTrue(warmup.join(10))
+        self.assertEqual(warmup.progress(),
+                         {'ready': True, 'total': 2, 'done': 2, 'failed': 0,
+                          'pending': 0})
+        for filename in self.filenames:
+            self.assertTrue(os.path.exists(filename))
+
+    def test_failed(self):
+        warmup = self._makeOne([(self.sources[0], {'cmd': 'false',
+                                                   'ext': 'txt'})])
+        warmup.start()
+        self.assertTrue(warmup.join(10))
+        self.assertEqual(warmup.progress()['failed'], 1)
+
+    def test_wait_prioritized(self):
+        warmup = self._makeOne([(source, None) for source in self.sources])
+        self.settings['assetmutator.warmup'] = warmup
+
+        # A request for a pending asset mutates it right away (the background
+        # threads have not even been started here)
+        mutant = Mutator(self.request, self.sources[1])
+        self.assertTrue(mutant.is_mutated)
+        self.assertEqual(warmup.progress()['done'], 1)
+        self.assertFalse(os.path.exists(self.filenames[0]))
+
+    def test_mutate_all_pending(self):
+        import threading
+        from pyramid_assetmutator.events import AssetMutationStarted
+        from pyramid_assetmutator.mutator import mutate_all
+        warmup = self._makeOne([(source, None) for source in self.sources])
+        self.settings['assetmutator.warmup'] = warmup
+        threads = []
+        self.config.add_subscriber(
+            lambda event: threads.append(threading.current_thread()),
+            AssetMutationStarted
+        )
+
+        # Pending assets are waited for (here, mutated) in the pool rather
+        # than one at a time in the calling thread
+        self.assertTrue(warmup.is_pending(self.sources[0]))
+        mutate_all(self.request, self.sources, max_workers=2)
+        self.assertEqual(warmup.progress()['done'], 2)
+        self.assertFalse(warmup.is_pending(self.sources[0]))
+        self.assertEqual(len(threads), 2)
+        self.assertFalse(threading.current_thread() in threads)
+        for filename in self.filenames:
+            self.assertTrue(os.path.exists(filename))
+
+    def test_health_view(self):
+        from pyramid_assetmutator.warmup import health_view
+        warmup = self._makeOne([(source, None) for source in self.sources])
+
+        response = health_view(self.request)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.json['ready'], True)
+
+        self.settings['assetmutator.warmup'] = warmup
+        response = health_view(self.request)
+        self.assertEqual(response.status_int, 503)
+        self.assertEqual(response.json['pending'], 2)
+
+        warmup.start()
+        warmup.join(10)
+        response = health_view(self.request)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.json['done'], 2)
+
+class TestBuildState(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from pyramid_assetmutator import mutators
+        from pyramid_assetmutator.events import AssetMutated
+        self.tmpdir = tempfile.mkdtemp()
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request=self.request)
+        self.settings = self.config.registry.settings
+        self.config.include('pyramid_assetmutator')
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.settings['assetmutator.mutators'] = mutators
+        self.settings['assetmutator.mutated_path'] = \
+            os.path.join(self.tmpdir, 'cache')
+        self.events = []
+        self.config.add_subscriber(self.events.append, AssetMutated)
+        self.source = os.path.join(self.tmpdir, 'test.json')
+        with open(self.source, 'w') as f:
+            f.write('{"spam": "eggs"}')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+        testing.tearDown()
+
+    def _makeOne(self):
+        from pyramid_assetmutator.state import BuildState
+        return BuildState(os.path.join(self.tmpdir, 'state.db'))
+
+    def _mutate(self, state):
+        del self.events[:]
+        Mutator(self.request, os.path.join(self.tmpdir, '*.json'), batch=True,
+                build_state=state).mutate()
+        return [event.cache_hit for event in self.events]
+
+    def test_stable_fingerprint(self):
+        import subprocess
+        # Fingerprints are stable across processes (and hash seeds), so that
+        # the recorded outputs are found again after a restart
+        proc = subprocess.Popen(
+            [sys.executable, '-c',
+             'from pyramid_assetmutator.utils import hexhashify; '
+             'print(hexhashify(%r))' % self.source],
+            stdout=subprocess.PIPE,
+            env=dict(os.environ, PYTHONHASHSEED='12345')
+        )
+        output = proc.communicate()[0]
+        self.assertEqual(output.decode('utf-8').strip(),
+                         hexhashify(self.source))
+
+    def test_record(self):
+        state = self._makeOne()
+
+        self.assertEqual(state.get(self.source), None)
+        state.record(self.source, get_stat(self.source), 'abc', 'cat',
+                     self.source)
+        record = state.get(self.source)
+        self.assertEqual(record.digest, 'abc')
+        self.assertFalse(state.is_stale(record))
+        self.assertEqual(state.stale(), [])
+
+        os.utime(self.source, (0, 0))
+        self.assertTrue(state.is_stale(record))
+        self.assertEqual(state.stale(), [self.source])
+
+        state.remove(self.source)
+        self.assertEqual(state.records(), [])
+        state.close()
+
+    def test_mutate(self):
+        state = self._makeOne()
+
+        self.assertEqual(self._mutate(state), [False])
+        self.assertEqual(self._mutate(state), [True])
+        record = state.get(self.source)
+        self.assertEqual(record.cmd, 'cat')
+        self.assertEqual(record.digest, compute_md5(self.source))
+
+        # Only the stat info changed: the previous output is reused
+        os.utime(self.source, (0, 0))
+        self.assertEqual(state.stale(), [self.source])
+        self.assertEqual(self._mutate(state), [True])
+        self.assertNotEqual(state.get(self.source).dest, record.dest)
+        self.assertTrue(os.path.exists(state.get(self.source).dest))
+        self.assertEqual(state.stale(), [])
+
+        # The contents changed
+        with open(self.source, 'w') as f:
+            f.write('{"spam": "spam"}')
+        self.assertEqual(self._mutate(state), [False])
+        with open(state.get(self.source).dest) as f:
+            self.assertEqual(f.read(), '{"spam": "spam"}')
+        state.close()
+
+    def test_each_boot(self):
+        self.settings['assetmutator.build_state'] = True
+        self.settings['assetmutator.build_state_path'] = \
+            os.path.join(self.tmpdir, 'state', 'assetmutator.db')
+        self.settings['assetmutator.each_boot'] = \
+            [os.path.join(self.tmpdir, '*.json')]
+
+        self.config.make_wsgi_app()
+        self.config.make_wsgi_app()
+
+        self.assertEqual([event.cache_hit for event in self.events],
+                         [False, True])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'state',
+                                                    'assetmutator.db')))
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'cache')),
+                         ['_test.%s.txt' % self.events[0].mutant.fingerprint])
+
+    def test_default_path(self):
+        import tempfile
+        from pyramid_assetmutator.state import get_default_path
+        mutated_path = os.path.join(self.tmpdir, 'cache')
+        path = get_default_path(mutated_path)
+
+        self.assertEqual(os.path.dirname(path), tempfile.gettempdir())
+        self.assertEqual(path, get_default_path(mutated_path))
+        self.assertNotEqual(path, get_default_path(self.tmpdir))
+
+class TestContentAddressed(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from pyramid_assetmutator import mutators
+        self.tmpdir = tempfile.mkdtemp()
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request=self.request)
+        self.settings = self.config.registry.settings
+        self.config.include('pyramid_assetmutator')
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.settings['assetmutator.mutators'] = mutators
+        self.settings['assetmutator.mutated_path'] = \
+            os.path.join(self.tmpdir, 'cache')
+        self.settings['assetmutator.content_addressed'] = True
+        self.sources = []
+        for name in ('a', 'b', 'c'):
+            source = os.path.join(self.tmpdir, '%s.json' % name)
+            with open(source, 'w') as f:
+                f.write('{"spam": "%s"}' % ('eggs' if name == 'c' else 'spam'))
+            self.sources.append(source)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+        testing.tearDown()
+
+    def test_mutate(self):
+        mutants = [Mutator(self.request, source) for source in self.sources]
+        for mutant in mutants:
+            mutant.mutate()
+
+        a, b, c = [mutant.dest_fullpath for mutant in mutants]
+        self.assertTrue(os.path.samefile(a, b))
+        self.assertFalse(os.path.samefile(a, c))
+        self.assertEqual(mutants[1].mutated_data(), '{"spam": "spam"}')
+
+        cas = []
+        for dirpath, dirnames, filenames in os.walk(
+            os.path.join(self.tmpdir, 'cache', CAS_DIRNAME)
+        ):
+            cas.extend(os.path.join(dirpath, f) for f in filenames)
+        self.assertEqual(len(cas), 2)
+        self.assertTrue(os.path.basename(cas[0]).endswith('.txt'))
+
+    def test_link_file_fallback(self):
+        link = os.link
+        src = self.sources[0]
+        dest = os.path.join(self.tmpdir, 'link.json')
+
+        def fail(*args):
+            raise OSError('Not supported.')
+
+        os.link = fail
+        try:
+            link_file(src, dest)
+        finally:
+            os.link = link
+
+        self.assertTrue(os.path.islink(dest))
+        self.assertTrue(os.path.samefile(src, dest))
+
+        link_file(src, dest)
+        self.assertFalse(os.path.islink(dest))
+        self.assertTrue(os.path.samefile(src, dest))
+
+class TestBuildProfile(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from pyramid_assetmutator import mutators
+        self.tmpdir = tempfile.mkdtemp()
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request=self.request)
+        self.settings = self.config.registry.settings
+        self.config.include('pyramid_assetmutator')
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.settings['assetmutator.mutators'] = mutators
+        self.settings['assetmutator.mutated_path'] = \
+            os.path.join(self.tmpdir, 'cache')
+        self.settings['assetmutator.build_state'] = True
+        self.settings['assetmutator.build_state_path'] = \
+            os.path.join(self.tmpdir, 'assetmutator.db')
+        self.settings['assetmutator.each_boot'] = \
+            [os.path.join(self.tmpdir, '[ab].json')]
+        self.settings['assetmutator.build_profile'] = \
+            os.path.join(self.tmpdir, 'profile.json')
+        for name in ('a', 'b'):
+            with open(os.path.join(self.tmpdir, '%s.json' % name), 'w') as f:
+                f.write('{"spam": "%s"}' % (name * 64))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+        testing.tearDown()
+
+    def _report(self):
+        import json
+        with open(self.settings['assetmutator.build_profile']) as f:
+            return json.load(f)
+
+    def test_each_boot(self):
+        from pyramid_assetmutator.profiling import summarize
+        self.config.make_wsgi_app()
+        report = self._report()
+
+        self.assertEqual(report['totals']['assets'], 2)
+        self.assertEqual(report['totals']['mutated'], 2)
+        self.assertEqual(sorted(report['mutators']), ['cat'])
+        seconds = [entry['seconds'] for entry in report['assets']]
+        self.assertEqual(seconds, sorted(seconds, reverse=True))
+        for entry in report['assets']:
+            self.assertEqual(entry['mutator'], 'cat')
+            self.assertEqual(entry['input_bytes'], 76)
+            self.assertEqual(entry['output_bytes'], 76)
+            self.assertFalse(entry['skipped'] or entry['failed'])
+
+        # Up to date assets are reported as skipped
+        self.config.make_wsgi_app()
+        report = self._report()
+        self.assertEqual(report['totals']['skipped'], 2)
+        self.assertEqual(report['totals']['seconds'], 0)
+        self.assertTrue(summarize(report).startswith(
+            'Processed 2 asset(s) in 0.00s: 0 mutated, 2 skipped, 0 failed.'
+        ))
+
+    def test_each_boot_failed(self):
+        with open(os.path.join(self.tmpdir, 'a.json'), 'w') as f:
+            f.write('{}')
+        self.config.assign_assetmutator('json', 'false', 'txt')
+        try:
+            self.assertRaises(EnvironmentError, self.config.make_wsgi_app)
+        finally:
+            self.config.assign_assetmutator('json', 'cat', 'txt')
+
+        report = self._report()
+        self.assertEqual(report['totals']['failed'], 1)
+        self.assertTrue(report['assets'][0]['error'])
+        self.assertEqual(report['assets'][0]['output_bytes'], None)
+
+    def test_each_boot_background(self):
+        self.settings['assetmutator.each_boot_background'] = True
+        self.config.make_wsgi_app()
+        self.assertTrue(self.settings['assetmutator.warmup'].join(10))
+
+        self.assertEqual(self._report()['totals']['mutated'], 2)
+
+    def test_relative_path(self):
+        cwd = os.getcwd()
+        self.settings['assetmutator.build_profile'] = 'profile.json'
+        os.chdir(self.tmpdir)
+        try:
+            self.config.make_wsgi_app()
+        finally:
+            os.chdir(cwd)
+
+        # Relative paths are resolved against the working directory
+        with open(os.path.join(self.tmpdir, 'profile.json')) as f:
+            self.assertTrue(f.read())
+
+    def test_requests_ignored(self):
+        from pyramid_assetmutator.profiling import BuildProfile
+        profile = BuildProfile()
+        profile.subscribe(self.config.registry)
+        source = os.path.join(self.tmpdir, 'a.json')
+
+        try:
+            Mutator(self.request, source, registry=self.config.registry,
+                    batch=True).mutate()
+            Mutator(self.request, os.path.join(self.tmpdir, 'b.json'),
+                    registry=self.config.registry).mutate()
+        finally:
+            profile.unsubscribe()
+
+        self.assertEqual([entry['path'] for entry in profile.entries],
+                         [source])
+
+class TestStaticView(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = testing.setUp(settings={
+            'assetmutator.mutated_path': self.tmpdir,
+        })
+        self.config.include('pyramid_assetmutator')
+        self.filename = '_test.0x1234.txt'
+        with open(os.path.join(self.tmpdir, self.filename), 'wb') as f:
+            f.write(b'{"spam": "eggs"}')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+        testing.tearDown()
+
+    def _makeApp(self, **kw):
+        self.config.add_assetmutator_view('mutated', **kw)
+        return TestApp(self.config.make_wsgi_app())
+
+    def test_no_mutated_path(self):
+        from pyramid.exceptions import ConfigurationError
+        self.config.registry.settings['assetmutator.mutated_path'] = ''
+        self.assertRaises(ConfigurationError,
+                          self.config.add_assetmutator_view, 'mutated')
+
+    def test_immutable(self):
+        app = self._makeApp(cache_max_age=600)
+        resp = app.get('/mutated/%s' % self.filename)
+        resp.mustcontain('{"spam": "eggs"}')
+        self.assertEqual(resp.headers['Cache-Control'],
+                         'public, max-age=600, immutable')
+        self.assertEqual(resp.headers['ETag'], '"%s"' % self.filename)
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(resp.content_type, 'text/plain')
+
+    def test_not_modified(self):
+        app = self._makeApp()
+        resp = app.get('/mutated/%s' % self.filename,
+                       headers={'If-None-Match': '"%s"' % self.filename},
+                       status=304)
+        self.assertEqual(resp.body, b'')
+        self.assertEqual(resp.headers['ETag'], '"%s"' % self.filename)
+        self.assertTrue('immutable' in resp.headers['Cache-Control'])
+
+        # A stale ETag gets the full response
+        app.get('/mutated/%s' % self.filename,
+                headers={'If-None-Match': '"_test.0x5678.txt"'}, status=200)
+
+    def test_precompressed(self):
+        import gzip
+        path = os.path.join(self.tmpdir, self.filename + '.gz')
+        f = gzip.open(path, 'wb')
+        f.write(b'{"spam": "eggs"}')
+        f.close()
+        app = self._makeApp()
+
+        # (WebTest transparently decodes the gzipped response body)
+        resp = app.get('/mutated/%s' % self.filename,
+                       headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.headers['ETag'], '"%s-gzip"' % self.filename)
+        self.assertEqual(resp.content_type, 'text/plain')
+        resp.mustcontain('{"spam": "eggs"}')
+
+        # Clients which don't accept the encoding get the plain file
+        resp = app.get('/mutated/%s' % self.filename,
+                       headers={'Accept-Encoding': 'identity'})
+        self.assertEqual(resp.headers['ETag'], '"%s"' % self.filename)
+        resp.mustcontain('{"spam": "eggs"}')
+
+    def test_not_found(self):
+        app = self._makeApp()
+        app.get('/mutated/_missing.txt', status=404)
+        app.get('/mutated/', status=404)
+        app.get('/mutated/../__init__.py', status=404)
+
+    def test_private_files(self):
+        os.mkdir(os.path.join(self.tmpdir, '.cas'))
+        for name in ('.cas/0123', '.hidden', self.filename + '.sri',
+                     self.filename + '.1-2.tmp', 'slots.0.lock'):
+            with open(os.path.join(self.tmpdir, name), 'wb') as f:
+                f.write(b'spam')
+        app = self._makeApp()
+
+        app.get('/mutated/.cas/0123', status=404)
+        app.get('/mutated/.hidden', status=404)
+        app.get('/mutated/%s.sri' % self.filename, status=404)
+        app.get('/mutated/%s.1-2.tmp' % self.filename, status=404)
+        app.get('/mutated/slots.0.lock', status=404)
+
+    def test_static_url(self):
+        from pyramid.request import Request
+        self._makeApp()
+        request = Request.blank('/')
+        request.registry = self.config.registry
+        self.assertEqual(
+            request.static_url(os.path.join(self.tmpdir, self.filename)),
+            'http://localhost/mutated/%s' % self.filename
+        )
+
 class TestPyramidMutator(unittest.TestCase):
     def setUp(self):
         self.here = os.path.abspath(os.path.dirname(__file__))
@@ -402,6 +2235,200 @@ class TestPyramidMutator(unittest.TestCase):
         self.assertEqual(os.path.getsize(filename), os.path.getsize(source))
         os.remove(filename)
 
+    def test_assetmutator_integrity(self):
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        src_fullpath = get_abspath(path)
+        template = '%s/fixtures/test_assetmutator_integrity.pt' % self.here
+        self.config.registry.settings['assetmutator.integrity'] = 'sha256'
+        self.config.add_view(route_name='home', view=home, renderer=template)
+        self.app = TestApp(self.config.make_wsgi_app())
+        resp = self.app.get('/')
+
+        filename = '%s/fixtures/_test.%s.txt' % (self.here,
+                                                 hexhashify(src_fullpath))
+        with open(filename + '.sri') as f:
+            integrity = f.read()
+        self.assertTrue(integrity.startswith('sha256-'))
+        self.assertEqual(resp.text.strip(), integrity)
+
+        os.remove(filename)
+        os.remove(filename + '.sri')
+
+    def test_assetmutator_bundle_url(self):
+        from pyramid_assetmutator import bundles
+        self.config.assign_assetbundle(
+            'bundle.txt',
+            ['pyramid_assetmutator.tests:fixtures/test.json',
+             'pyramid_assetmutator.tests:fixtures/subdir/test2.json']
+        )
+        template = '%s/fixtures/test_assetmutator_bundle_url.pt' % self.here
+        self.config.add_view(route_name='home', view=home, renderer=template)
+        self.app = TestApp(self.config.make_wsgi_app())
+        try:
+            resp = self.app.get('/')
+        finally:
+            bundles.clear()
+        url = resp.text.strip()
+        self.assertTrue(url.startswith('http://localhost/static/_bundle.'))
+        resp = self.app.get(url)
+        self.assertEqual(resp.text, '{"spam": "lorem", "eggs": "鸡蛋"}\n\n' + \
+                                    '{"spam": "lorem", "eggs": "鸡蛋"}\n')
+
+        source = '%s/fixtures/test.json' % self.here
+        source2 = '%s/fixtures/subdir/test2.json' % self.here
+        os.remove('%s/fixtures/%s' % (self.here, url.split('/')[-1]))
+        os.remove('%s/fixtures/_test.%s.txt' % (self.here,
+                                                hexhashify(source)))
+        os.remove('%s/fixtures/subdir/_test2.%s.txt' % (self.here,
+                                                        hexhashify(source2)))
+
+    def test_assetmutator_urls(self):
+        paths = ['pyramid_assetmutator.tests:fixtures/subdir/test3.json',
+                 'pyramid_assetmutator.tests:fixtures/test.json',
+                 'pyramid_assetmutator.tests:fixtures/subdir/test2.json']
+        template = '%s/fixtures/test_assetmutator_urls.pt' % self.here
+        self.config.add_view(route_name='home', view=home, renderer=template)
+        self.app = TestApp(self.config.make_wsgi_app())
+        resp = self.app.get('/')
+
+        filenames = []
+        for path in paths:
+            src_fullpath = get_abspath(path)
+            filenames.append(
+                os.path.join(os.path.dirname(src_fullpath), '_%s.%s.txt' % (
+                    os.path.splitext(os.path.basename(src_fullpath))[0],
+                    hexhashify(src_fullpath)
+                ))
+            )
+
+        self.assertEqual(
+            resp.text.split(),
+            ['http://localhost/static/%s' % filename[len(self.here) + 10:]
+             for filename in filenames]
+        )
+
+        for filename in filenames:
+            self.assertTrue(os.path.exists(filename))
+            os.remove(filename)
+
+    def test_assetmutator_srcset(self):
+        from pyramid_assetmutator import variants
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        src_fullpath = get_abspath(path)
+        template = '%s/fixtures/test_assetmutator_srcset.pt' % self.here
+        self.config.assign_assetvariants('json', [('1x', 'cat', 'txt'),
+                                                  ('2x', 'cat', 'txt'),
+                                                  ('big', 'cat', 'txt', '3x')])
+        self.config.add_view(route_name='home', view=home, renderer=template)
+        self.app = TestApp(self.config.make_wsgi_app())
+
+        try:
+            resp = self.app.get('/')
+            urls = dict(
+                (name, 'http://localhost/static/_test-%s.%s.txt' % (
+                       name, hexhashify(src_fullpath)))
+                for name in ('1x', '2x', 'big')
+            )
+
+            self.assertEqual(resp.text.strip().split('\n'), [
+                '%s 1x, %s 2x, %s 3x' % (urls['1x'], urls['2x'], urls['big']),
+                '%s 2x' % urls['2x'],
+            ])
+        finally:
+            del variants['json']
+            for name in ('1x', '2x', 'big'):
+                filename = '%s/fixtures/_test-%s.%s.txt' % (
+                    self.here, name, hexhashify(src_fullpath))
+                self.assertTrue(os.path.exists(filename))
+                os.remove(filename)
+
+    def test_assetmutator_srcset_each_boot(self):
+        from pyramid_assetmutator import variants
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        src_fullpath = get_abspath(path)
+        template = '%s/fixtures/test_assetmutator_srcset.pt' % self.here
+        self.config.registry.settings['assetmutator.each_request'] = False
+        self.config.registry.settings['assetmutator.each_boot'] = [path]
+        self.config.assign_assetvariants('json', [('1x', 'cat', 'txt'),
+                                                  ('2x', 'cat', 'txt')])
+        self.config.add_view(route_name='home', view=home, renderer=template)
+
+        try:
+            self.app = TestApp(self.config.make_wsgi_app())
+
+            # The variants were built at boot
+            for name in ('', '-1x', '-2x'):
+                filename = '%s/fixtures/_test%s.%s.txt' % (
+                    self.here, name, hexhashify(src_fullpath))
+                self.assertTrue(os.path.exists(filename))
+
+            resp = self.app.get('/')
+            self.assertEqual(
+                resp.text.strip().split('\n')[-1],
+                'http://localhost/static/_test-2x.%s.txt 2x' % hexhashify(
+                    src_fullpath
+                )
+            )
+        finally:
+            del variants['json']
+            for name in ('', '-1x', '-2x'):
+                filename = '%s/fixtures/_test%s.%s.txt' % (
+                    self.here, name, hexhashify(src_fullpath))
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    def test_assetmutator_url_memoized(self):
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        src_fullpath = get_abspath(path)
+        template = '%s/fixtures/test_assetmutator_url_memoized.pt' % self.here
+        from pyramid_assetmutator.metrics import MemoryMetricsSink
+        sink = MemoryMetricsSink()
+        self.config.set_assetmutator_metrics_sink(sink)
+        self.config.add_view(route_name='home', view=home, renderer=template)
+        self.app = TestApp(self.config.make_wsgi_app())
+        filename = '_test.%s.txt' % hexhashify(src_fullpath)
+
+        resp = self.app.get('/')
+        self.assertEqual(resp.text.split(),
+                         ['http://localhost/static/%s' % filename,
+                          'http://localhost/static/%s' % filename,
+                          '/static/%s' % filename])
+        # The repeated url helper call was answered from the request's memo
+        self.assertEqual(
+            sink.value('assetmutator_should_mutate_total', outcome='mutate'),
+            1
+        )
+        self.assertEqual(
+            sink.value('assetmutator_should_mutate_total', outcome='hit'), 1
+        )
+
+        # ...which is not shared between requests
+        self.app.get('/')
+        self.assertEqual(
+            sink.value('assetmutator_should_mutate_total', outcome='hit'), 3
+        )
+
+        os.remove('%s/fixtures/%s' % (self.here, filename))
+
+    def test_assetmutator_metrics_view(self):
+        path = 'pyramid_assetmutator.tests:fixtures/test.json'
+        src_fullpath = get_abspath(path)
+        template = '%s/fixtures/test_assetmutator_url.pt' % self.here
+        from pyramid_assetmutator.metrics import MemoryMetricsSink
+        self.config.set_assetmutator_metrics_sink(MemoryMetricsSink())
+        self.config.add_assetmutator_metrics_view()
+        self.config.add_view(route_name='home', view=home, renderer=template)
+        self.app = TestApp(self.config.make_wsgi_app())
+        self.app.get('/')
+
+        resp = self.app.get('/_assetmutator/metrics')
+        resp.mustcontain('assetmutator_helper_seconds_count{helper="url"} 1',
+                         'assetmutator_should_mutate_total{outcome="mutate"} 1',
+                         'assetmutator_compile_seconds_count{mutator="cat"} 1')
+
+        os.remove('%s/fixtures/_test.%s.txt' % (self.here,
+                                                hexhashify(src_fullpath)))
+
     def test_each_boot_exists(self):
         self.config.registry.settings['assetmutator.each_request'] = 'false'
         self.config.registry.settings['assetmutator.each_boot'] = \
@@ -468,6 +2495,104 @@ class TestPyramidMutator(unittest.TestCase):
         self.assertEqual(os.path.getsize(filename3), os.path.getsize(source3))
         os.remove(filename3)
 
+    def test_each_boot_recursive_exclude(self):
+        self.config.registry.settings['assetmutator.each_request'] = 'false'
+        self.config.registry.settings['assetmutator.each_boot'] = \
+            ['pyramid_assetmutator.tests:fixtures/**/*.json']
+        self.config.registry.settings['assetmutator.each_boot_exclude'] = \
+            ['test2.json']
+        self.app = TestApp(self.config.make_wsgi_app())
+
+        source = '%s/fixtures/test.json' % self.here
+        filename = '%s/fixtures/_test.%s.txt' % (self.here,
+                                                 hexhashify(source))
+        self.assertTrue(os.path.exists(filename))
+        os.remove(filename)
+
+        source2 = '%s/fixtures/subdir/test2.json' % self.here
+        filename2 = '%s/fixtures/subdir/_test2.%s.txt' % (self.here,
+                                                          hexhashify(source2))
+        self.assertFalse(os.path.exists(filename2))
+
+        source3 = '%s/fixtures/subdir/test3.json' % self.here
+        filename3 = '%s/fixtures/subdir/_test3.%s.txt' % (self.here,
+                                                          hexhashify(source3))
+        self.assertTrue(os.path.exists(filename3))
+        os.remove(filename3)
+
+    def test_each_boot_templates(self):
+        self.config.registry.settings['assetmutator.each_request'] = 'false'
+        self.config.registry.settings['assetmutator.each_boot_templates'] = \
+            ['pyramid_assetmutator.tests:fixtures']
+        self.app = TestApp(self.config.make_wsgi_app())
+
+        source = '%s/fixtures/test.json' % self.here
+        filename = '%s/fixtures/_test.%s.txt' % (self.here,
+                                                 hexhashify(source))
+        self.assertTrue(os.path.exists(filename))
+        self.assertEqual(os.path.getsize(filename), os.path.getsize(source))
+        os.remove(filename)
+
+        # Including the sources referenced by assetmutator_urls
+        for source in ('subdir/test2.json', 'subdir/test3.json'):
+            source = '%s/fixtures/%s' % (self.here, source)
+            filename = '%s/_%s.%s.txt' % (os.path.dirname(source),
+                                          os.path.basename(source)[:-5],
+                                          hexhashify(source))
+            self.assertTrue(os.path.exists(filename))
+            os.remove(filename)
+
+    def test_each_boot_templates_srcset(self):
+        from pyramid_assetmutator import variants
+        self.config.registry.settings['assetmutator.each_request'] = 'false'
+        self.config.registry.settings['assetmutator.each_boot_templates'] = \
+            ['pyramid_assetmutator.tests:fixtures']
+        self.config.assign_assetvariants('json', [('1x', 'cat', 'txt'),
+                                                  ('2x', 'cat', 'txt')])
+
+        try:
+            self.app = TestApp(self.config.make_wsgi_app())
+        finally:
+            del variants['json']
+
+        # The variants referenced by assetmutator_srcset are built as well
+        for name in ('', '-1x', '-2x'):
+            source = '%s/fixtures/test.json' % self.here
+            filename = '%s/fixtures/_test%s.%s.txt' % (self.here, name,
+                                                       hexhashify(source))
+            self.assertTrue(os.path.exists(filename))
+            os.remove(filename)
+
+        for source in ('subdir/test2.json', 'subdir/test3.json'):
+            source = '%s/fixtures/%s' % (self.here, source)
+            filename = '%s/_%s.%s.txt' % (os.path.dirname(source),
+                                          os.path.basename(source)[:-5],
+                                          hexhashify(source))
+            os.remove(filename)
+
+    def test_each_boot_background(self):
+        self.config.registry.settings['assetmutator.each_request'] = 'false'
+        self.config.registry.settings['assetmutator.each_boot_background'] = \
+            'true'
+        self.config.registry.settings['assetmutator.each_boot'] = \
+            ['pyramid_assetmutator.tests:fixtures/**/*.json']
+        self.config.add_assetmutator_health_view()
+        self.app = TestApp(self.config.make_wsgi_app())
+
+        warmup = self.config.registry.settings['assetmutator.warmup']
+        self.assertTrue(warmup.join(10))
+        resp = self.app.get('/_assetmutator/health')
+        self.assertEqual(resp.json, {'ready': True, 'total': 3, 'done': 3,
+                                     'failed': 0, 'pending': 0})
+
+        for source in ('test.json', 'subdir/test2.json', 'subdir/test3.json'):
+            source = '%s/fixtures/%s' % (self.here, source)
+            filename = '%s/_%s.%s.txt' % (os.path.dirname(source),
+                                          os.path.basename(source)[:-5],
+                                          hexhashify(source))
+            self.assertTrue(os.path.exists(filename))
+            os.remove(filename)
+
     def test_each_boot_checksum(self):
         self.config.registry.settings['assetmutator.remutate_check'] = \
             'checksum'
@@ -502,6 +2627,8 @@ class TestPyramidMutator(unittest.TestCase):
 
 class TestPyramidRenderedMutator(unittest.TestCase):
     def setUp(self):
+        from pyramid_assetmutator.mutator import rendered_digests
+        rendered_digests.clear()
         self.here = os.path.abspath(os.path.dirname(__file__))
         self.fingerprint = None
         self.config = testing.setUp()
@@ -517,16 +2644,30 @@ class TestPyramidRenderedMutator(unittest.TestCase):
                                     'pyramid_assetmutator.tests:cache')
         self.config.add_route('home', '/')
 
+    def _outputs(self, fingerprint):
+        prefix = '_test.%s' % fingerprint
+        return [name[6:-4] for name in os.listdir('%s/cache' % self.here)
+                if name.startswith(prefix) and name.endswith('.txt')]
+
+    def _fingerprint(self, src_fullpath, base=None):
+        # The rendered source is removed once mutated, so look up the mutated
+        # output (whose digest is that of the rendered source, as ``cat`` is
+        # the mutator)
+        fingerprints = self._outputs(base or hexhashify(src_fullpath))
+        self.assertEqual(len(fingerprints), 1)
+        filename = '%s/cache/_test.%s.txt' % (self.here, fingerprints[0])
+        self.assertEqual(fingerprints[0][-12:], compute_md5(filename))
+        return fingerprints[0]
+
     def tearDown(self):
-        source = '%s/cache/_test.json' % self.here
         filename = '%s/cache/_test.%s.txt' % (self.here, self.fingerprint)
 
-        self.assertTrue(os.path.exists(source))
         self.assertTrue(os.path.exists(filename))
-        self.assertEqual(os.path.getsize(filename), os.path.getsize(source))
         self.assertTrue(os.path.getsize(filename) > 30)
+        # No rendered sources are left behind
+        self.assertEqual([name for name in os.listdir('%s/cache' % self.here)
+                          if name.endswith('.json')], [])
 
-        os.remove(source)
         os.remove(filename)
 
         testing.tearDown()
@@ -534,11 +2675,11 @@ class TestPyramidRenderedMutator(unittest.TestCase):
     def test_assetmutator_url_rendered_pt(self):
         path = 'pyramid_assetmutator.tests:fixtures/test.json.pt'
         src_fullpath = get_abspath(path)
-        self.fingerprint = hexhashify(src_fullpath)
         template = '%s/fixtures/test_assetmutator_url_rendered.pt' % self.here
         self.config.add_view(route_name='home', view=home, renderer=template)
         self.app = TestApp(self.config.make_wsgi_app())
         resp = self.app.get('/')
+        self.fingerprint = self._fingerprint(src_fullpath)
         self.assertEqual(
             resp.text.strip(),
             'http://localhost/static/_test.%s.txt' % self.fingerprint
@@ -549,11 +2690,11 @@ class TestPyramidRenderedMutator(unittest.TestCase):
     def test_assetmutator_path_rendered_pt(self):
         path = 'pyramid_assetmutator.tests:fixtures/test.json.jinja2'
         src_fullpath = get_abspath(path)
-        self.fingerprint = hexhashify(src_fullpath)
         template = '%s/fixtures/test_assetmutator_path_rendered.pt' % self.here
         self.config.add_view(route_name='home', view=home, renderer=template)
         self.app = TestApp(self.config.make_wsgi_app())
         resp = self.app.get('/')
+        self.fingerprint = self._fingerprint(src_fullpath)
         self.assertEqual(resp.text.strip(),
                          '/static/_test.%s.txt' % self.fingerprint)
         resp = self.app.get(resp.text.strip())
@@ -566,23 +2707,23 @@ class TestPyramidRenderedMutator(unittest.TestCase):
 
         path = 'pyramid_assetmutator.tests:fixtures/test.json.pt'
         src_fullpath = get_abspath(path)
-        self.fingerprint = hexhashify(src_fullpath)
         template = ('%s/fixtures/test_assetmutator_source_rendered.pt' %
                     self.here)
         self.config.add_view(route_name='home', view=home, renderer=template)
         self.app = TestApp(self.config.make_wsgi_app())
         resp = self.app.get('/')
+        self.fingerprint = self._fingerprint(src_fullpath)
         resp.mustcontain('{"spam": "spam", "eggs": "鸡蛋"}')
 
     def test_assetmutator_url_rendered_jinja2(self):
         path = 'pyramid_assetmutator.tests:fixtures/test.json.jinja2'
         src_fullpath = get_abspath(path)
-        self.fingerprint = hexhashify(src_fullpath)
         template = ('%s/fixtures/test_assetmutator_url_rendered.jinja2' %
                     self.here)
         self.config.add_view(route_name='home', view=home, renderer=template)
         self.app = TestApp(self.config.make_wsgi_app())
         resp = self.app.get('/')
+        self.fingerprint = self._fingerprint(src_fullpath)
         self.assertEqual(
             resp.text.strip(),
             'http://localhost/static/_test.%s.txt' % self.fingerprint
@@ -593,12 +2734,12 @@ class TestPyramidRenderedMutator(unittest.TestCase):
     def test_assetmutator_path_rendered_jinja2(self):
         path = 'pyramid_assetmutator.tests:fixtures/test.json.pt'
         src_fullpath = get_abspath(path)
-        self.fingerprint = hexhashify(src_fullpath)
         template = ('%s/fixtures/test_assetmutator_path_rendered.jinja2' %
                     self.here)
         self.config.add_view(route_name='home', view=home, renderer=template)
         self.app = TestApp(self.config.make_wsgi_app())
         resp = self.app.get('/')
+        self.fingerprint = self._fingerprint(src_fullpath)
         self.assertEqual(resp.text.strip(),
                          '/static/_test.%s.txt' % self.fingerprint)
         resp = self.app.get(resp.text.strip())
@@ -611,12 +2752,12 @@ class TestPyramidRenderedMutator(unittest.TestCase):
 
         path = 'pyramid_assetmutator.tests:fixtures/test.json.jinja2'
         src_fullpath = get_abspath(path)
-        self.fingerprint = hexhashify(src_fullpath)
         template = ('%s/fixtures/test_assetmutator_source_rendered.jinja2' %
                     self.here)
         self.config.add_view(route_name='home', view=home, renderer=template)
         self.app = TestApp(self.config.make_wsgi_app())
         resp = self.app.get('/')
+        self.fingerprint = self._fingerprint(src_fullpath)
         resp.mustcontain('{"request_url": "http://localhost/?one=1"}')
 
     def test_assetmutator_url_rendered_pt_checksum_shouldnt_recreate(self):
@@ -627,34 +2768,157 @@ class TestPyramidRenderedMutator(unittest.TestCase):
         self.app = TestApp(self.config.make_wsgi_app())
         resp = self.app.get('/')
 
-        checksum = compute_md5('%s/fixtures/test.json.pt' % self.here)
-        rendered_filename = '%s/cache/_test.json' % (self.here)
+        checksum = self._fingerprint(
+            None, base=compute_md5('%s/fixtures/test.json.pt' % self.here)
+        )
         checksum_filename = '%s/cache/_test.%s.txt' % (self.here, checksum)
-        self.assertTrue(os.path.exists(rendered_filename))
-        self.assertTrue(os.path.exists(checksum_filename))
-
-        os.remove(rendered_filename)
+        inode = os.stat(checksum_filename).st_ino
 
         resp = self.app.get('/')
 
-        self.assertFalse(os.path.exists(rendered_filename))
+        # The output was not mutated again
+        self.assertEqual(os.stat(checksum_filename).st_ino, inode)
         os.remove(checksum_filename)
 
         self.config.registry.settings['assetmutator.remutate_check'] = 'exists'
         path = 'pyramid_assetmutator.tests:fixtures/test.json.pt'
         src_fullpath = get_abspath(path)
-        self.fingerprint = hexhashify(src_fullpath)
 
         resp = self.app.get('/')
+        self.fingerprint = self._fingerprint(src_fullpath)
+
+    def test_assetmutator_url_rendered_pt_context_changed(self):
+        path = 'pyramid_assetmutator.tests:fixtures/test.json.pt'
+        src_fullpath = get_abspath(path)
+        template = '%s/fixtures/test_assetmutator_url_rendered.pt' % self.here
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.config.add_view(route_name='home', view=home, renderer=template)
+        self.config.add_route('eggs', '/eggs')
+        self.config.add_view(route_name='eggs', renderer=template,
+                             view=lambda request: {'spam': 'eggs',
+                                                   'eggs': '鸡蛋'})
+        self.app = TestApp(self.config.make_wsgi_app())
+
+        eggs_url = self.app.get('/eggs').text.strip()
+        resp = self.app.get(eggs_url)
+        resp.mustcontain('{"spam": "eggs", "eggs": "鸡蛋"}')
+        eggs_filename = '%s/cache/%s' % (self.here, eggs_url.split('/')[-1])
+        self.assertTrue(os.path.exists(eggs_filename))
+        os.remove(eggs_filename)
+
+        # A different rendering context results in a new mutated output
+        url = self.app.get('/').text.strip()
+        self.fingerprint = self._fingerprint(src_fullpath)
+        self.assertNotEqual(url, eggs_url)
+        resp = self.app.get(url)
+        resp.mustcontain('{"spam": "spam", "eggs": "鸡蛋"}')
+
+    def test_rendered_concurrent_contexts(self):
+        import tempfile
+        import threading
+        tmpdir = tempfile.mkdtemp()
+        script = os.path.join(tmpdir, 'slowcat.py')
+        with open(script, 'w') as f:
+            f.write('import sys, time\n'
+                    'time.sleep(0.2)\n'
+                    'sys.stdout.write(open(sys.argv[1]).read())\n')
+        mutator = {'cmd': '%s %s' % (sys.executable, script), 'ext': 'txt'}
+        request = testing.DummyRequest()
+        path = get_abspath('pyramid_assetmutator.tests:fixtures/test.json.pt')
+        contexts = [home(request), {'spam': 'eggs', 'eggs': '鸡蛋'}]
+        mutants = [Mutator(request, path, mutator=mutator, rendering_val=val,
+                           registry=self.config.registry)
+                   for val in contexts]
+
+        try:
+            threads = [threading.Thread(target=mutant.mutate)
+                       for mutant in mutants]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # Each context was mutated from its own rendered source
+            with open(mutants[0].dest_fullpath, 'rb') as f:
+                self.assertTrue(b'"spam": "spam"' in f.read())
+            with open(mutants[1].dest_fullpath, 'rb') as f:
+                self.assertTrue(b'"spam": "eggs"' in f.read())
+            os.remove(mutants[1].dest_fullpath)
+            self.fingerprint = mutants[0].fingerprint
+        finally:
+            import shutil
+            shutil.rmtree(tmpdir)
+
+    def test_rendered_context_keys_cached(self):
+        from pyramid_assetmutator import mutators
+        from pyramid_assetmutator.mutator import rendered_digests
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        settings = self.config.registry.settings
+        settings['assetmutator.mutators'] = mutators
+        settings['assetmutator.template_context_keys'] = ['spam']
+        rendered_digests.clear()
+        request = testing.DummyRequest()
+        path = 'pyramid_assetmutator.tests:fixtures/test.json.pt'
+        src_fullpath = get_abspath(path)
+
+        mutant = Mutator(request, path, rendering_val=home(request))
+        mutant.mutate()
+        self.assertTrue(mutant.rendered_data is not None)
+        self.fingerprint = self._fingerprint(src_fullpath)
+        self.assertEqual(mutant.fingerprint, self.fingerprint)
+
+        # The same context values reuse the cached digest without rendering
+        mutant = Mutator(request, path, rendering_val=home(request))
+        self.assertTrue(mutant.rendered_data is None)
+        self.assertEqual(mutant.fingerprint, self.fingerprint)
+        self.assertFalse(mutant.should_mutate)
+
+        # ...while different values are rendered
+        mutant = Mutator(request, path, rendering_val={'spam': 'eggs',
+                                                       'eggs': '鸡蛋'})
+        self.assertTrue(mutant.rendered_data is not None)
+        self.assertNotEqual(mutant.fingerprint, self.fingerprint)
+        rendered_digests.clear()
+
+    def test_rendered_digest_cached(self):
+        from pyramid_assetmutator import mutators
+        self.config.assign_assetmutator('json', 'cat', 'txt')
+        self.config.registry.settings['assetmutator.mutators'] = mutators
+        request = testing.DummyRequest()
+        path = 'pyramid_assetmutator.tests:fixtures/test.json.pt'
+        renders = []
+        render_template = Mutator._render_template
+
+        def _render_template(mutant):
+            renders.append(mutant.path)
+            return render_template(mutant)
+
+        Mutator._render_template = _render_template
+        try:
+            for i in range(5):
+                mutant = Mutator(request, path, rendering_val=home(request))
+                mutant.mutate()
+
+            # Rendered once (for both the digest and the mutator)
+            self.assertEqual(len(renders), 1)
+            self.fingerprint = mutant.fingerprint
+
+            # Contexts which can't be serialized are rendered on each call
+            for i in range(2):
+                Mutator(request, path,
+                        rendering_val=dict(home(request), obj=object()))
+            self.assertEqual(len(renders), 3)
+        finally:
+            Mutator._render_template = render_template
 
     def test_assetmutator_url_rendered_pt_no_mutated_path(self):
         path = 'pyramid_assetmutator.tests:fixtures/test.json.pt'
         src_fullpath = get_abspath(path)
-        self.fingerprint = hexhashify(src_fullpath)
         template = '%s/fixtures/test_assetmutator_url_rendered.pt' % self.here
         self.config.add_view(route_name='home', view=home, renderer=template)
         self.app = TestApp(self.config.make_wsgi_app())
         resp = self.app.get('/')
+        self.fingerprint = self._fingerprint(src_fullpath)
 
         self.config.registry.settings['assetmutator.mutated_path'] = ''
 
@@ -1,7 +1,17 @@
 import os
+import re
+import time
+import shutil
 import hashlib
+import weakref
+import tempfile
+import threading
+from fnmatch import translate
 from pyramid.path import AssetResolver
-from pyramid_assetmutator.compat import string_types
+from pyramid.interfaces import IPackageOverrides
+from pyramid.threadlocal import get_current_registry
+from pyramid_assetmutator.compat import string_types, OrderedDict, get_ident, \
+                                        replace_file, fcntl
 
 def as_string(value):
     result = ''
@@ -22,32 +32,368 @@ def as_list(value):
         result.extend(subvalues)
     return result
 
+class LRUCache(object):
+    """
+    A minimal thread-safe mapping which holds at most ``maxsize`` entries,
+    evicting the least recently used entries first.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.data.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+_abspath_cache = LRUCache(maxsize=4096)
+
+def get_output_abspath(path):
+    """
+    Returns the absolute path of an output file (e.g. a report or database)
+    defined as an asset specification, or as an absolute path or a path
+    relative to the current working directory.
+    """
+    if ':' in path and not os.path.isabs(path):
+        return get_abspath(path)
+
+    return os.path.abspath(path)
+
 def get_abspath(path):
     """
     Convenience method to compute the absolute path from an assetpath.
+
+    Resolved paths are memoized. As the cache key includes the state of any
+    Pyramid asset overrides registered for the asset's package, registering a
+    new override automatically invalidates the affected entries.
     """
-    resolver = AssetResolver()
+    if os.path.isabs(path):
+        return path
+
+    overrides = None
+    if ':' in path:
+        overrides = get_current_registry().queryUtility(
+            IPackageOverrides, name=path.split(':', 1)[0]
+        )
+
+    if overrides is None:
+        key = path
+    else:
+        key = (path, overrides, len(getattr(overrides, 'overrides', ())))
+
+    abspath = _abspath_cache.get(key)
 
-    if not os.path.isabs(path):
+    if abspath is None:
         # Try to resolve the asset full path
-        path = resolver.resolve(path).abspath()
+        abspath = AssetResolver().resolve(path).abspath()
+        _abspath_cache.set(key, abspath)
 
-    return path
+    return abspath
+
+def clear_abspath_cache():
+    """
+    Clears the memoized :func:`get_abspath` results.
+    """
+    _abspath_cache.clear()
 
 def get_stat(path):
     """
     Convenience method for getting the size and mtime for the specified
     ``path``.
     """
-    statinfo = os.stat(path)
+    return format_stat(os.stat(path))
 
+def format_stat(statinfo):
+    """
+    Format the size and mtime of a :func:`os.stat` result the way
+    :func:`get_stat` does.
+    """
     return '%s.%s' % (statinfo.st_size, statinfo.st_mtime)
 
+def has_magic(pattern):
+    """
+    Return ``True`` if the passed ``pattern`` contains globbing characters.
+    """
+    return re.search(r'[*?[]', pattern) is not None
+
+def glob_to_regex(pattern, sep=os.sep):
+    """
+    Translate a glob ``pattern`` into a compiled regular expression. Unlike
+    :func:`fnmatch.translate`, wildcards never match the path separator, except
+    for ``**`` which matches any number of (nested) directories.
+    """
+    sep_re = re.escape(sep)
+    i, n = 0, len(pattern)
+    result = []
+
+    while i < n:
+        char = pattern[i]
+        i += 1
+
+        if char == '*':
+            if pattern[i:i+1] == '*':
+                i += 1
+                if pattern[i:i+1] == sep:
+                    i += 1
+                    result.append('(?:.*%s)?' % sep_re)
+                else:
+                    result.append('.*')
+            else:
+                result.append('[^%s]*' % sep_re)
+        elif char == '?':
+            result.append('[^%s]' % sep_re)
+        elif char == '[':
+            j = i
+            if pattern[j:j+1] == '!':
+                j += 1
+            if pattern[j:j+1] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+
+            if j >= n:
+                result.append('\\[')
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] == '^':
+                    stuff = '\\' + stuff
+                result.append('[%s]' % stuff)
+        else:
+            result.append(re.escape(char))
+
+    return re.compile('^%s$' % ''.join(result), re.S)
+
+class PatternMatcher(object):
+    """
+    Matches paths against a list of :mod:`fnmatch` style ``patterns`` (or exact
+    paths) using a single precompiled regular expression. Calling an instance
+    with a ``path`` returns ``True`` if any of the patterns match.
+    """
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self.exact = frozenset(self.patterns)
+        self.match_all = '*' in self.exact
+        self.regex = None
+
+        if self.patterns and not self.match_all:
+            self.regex = re.compile('|'.join(
+                '(?:%s)' % translate(os.path.normcase(pattern))
+                for pattern in self.patterns
+            ))
+
+    def __call__(self, path):
+        if self.match_all or path in self.exact:
+            return True
+        if self.regex is None:
+            return False
+        return self.regex.match(os.path.normcase(path)) is not None
+
+_pattern_matchers = {}
+
+def get_pattern_matcher(patterns):
+    """
+    Returns a (shared) :class:`PatternMatcher` for the passed list of
+    ``patterns``, compiling it only the first time the list is seen.
+    """
+    key = tuple(patterns or ())
+
+    try:
+        return _pattern_matchers[key]
+    except KeyError:
+        matcher = _pattern_matchers[key] = PatternMatcher(key)
+        return matcher
+
+class PathLock(object):
+    """
+    A (weakly referenceable) :class:`threading.Lock` for a single path.
+    """
+    __slots__ = ('lock', '__weakref__')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def acquire(self, blocking=True):
+        return self.lock.acquire(blocking)
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+# Locks are dropped as soon as no thread holds (or waits for) them anymore
+_path_locks = weakref.WeakValueDictionary()
+_path_locks_lock = threading.Lock()
+
+def get_path_lock(path):
+    """
+    Returns the (shared) :class:`PathLock` for ``path``, which is used to make
+    sure that only one thread at a time writes a given output file. Callers
+    must keep a reference to the lock for as long as they use it.
+    """
+    with _path_locks_lock:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _path_locks[path] = PathLock()
+        return lock
+
+class FileSemaphore(object):
+    """
+    A semaphore shared between processes, which allows at most ``value``
+    holders at once by taking an exclusive :func:`fcntl.flock` on one of
+    ``value`` slot files (named ``<path>.<slot>.lock``). The slots are
+    released automatically if a holding process dies, and the slot files are
+    left in place (removing one while another process is about to lock it
+    would break the limit).
+    """
+    # Seconds to wait before polling the slots again when all are taken
+    poll_interval = 0.05
+
+    def __init__(self, path, value):
+        if fcntl is None: # pragma: no cover
+            raise RuntimeError('File semaphores require fcntl.')
+
+        self.path = path
+        self.value = value
+
+    def acquire(self):
+        """
+        Blocks until a slot is free, and returns the (open) slot file which
+        must be passed to :meth:`release`.
+        """
+        while True:
+            for slot in range(self.value):
+                f = open('%s.%s.lock' % (self.path, slot), 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    f.close()
+                else:
+                    return f
+
+            time.sleep(self.poll_interval)
+
+    def release(self, f):
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+class ConcurrencyLimit(object):
+    """
+    Context manager which allows at most ``value`` threads at once to enter
+    it, and, if ``interprocess`` is set, at most ``value`` threads across all
+    of the processes on the host which use a limit of the same ``name``.
+
+    Interprocess limits use the ``assetmutator-<digest of name>.<slot>.lock``
+    files of a :class:`FileSemaphore` in ``lock_dir`` (defaults to the
+    temporary directory, see :func:`tempfile.gettempdir`).
+    """
+    def __init__(self, name, value, interprocess=False, lock_dir=None):
+        self.name = name
+        self.value = value
+        self.semaphore = threading.BoundedSemaphore(value)
+        self.file_semaphore = None
+        self.local = threading.local()
+
+        if interprocess:
+            digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:12]
+            self.file_semaphore = FileSemaphore(
+                os.path.join(lock_dir or tempfile.gettempdir(),
+                             'assetmutator-%s' % digest),
+                value
+            )
+
+    def __enter__(self):
+        self.semaphore.acquire()
+
+        if self.file_semaphore is not None:
+            try:
+                self.local.slot = self.file_semaphore.acquire()
+            except:
+                self.semaphore.release()
+                raise
+
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.file_semaphore is not None:
+            self.file_semaphore.release(self.local.slot)
+            self.local.slot = None
+
+        self.semaphore.release()
+
+_concurrency_limits = {}
+
+def get_concurrency_limit(name, value, interprocess=False):
+    """
+    Returns the (shared) :class:`ConcurrencyLimit` allowing ``value``
+    concurrent holders for ``name`` (e.g. a mutator command).
+    """
+    key = (name, value, interprocess)
+
+    with _path_locks_lock:
+        try:
+            return _concurrency_limits[key]
+        except KeyError:
+            limit = _concurrency_limits[key] = ConcurrencyLimit(
+                name, value, interprocess=interprocess
+            )
+            return limit
+
+def get_cpu_count():
+    """
+    Returns the number of CPUs (or ``2`` if it cannot be determined).
+    """
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError): # pragma: no cover
+        return 2
+
+def get_temp_path(path):
+    """
+    Return a temporary filename (unique to the current process and thread) in
+    the same directory as ``path``, which can be atomically renamed to
+    ``path`` once it has been completely written.
+    """
+    return '%s.%s-%s.tmp' % (path, os.getpid(), get_ident())
+
 def hexhashify(string):
     """
-    Return a :func:`hex` value of the :func:`hash` of the passed ``string``.
+    Return a short hexadecimal hash (e.g. ``0x1f3a...``) of the passed
+    ``string``. Unlike :func:`hash`, which is randomized per process, the value
+    is stable across processes and restarts.
     """
-    return hex(hash(string))
+    return '0x%s' % hashlib.md5(string.encode('utf-8')).hexdigest()[:16]
 
 def compute_md5(path):
     """
@@ -63,3 +409,63 @@ def compute_md5(path):
 
     # The first 12 characters of the hexdigest should be plenty
     return md5.hexdigest()[:12]
+
+
+# The directory (in the mutated_path) holding the content-addressed outputs
+CAS_DIRNAME = '.cas'
+
+def link_file(src, dest):
+    """
+    Atomically replaces ``dest`` with a hardlink to ``src``, falling back to a
+    (relative) symlink, and then to a copy, if the filesystem does not support
+    hardlinks.
+    """
+    tmp_fullpath = get_temp_path(dest)
+
+    try:
+        os.link(src, tmp_fullpath)
+    except (OSError, AttributeError):
+        try:
+            os.symlink(os.path.relpath(src, os.path.dirname(dest)),
+                       tmp_fullpath)
+        except (OSError, AttributeError, NotImplementedError):
+            shutil.copyfile(src, tmp_fullpath)
+
+    replace_file(tmp_fullpath, dest)
+
+def store_content(root, path, digest):
+    """
+    Moves the file ``path`` into the content-addressed store below ``root``
+    (as ``.cas/<digest[:2]>/<digest><ext>``), unless identical content is
+    already stored, and replaces ``path`` with a link to the stored file.
+    Returns the path of the stored file.
+    """
+    ext = os.path.splitext(path)[-1]
+    cas_dirpath = os.path.join(root, CAS_DIRNAME, digest[:2])
+    cas_fullpath = os.path.join(cas_dirpath, digest + ext)
+
+    if not os.path.isdir(cas_dirpath):
+        try:
+            os.makedirs(cas_dirpath)
+        except OSError:
+            if not os.path.isdir(cas_dirpath):
+                raise
+
+    if not os.path.exists(cas_fullpath):
+        replace_file(path, cas_fullpath)
+
+    link_file(cas_fullpath, path)
+
+    return cas_fullpath
+
+def compute_sha1(path):
+    """
+    Returns the (full) SHA-1 hexdigest of the contents of ``path``.
+    """
+    sha1 = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(128*sha1.block_size), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
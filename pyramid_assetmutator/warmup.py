@@ -0,0 +1,205 @@
+import json
+import logging
+import threading
+from collections import deque
+from pyramid.response import Response
+from pyramid.threadlocal import manager
+from pyramid_assetmutator.mutator import Mutator
+from pyramid_assetmutator.scheduler import REQUEST, BATCH
+from pyramid_assetmutator.utils import get_cpu_count
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class _Job(object):
+    def __init__(self, path, mutator):
+        self.path = path
+        self.mutator = mutator
+        self.state = QUEUED
+        self.done = threading.Event()
+
+
+class Warmup(object):
+    """
+    Mutates the ``each_boot`` assets in a pool of background threads, so that
+    the application can start serving requests right away.
+
+    ``assets`` is a list of ``(fullpath, mutator)`` tuples (where ``mutator``
+    may be ``None`` to use the mutator matching the source extension). The
+    pool uses at most ``workers`` threads (defaults to the number of CPUs),
+    and ``callback`` (if any) is called with the warmup once all of the assets
+    have been processed.
+
+    A request which needs an asset that is still pending calls :meth:`wait`,
+    which mutates the asset right away (in the calling thread) if no worker
+    has picked it up yet (with the priority of a request in the compile
+    scheduler), or waits for the worker which is mutating it.
+    """
+    def __init__(self, request, registry, assets, workers=None, callback=None,
+                 **kw):
+        self.request = request
+        self.registry = registry
+        self.workers = workers or get_cpu_count()
+        self.callback = callback
+        self.kw = kw
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.queue = deque()
+        self.threads = []
+
+        for path, mutator in assets:
+            if path not in self.jobs:
+                job = self.jobs[path] = _Job(path, mutator)
+                self.queue.append(job)
+
+        self.remaining = len(self.jobs)
+        self.finished = threading.Event()
+        if not self.remaining:
+            self.finished.set()
+
+    @property
+    def ready(self):
+        """
+        ``True`` once all of the assets have been processed.
+        """
+        return self.finished.is_set()
+
+    def progress(self):
+        """
+        Returns a dictionary with the number of ``total``, ``done``, ``failed``
+        and ``pending`` assets, and whether the warmup is ``ready``.
+        """
+        with self.lock:
+            states = [job.state for job in self.jobs.values()]
+
+        done = states.count(DONE)
+        failed = states.count(FAILED)
+
+        return {'ready': self.ready, 'total': len(states), 'done': done,
+                'failed': failed, 'pending': len(states) - done - failed}
+
+    def start(self):
+        """
+        Starts the background threads.
+        """
+        if not self.remaining:
+            self._finish()
+
+        for i in range(min(self.workers, len(self.queue))):
+            thread = threading.Thread(target=self._work,
+                                      name='assetmutator-warmup-%s' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def join(self, timeout=None):
+        """
+        Waits until all of the assets have been processed (or ``timeout``
+        seconds have passed). Returns :attr:`ready`.
+        """
+        self.finished.wait(timeout)
+        return self.ready
+
+    def _next(self):
+        with self.lock:
+            while self.queue:
+                job = self.queue.popleft()
+                if job.state == QUEUED:
+                    job.state = RUNNING
+                    return job
+
+        return None
+
+    def _work(self):
+        manager.push({'registry': self.registry, 'request': self.request})
+
+        try:
+            job = self._next()
+            while job is not None:
+                self._run(job)
+                job = self._next()
+        finally:
+            manager.pop()
+
+    def _run(self, job, priority=BATCH):
+        try:
+            mutant = Mutator(self.request, job.path, registry=self.registry,
+                             batch=True, mutator=job.mutator,
+                             priority=priority, **self.kw)
+            mutant.mutate()
+            state = DONE
+        except Exception:
+            logger.exception('Unable to mutate "%s".' % job.path)
+            state = FAILED
+
+        with self.lock:
+            job.state = state
+            self.remaining -= 1
+            last = not self.remaining
+
+        job.done.set()
+
+        if last:
+            self._finish()
+
+    def _finish(self):
+        if self.callback is not None:
+            try:
+                self.callback(self)
+            except Exception:
+                logger.exception('The warmup callback failed.')
+
+        self.finished.set()
+
+    def is_pending(self, path):
+        """
+        Returns ``True`` if the asset ``path`` (a full path) has not been
+        processed yet, without waiting for it.
+        """
+        with self.lock:
+            job = self.jobs.get(path)
+            return job is not None and job.state in (QUEUED, RUNNING)
+
+    def wait(self, path):
+        """
+        Makes sure that the pending asset ``path`` (a full path) has been
+        processed, mutating it in the calling thread if no worker has picked
+        it up yet.
+        """
+        with self.lock:
+            job = self.jobs.get(path)
+            if job is None or job.state in (DONE, FAILED):
+                return
+
+            owner = job.state == QUEUED
+            if owner:
+                job.state = RUNNING
+
+        if owner:
+            self._run(job, priority=REQUEST)
+        else:
+            job.done.wait()
+
+
+def health_view(request):
+    """
+    A Pyramid view which reports the progress of the background ``each_boot``
+    warmup as JSON, responding with a ``503`` status until it is ready.
+    """
+    warmup = request.registry.settings.get('assetmutator.warmup')
+
+    if warmup is None:
+        progress = {'ready': True, 'total': 0, 'done': 0, 'failed': 0,
+                    'pending': 0}
+    else:
+        progress = warmup.progress()
+
+    return Response(json.dumps(progress, sort_keys=True),
+                    status=200 if progress['ready'] else 503,
+                    content_type='application/json', charset='utf-8')